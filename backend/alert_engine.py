@@ -0,0 +1,117 @@
+# alert_engine.py
+import bisect
+import threading
+import time
+
+
+class _DeviceAlertState:
+    __slots__ = ("alerted", "shutdown_sent", "last_shutdown")
+
+    def __init__(self):
+        self.alerted = {}          # sid -> threshold đã cảnh báo trong lần vượt ngưỡng hiện tại
+        self.shutdown_sent = False
+        self.last_shutdown = None
+
+
+class AlertEngine:
+    """
+    Ngưỡng dòng điện (A) của các client, giữ trong list đã sort theo ngưỡng.
+
+    - Phát hiện vượt ngưỡng: 1 phép so sánh với ngưỡng nhỏ nhất, sau đó bisect
+      để lấy đúng các client bị ảnh hưởng.
+    - Trạng thái theo thiết bị: mỗi client chỉ nhận 1 cảnh báo cho mỗi lần vượt
+      ngưỡng; chỉ re-arm khi dòng giảm xuống dưới threshold * (1 - hysteresis).
+    - Mỗi lần vượt ngưỡng chỉ gửi 1 lệnh tắt; nếu lệnh tắt thất bại thì thử lại
+      sau cooldown giây.
+    """
+
+    def __init__(self, hysteresis=0.1, cooldown=60.0):
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._sorted = []    # [(threshold, sid)]
+        self._by_sid = {}    # sid -> threshold
+        self._devices = {}   # device_id -> _DeviceAlertState
+
+    def set_threshold(self, sid, threshold):
+        with self._lock:
+            self._remove_locked(sid)
+            bisect.insort(self._sorted, (threshold, sid))
+            self._by_sid[sid] = threshold
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._remove_locked(sid)
+            for state in self._devices.values():
+                state.alerted.pop(sid, None)
+
+    def _remove_locked(self, sid):
+        old = self._by_sid.pop(sid, None)
+        if old is not None:
+            idx = bisect.bisect_left(self._sorted, (old, sid))
+            if idx < len(self._sorted) and self._sorted[idx] == (old, sid):
+                del self._sorted[idx]
+
+    def replace_thresholds(self, thresholds):
+        """Thay toàn bộ ngưỡng (đồng bộ từ shared state khi chạy nhiều worker)."""
+        with self._lock:
+            self._by_sid = dict(thresholds)
+            self._sorted = sorted((threshold, sid) for sid, threshold in self._by_sid.items())
+            for state in self._devices.values():
+                for sid in [sid for sid in state.alerted if sid not in self._by_sid]:
+                    del state.alerted[sid]
+
+    def thresholds(self):
+        with self._lock:
+            return dict(self._by_sid)
+
+    def evaluate(self, device_id, current, now=None):
+        """
+        Trả về (alerts, shutdown):
+        - alerts: list (sid, threshold) cần gửi cảnh báo mới
+        - shutdown: True nếu cần gửi lệnh OFF cho thiết bị
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._devices.get(device_id)
+
+            # Re-arm các client mà dòng đã giảm đủ sâu (hoặc đã đổi/xóa ngưỡng)
+            if state is not None and state.alerted:
+                for sid, threshold in list(state.alerted.items()):
+                    if current < threshold * (1 - self.hysteresis) or self._by_sid.get(sid) != threshold:
+                        del state.alerted[sid]
+                if not state.alerted:
+                    state.shutdown_sent = False
+
+            # Fast path: không vượt ngưỡng nhỏ nhất -> không client nào bị ảnh hưởng
+            if not self._sorted or current <= self._sorted[0][0]:
+                return [], False
+
+            if state is None:
+                state = self._devices[device_id] = _DeviceAlertState()
+
+            # Các ngưỡng < current nằm trước vị trí bisect
+            idx = bisect.bisect_left(self._sorted, (current,))
+            alerts = []
+            for threshold, sid in self._sorted[:idx]:
+                if sid not in state.alerted:
+                    state.alerted[sid] = threshold
+                    alerts.append((sid, threshold))
+
+            shutdown = False
+            if state.alerted and not state.shutdown_sent:
+                if state.last_shutdown is None or now - state.last_shutdown >= self.cooldown:
+                    state.shutdown_sent = True
+                    state.last_shutdown = now
+                    shutdown = True
+
+            return alerts, shutdown
+
+    def report_shutdown(self, device_id, success):
+        """Lệnh OFF thất bại -> cho phép thử lại sau cooldown trong cùng lần vượt ngưỡng."""
+        if success:
+            return
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is not None:
+                state.shutdown_sent = False
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import requests
@@ -12,24 +12,58 @@ import time
 import threading
 import random
 import hashlib
+import atexit
+import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from ingest_pipeline import Stage, IngestPipeline
+from alert_engine import AlertEngine
+from dashboard_broadcaster import DashboardBroadcaster
+from device_registry import DeviceRegistry, device_list_item
+from response_cache import VersionedSnapshot, EncodedBody, make_cached_response, encode_json, wants_columnar
+from hourly_series import HourlySeries, BUCKETS, to_key, to_columns
+from forecast_jobs import ForecastJobManager, ForecastPrecomputer
+from shared_state import create_shared_state, SharedStatePublisher
+from log_setup import setup_logging
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiling import Profiler, PROFILE_MAX_SECONDS, PROFILE_MAX_CALLS
+from startup import StartupTimer
 
 # === Forecast & DB Integration ===
 try:
     from websocket_forecast import forecast_client
-    from database import save_hourly_kwh
+    from database import save_hourly_kwh, save_forecast_result, get_forecast_history, get_history_range, iter_history
+    from forecast_store import ForecastStore
+    from baseline_forecast import baseline_forecast
     FORECAST_ENABLED = True
 except ImportError:
     print("WARNING: websocket_forecast.py or database.py not found. Running without forecast.")
     FORECAST_ENABLED = False
 
-app = Flask(__name__)
-CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-
 # Load environment variables
 load_dotenv()
 
+# Deployment mode:
+#   all    -> 1 process làm mọi việc (mặc định, state nằm trong biến module)
+#   ingest -> chỉ 1 process: CoreIoT polling/WebSocket + pipeline, ghi state vào shared store
+#   api    -> N process phục vụ HTTP/Socket.IO, đọc state từ shared store
+# ingest/api cần SHARED_STATE_URL (redis://... hoặc sqlite:///...) và
+# SOCKETIO_MESSAGE_QUEUE (vd: redis://...) để emit từ process này tới client ở process khác.
+APP_ROLE = os.getenv("APP_ROLE", "all")
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL")
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+PORT = int(os.getenv("PORT", "5000"))
+
+if APP_ROLE not in ("all", "ingest", "api"):
+    raise ValueError("APP_ROLE must be one of: all, ingest, api")
+if APP_ROLE != "all" and not (SHARED_STATE_URL and SOCKETIO_MESSAGE_QUEUE):
+    raise ValueError("APP_ROLE=ingest/api requires SHARED_STATE_URL and SOCKETIO_MESSAGE_QUEUE")
+
+app = Flask(__name__)
+CORS(app)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', message_queue=SOCKETIO_MESSAGE_QUEUE)
+shared_state = create_shared_state(SHARED_STATE_URL)
+
 # Core IoT Info
 CORE_IOT_URL = "https://app.coreiot.io"
 JWT_TOKEN = os.getenv("JWT_TOKEN")
@@ -37,21 +71,56 @@ DEVICE_ID = os.getenv("DEVICE_ID")
 GROUP_ID = os.getenv("GROUP_ID")
 HEADERS = {"Authorization": f"Bearer {JWT_TOKEN}"}
 
+# RPC fan-out config
+RPC_MAX_WORKERS = int(os.getenv("RPC_MAX_WORKERS", "16"))
+GROUP_CONTROL_DEADLINE = float(os.getenv("GROUP_CONTROL_DEADLINE", "20"))
+
+# Ingest pipeline config
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_ALERT_WORKERS = int(os.getenv("INGEST_ALERT_WORKERS", "2"))
+
+# Alert config: re-arm khi dòng giảm dưới threshold * (1 - hysteresis); thử tắt lại sau cooldown (s)
+ALERT_HYSTERESIS = float(os.getenv("ALERT_HYSTERESIS", "0.1"))
+ALERT_SHUTDOWN_COOLDOWN = float(os.getenv("ALERT_SHUTDOWN_COOLDOWN", "60"))
+
+# Dashboard broadcast: gom update trong cửa sổ (ms) rồi emit 1 lần
+DASHBOARD_BROADCAST_WINDOW_MS = int(os.getenv("DASHBOARD_BROADCAST_WINDOW_MS", "250"))
+
+# Kết quả verify_token được dùng lại trong khoảng này (s) cho các API đọc
+TOKEN_CHECK_TTL = float(os.getenv("TOKEN_CHECK_TTL", "60"))
+
 # Check environment variables
 if not all([JWT_TOKEN, DEVICE_ID, GROUP_ID]):
     raise ValueError("JWT_TOKEN, DEVICE_ID and GROUP_ID must be set in .env file")
 
 # Logs directory
 log_dir = "logs"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Logging config
-logging.basicConfig(
-    filename=os.path.join(log_dir, 'telemetry.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+
+# Logging config: ghi file ở thread riêng qua queue, xoay vòng theo dung lượng,
+# các category telemetry/activity/clients bị giới hạn LOG_SAMPLE_RATE dòng/giây (WARNING+ luôn giữ)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "5"))
+
+# Profiling theo yêu cầu (POST /admin/profile): tắt (404) nếu không đặt ADMIN_TOKEN, cần header X-Admin-Token
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+log_listener, log_queue_handler = setup_logging(
+    log_dir, 'telemetry.log', max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+    queue_size=LOG_QUEUE_SIZE, sampled_categories=("telemetry", "activity", "clients"), sample_rate=LOG_SAMPLE_RATE
 )
+atexit.register(log_listener.stop)
+
+profiler = Profiler(PROFILE_DIR)
+
+# Thời gian khởi động (process_startup_seconds{phase}, /health): hydrated, first_request
+startup = StartupTimer(REGISTRY)
+
+telemetry_logger = logging.getLogger("telemetry")
+activity_logger = logging.getLogger("activity")
+client_logger = logging.getLogger("clients")
 
 # Telemetry keys
 TELEMETRY_KEYS = ["ENERGY-Voltage", "ENERGY-Current", "ENERGY-Power", "ENERGY-Today",
@@ -68,23 +137,113 @@ DEVICE_NAME_MAP = {
     "camera": "Camera"
 }
 
-# Store latest data
-latest_data = {}
+# === METRICS (GET /metrics, Prometheus text format) ===
+COREIOT_HTTP_REQUESTS = REGISTRY.counter("coreiot_http_requests_total", "HTTP requests to CoreIoT", ("endpoint", "status"))
+COREIOT_HTTP_SECONDS = REGISTRY.histogram("coreiot_http_request_seconds", "CoreIoT HTTP request latency", ("endpoint",))
+WS_FRAMES = REGISTRY.counter("coreiot_ws_frames_total", "WebSocket frames received from CoreIoT")
+FRAME_TO_EMIT_SECONDS = REGISTRY.histogram("ingest_frame_to_emit_seconds",
+                                           "Time from WebSocket frame received to dashboard emit")
+SAVE_HOURLY_SECONDS = REGISTRY.histogram("save_hourly_kwh_seconds", "save_hourly_kwh duration")
+FORECAST_RTT_SECONDS = REGISTRY.histogram("forecast_request_seconds", "Round-trip time to the forecast server",
+                                          ("outcome",), buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60))
+FORECAST_DEGRADED = REGISTRY.counter("forecast_degraded_total",
+                                     "GET /forecast answered with the baseline model", ("reason",))
+FORECAST_PRECOMPUTE = REGISTRY.counter("forecast_precompute_total",
+                                       "Background forecast runs after an hour is committed, by outcome", ("outcome",))
+RPC_REQUESTS = REGISTRY.counter("rpc_requests_total", "RPC commands sent to devices by outcome", ("command", "outcome"))
+SOCKETIO_CLIENTS = REGISTRY.gauge("socketio_connected_clients", "Connected Socket.IO clients")
+RPC_PENDING = REGISTRY.gauge("rpc_executor_queue_depth", "RPC commands submitted to the worker pool and not finished yet")
+
+# CoreIoT dùng UUID cho device/group id -> gom về 1 nhãn endpoint
+_COREIOT_ID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+class InstrumentedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter đếm request và đo độ trễ theo endpoint (kể cả request lỗi/timeout)."""
+
+    def send(self, request, **kwargs):
+        endpoint = _COREIOT_ID_RE.sub("{id}", request.path_url.split("?", 1)[0])
+        status = "error"
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            COREIOT_HTTP_SECONDS.observe(time.perf_counter() - start, endpoint)
+            COREIOT_HTTP_REQUESTS.inc(endpoint, status)
+
+# HTTP session dùng chung (connection pooling) cho mọi request tới CoreIoT
+http_session = requests.Session()
+http_session.mount("https://", InstrumentedHTTPAdapter(pool_connections=4, pool_maxsize=RPC_MAX_WORKERS))
+
+# Worker pool giới hạn cho các lệnh RPC gửi song song
+rpc_executor = ThreadPoolExecutor(max_workers=RPC_MAX_WORKERS, thread_name_prefix="rpc")
+
+def submit_rpc(fn, *args, **kwargs):
+    """rpc_executor.submit + đếm số lệnh đang chờ/chạy (RPC_PENDING giảm khi future xong)."""
+    future = rpc_executor.submit(fn, *args, **kwargs)
+    RPC_PENDING.inc()
+    future.add_done_callback(lambda _: RPC_PENDING.dec())
+    return future
+
+# Store latest data (telemetry đã parse sang float, xem device_registry.py)
+device_registry = DeviceRegistry(TELEMETRY_KEYS)
 subscription_to_device_map = {}
 
+def build_device_list():
+    """Danh sách thiết bị theo shape của /check-data và join_dashboard: device_registry (process ingest) hoặc shared store (APP_ROLE=api)."""
+    if APP_ROLE == "api":
+        return [device_list_item(device_id, info) for device_id, info in shared_state.get_map("devices").items()]
+    return device_registry.device_list()
+
+# Snapshot đã encode sẵn của device_registry; mọi chỗ ghi vào device_registry phải gọi mark_device_changed(device_id)
+if APP_ROLE == "api":
+    device_snapshot = VersionedSnapshot(
+        lambda: {"status": "success", "data": build_device_list()},
+        version_source=lambda: shared_state.version("devices")
+    )
+else:
+    # Chỉ encode lại JSON của các thiết bị đã đổi từ snapshot trước
+    device_snapshot = VersionedSnapshot(
+        lambda: {"status": "success", "data": device_registry.device_list()},
+        encode=lambda snapshot: b'{"status":"success","data":' + device_registry.encode_device_list(snapshot["data"]) + b'}'
+    )
+
+# Ingest ghi gộp các thiết bị thay đổi vào shared store (chỉ khi chạy nhiều process)
+state_publisher = None
+if shared_state is not None and APP_ROLE != "api":
+    state_publisher = SharedStatePublisher(
+        shared_state,
+        device_registry.entry
+    )
+
+def mark_device_changed(device_id):
+    """Gọi sau mỗi lần ghi vào device_registry (thiết bị device_id)."""
+    device_snapshot.bump()
+    if state_publisher is not None:
+        state_publisher.mark_dirty(device_id)
+
 # Cache metadata đã gán
 DEVICE_METADATA_CACHE = {}
 
-# Store alert thresholds for each client
-client_thresholds = {}
+# Store alert thresholds for each client (sorted index + per-device alert state)
+alert_engine = AlertEngine(hysteresis=ALERT_HYSTERESIS, cooldown=ALERT_SHUTDOWN_COOLDOWN)
 
 # === GLOBAL VARIABLES FOR FORECAST ===
 if FORECAST_ENABLED:
     previous_energy = {}
-    hourly_kwh_global = {}
+    hourly_kwh_global = HourlySeries()
     predicted_details_cache = {}
     lock = threading.Lock()
 
+    # Kết quả forecast mới nhất (RAM) + lịch sử trong SQLite; APP_ROLE=ingest/api: dùng chung qua shared state
+    # (ingest precompute sau mỗi giờ đóng, các worker api đọc kết quả đã publish)
+    forecast_store = ForecastStore(save_history=save_forecast_result, load_history=get_forecast_history,
+                                   shared_state=shared_state if APP_ROLE != "all" else None)
+
+    # Feedback gửi AI Server ngoài `lock`: send_feedback có thể phải đợi 1 lần predict (tới 30s)
+    feedback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-feedback")
+
     def process_new_energy(device_id, total_energy_str, ts_iso):
         """Calculate hourly kWh from ENERGY-Total and save to DB"""
         global hourly_kwh_global, previous_energy
@@ -93,7 +252,12 @@ if FORECAST_ENABLED:
             ts = datetime.fromisoformat(ts_iso.replace("Z", "+00:00")).replace(tzinfo=None)
         except:
             return
+        record_energy(device_id, total_energy, ts)
 
+    def record_energy(device_id, total_energy, ts):
+        """process_new_energy với ENERGY-Total đã parse (float) và ts (datetime naive), dùng cho ingest."""
+        global hourly_kwh_global, previous_energy
+        feedback = None
         with lock:
             key = ts.strftime("%Y-%m-%dT%H:00:00")
             prev = previous_energy.get(device_id)
@@ -106,18 +270,26 @@ if FORECAST_ENABLED:
                         delta = total_energy
 
                     hourly_kwh_global[key] = hourly_kwh_global.get(key, 0.0) + round(delta, 4)
-                    save_hourly_kwh(key, hourly_kwh_global[key])
+                    with SAVE_HOURLY_SECONDS.time():
+                        save_hourly_kwh(key, hourly_kwh_global[key])
+                    if shared_state is not None:
+                        shared_state.bump("hourly")
+                    if forecast_precomputer is not None:
+                        forecast_precomputer.trigger()
 
                     # Feedback logic
-                    if key in predicted_details_cache:
-                        forecast_client.send_feedback(
-                            {key: predicted_details_cache[key]},
-                            {key: hourly_kwh_global[key]}
-                        )
-                        del predicted_details_cache[key]
+                    if shared_state is not None:
+                        predicted = shared_state.pop_map_field("predicted_details", key)
+                    else:
+                        predicted = predicted_details_cache.pop(key, None)
+                    if predicted is not None:
+                        feedback = ({key: predicted}, {key: hourly_kwh_global[key]})
 
             previous_energy[device_id] = (ts, total_energy)
 
+        if feedback is not None:
+            feedback_executor.submit(forecast_client.send_feedback, *feedback)
+
     def generate_realistic_kwh(hour):
         """Generate realistic kWh based on time of day."""
         if 0 <= hour < 6:
@@ -134,8 +306,38 @@ if FORECAST_ENABLED:
         noise_factor = random.uniform(0.8, 1.2)
         return round(base * noise_factor, 4)
 
+    hourly_synced_version = [None]
+
+    def refresh_hourly_series():
+        """
+        APP_ROLE=api: khi process ingest đã lưu giờ mới, chỉ đọc các dòng từ giờ mới nhất đã nạp
+        (giờ đó có thể vừa được cộng thêm) và merge vào hourly_kwh_global; lần đầu đọc toàn bộ.
+        """
+        if APP_ROLE != "api":
+            return
+        version = shared_state.version("hourly")
+        if version == hourly_synced_version[0]:
+            return
+        with lock:
+            newest = hourly_kwh_global.tail(1)
+        rows = get_history_range(newest[0][0] if newest else None)
+        with lock:
+            for key, kwh in rows.items():
+                if hourly_kwh_global.get(key) != kwh:
+                    hourly_kwh_global[key] = kwh
+            hourly_synced_version[0] = version
+
+    def hydrate_hourly_series():
+        """Khởi động: nạp hourly_kwh từ SQLite vào RAM, stream theo batch đã sort (không fetchall rồi sort lại)."""
+        with lock:
+            hourly_kwh_global.load(iter_history(), presorted=True)
+            hours = len(hourly_kwh_global)
+        startup.mark("hydrated")
+        logging.info(f"Loaded {hours} hours of history from SQLite")
+        return hours
+
     def init_dummy_data():
-        """Run ONCE at startup to populate data (For testing)"""
+        """Run ONCE at startup to populate data (For testing), chỉ khi SQLite chưa có lịch sử"""
         logging.info("!!! SYSTEM STARTUP: Generating REALISTIC dummy data...")
         with lock:
             dummy_now = datetime.now()
@@ -181,26 +383,45 @@ def get_or_assign_metadata(device_id):
     
     return metadata
 
+def get_device_state(device_id):
+    """DeviceState của device_id, thêm vào device_registry (kèm metadata) nếu chưa có."""
+    device = device_registry.get(device_id)
+    if device is None:
+        device = device_registry.add(device_id, get_or_assign_metadata(device_id))
+        mark_device_changed(device_id)
+    return device
+
+token_state = {"valid": False, "checked_at": None}
+
 def verify_token():
     """Verify JWT token validity."""
     try:
-        response = requests.get(
+        response = http_session.get(
             f"{CORE_IOT_URL}/api/auth/user",
             headers=HEADERS,
             timeout=10
         )
         response.raise_for_status()
         logging.info("JWT_TOKEN is valid")
-        return True
+        valid = True
     except requests.RequestException as e:
         logging.error(f"Invalid JWT_TOKEN: {e}, Status Code: {getattr(e.response, 'status_code', 'N/A')}")
-        return False
+        valid = False
+    token_state["valid"], token_state["checked_at"] = valid, time.monotonic()
+    return valid
+
+def verify_token_cached(max_age=TOKEN_CHECK_TTL):
+    """Dùng lại kết quả verify_token gần nhất (periodic logger gọi mỗi 10s) nếu còn mới."""
+    checked_at = token_state["checked_at"]
+    if checked_at is not None and time.monotonic() - checked_at < max_age:
+        return token_state["valid"]
+    return verify_token()
 
 def get_devices_from_group():
     """Get all devices from group with fallback."""
     try:
         url = f"{CORE_IOT_URL}/api/tenant/devices?pageSize=100&page=0&groupId={GROUP_ID}"
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        response = http_session.get(url, headers=HEADERS, timeout=15)
         response.raise_for_status()
         devices_data = response.json().get("data", [])
         
@@ -222,7 +443,7 @@ def get_devices_from_group():
         
         # Fallback: Get all tenant devices
         try:
-            response = requests.get(
+            response = http_session.get(
                 f"{CORE_IOT_URL}/api/tenant/devices?pageSize=100&page=0",
                 headers=HEADERS, timeout=15
             )
@@ -239,27 +460,27 @@ def get_devices_from_group():
 def get_device_telemetry(device_id):
     """Fetch device telemetry data."""
     try:
-        response = requests.get(
+        response = http_session.get(
             f"{CORE_IOT_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys={','.join(TELEMETRY_KEYS)}&limit=1",
             headers=HEADERS,
             timeout=15
         )
         response.raise_for_status()
         telemetry = response.json()
+        device = get_device_state(device_id)
         
-        if device_id not in latest_data:
-            metadata = get_or_assign_metadata(device_id)
-            latest_data[device_id] = {"telemetry": {}, "attributes": {"POWER": "N/A"}, "metadata": metadata}
-        
-        parsed_telemetry = {}
+        # REST trả {key: [{"ts", "value"}]} -> cùng dạng frame WebSocket {key: [[ts, value]]}
+        samples = {}
         for key, value_list in telemetry.items():
             if value_list and isinstance(value_list, list) and value_list[0] and 'value' in value_list[0]:
-                parsed_telemetry[key] = value_list[0]['value']
+                samples[key] = [[value_list[0].get('ts'), value_list[0]['value']]]
             else:
-                parsed_telemetry[key] = "N/A"
+                samples[key] = [[None, "N/A"]]
         
-        latest_data[device_id]["telemetry"].update(parsed_telemetry)
-        logging.info(f"Telemetry received for device {device_id}: {parsed_telemetry}")
+        parsed_telemetry, changed = device_registry.update(device, samples)
+        if changed:
+            mark_device_changed(device_id)
+        telemetry_logger.info("Telemetry received for device %s: %s", device_id, parsed_telemetry)
         return telemetry
         
     except requests.RequestException as e:
@@ -272,7 +493,7 @@ def get_device_telemetry(device_id):
 def get_device_attributes(device_id):
     """Fetch device attributes (POWER state)."""
     try:
-        response = requests.get(
+        response = http_session.get(
             f"{CORE_IOT_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/attributes/CLIENT_SCOPE",
             headers=HEADERS,
             timeout=15
@@ -280,13 +501,11 @@ def get_device_attributes(device_id):
         response.raise_for_status()
         attributes = response.json()
         power_attr = next((attr for attr in attributes if attr["key"] == "POWER"), {"value": "N/A"})
-        
-        if device_id not in latest_data:
-            metadata = get_or_assign_metadata(device_id)
-            latest_data[device_id] = {"telemetry": {}, "attributes": {"POWER": "N/A"}, "metadata": metadata}
+        device = get_device_state(device_id)
             
-        latest_data[device_id]["attributes"]["POWER"] = power_attr["value"]
-        logging.info(f"POWER attribute received for device {device_id}: {power_attr['value']}")
+        if device_registry.set_power(device, power_attr["value"], power_attr.get("lastUpdateTs")) != power_attr["value"]:
+            mark_device_changed(device_id)
+        telemetry_logger.info("POWER attribute received for device %s: %s", device_id, power_attr['value'])
         return attributes
     except requests.RequestException as e:
         logging.error(f"Error fetching attributes for device {device_id}: {e}")
@@ -295,8 +514,16 @@ def get_device_attributes(device_id):
         logging.error(f"Failed to decode JSON attributes for device {device_id}")
         return []
 
-def send_rpc_to_device(device_id, command, retries=3):
-    """Send RPC command (POWER: ON/OFF) to device with retry logic."""
+def send_rpc_to_device(device_id, command, retries=3, deadline=None):
+    """Send RPC command (POWER: ON/OFF) to device with retry logic.
+
+    deadline: mốc time.monotonic() tuyệt đối; timeout và backoff không vượt quá mốc này.
+    """
+    success, result = _send_rpc_with_retry(device_id, command, retries, deadline)
+    RPC_REQUESTS.inc(command.upper(), result.get("status", "error"))
+    return success, result
+
+def _send_rpc_with_retry(device_id, command, retries, deadline):
     api_url = f"{CORE_IOT_URL}/api/rpc/oneway/{device_id}"
     payload = {
         "method": "POWER",
@@ -304,15 +531,22 @@ def send_rpc_to_device(device_id, command, retries=3):
     }
     
     for attempt in range(retries):
+        timeout = 15
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                logging.error(f"Deadline exceeded sending RPC to {device_id} after {attempt} attempts")
+                return False, {"status": "timeout", "message": "Deadline exceeded. Device not responding.", "device_id": device_id}
+
         try:
-            response = requests.post(api_url, headers=HEADERS, json=payload, timeout=15)
+            response = http_session.post(api_url, headers=HEADERS, json=payload, timeout=timeout)
             
             if response.status_code == 200:
                 logging.info(f"RPC '{command}' sent to {device_id} successfully.")
                 return True, {"status": "success", "device_id": device_id, "command_sent": command}
             elif response.status_code == 401:
                 logging.warning(f"401 error sending RPC to {device_id}: Invalid token.")
-                return False, {"status": "error", "message": "Token (JWT) expired or invalid."}
+                return False, {"status": "error", "message": "Token (JWT) expired or invalid.", "device_id": device_id}
             else:
                 logging.error(f"Error sending RPC to {device_id}: {response.status_code} - {response.text}")
                 return False, {"status": "error", "message": response.text, "device_id": device_id}
@@ -320,7 +554,10 @@ def send_rpc_to_device(device_id, command, retries=3):
         except requests.exceptions.Timeout as e:
             logging.warning(f"Timeout attempt {attempt + 1}/{retries} sending RPC to {device_id}: {e}")
             if attempt < retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
+                backoff = 2 ** attempt  # Exponential backoff
+                if deadline is not None:
+                    backoff = max(0, min(backoff, deadline - time.monotonic()))
+                time.sleep(backoff)
             else:
                 logging.error(f"All {retries} attempts failed sending RPC to {device_id}")
                 return False, {"status": "error", "message": "Device not responding. Please check connection.", "device_id": device_id}
@@ -344,124 +581,187 @@ def periodic_data_logger():
             logging.warning("Periodic check: Cannot fetch data due to invalid token")
         time.sleep(10)
 
+# --- Ingestion Pipeline ---
+
+def parse_frame(message):
+    """Stage 1: decode JSON và map subscriptionId -> device_id."""
+    try:
+        data = json.loads(message)
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding WebSocket message: {e}")
+        return None
+
+    device_id = subscription_to_device_map.get(data.get("subscriptionId"))
+    if not device_id:
+        if "errorCode" in data and data["errorCode"] != 0:
+            logging.error(f"WebSocket server error: {data.get('errorMsg', 'Unknown')}")
+        return None
+
+    if "data" not in data:
+        return None
+    return {"device_id": device_id, "data": data.get("data", {}), "received_at": time.monotonic()}
+
+def update_device_state(frame):
+    """Stage 2: cập nhật device_registry (1 worker -> giữ thứ tự), sinh event cho các stage sau."""
+    device_id = frame["device_id"]
+    telemetry_data = frame["data"]
+    device = get_device_state(device_id)
+
+    # Process Telemetry (parse sang float 1 lần ở đây, các stage sau dùng lại)
+    telemetry_keys_found, changed = device_registry.update(device, telemetry_data)
+    if telemetry_keys_found:
+        telemetry_logger.info("Real-time telemetry for %s: %s", device_id, telemetry_keys_found)
+
+    # Process Attribute (POWER)
+    attributes_found = {}
+    power_change = None
+    if "POWER" in telemetry_data:
+        power_ts, power_val = telemetry_data["POWER"][0]
+        old_power = device_registry.set_power(device, power_val, power_ts)
+        attributes_found["POWER"] = power_val
+        telemetry_logger.info("Real-time attribute for %s: POWER = %s", device_id, power_val)
+        if old_power != power_val:
+            changed = True
+            if old_power != "N/A":
+                power_change = power_val
+
+    if changed:
+        mark_device_changed(device_id)
+
+    # ENERGY-Total / ENERGY-Current là "N/A" -> None (persist / alert bỏ qua như trước)
+    total = telemetry_keys_found.get("ENERGY-Total")
+    energy_total = (telemetry_data["ENERGY-Total"][0][0], total) if isinstance(total, float) else None
+    current = telemetry_keys_found.get("ENERGY-Current")
+
+    return {
+        "device_id": device_id,
+        "name": device.metadata["name"],
+        "telemetry": telemetry_keys_found,
+        "attributes": attributes_found,
+        "metadata": device.metadata,
+        "current": current if isinstance(current, float) else None,
+        "power_change": power_change,
+        "energy_total": energy_total,
+        "received_at": frame["received_at"]
+    }
+
+def handle_alerts(event):
+    """Stage 3: check threshold và auto-shutdown (RPC blocking chạy ở đây, không ở reader thread)."""
+    current_val = event["current"]
+    if current_val is None:
+        return None
+
+    device_id = event["device_id"]
+    alerts, shutdown = alert_engine.evaluate(device_id, current_val)
+    if not alerts and not shutdown:
+        return None
+
+    display_name = event["name"]
+    for sid, threshold in alerts:
+        msg = {
+            "level": "DANGER",
+            "device_id": device_id,
+            "current": current_val,
+            "threshold": threshold,
+            "message": f"{display_name} (Dòng {current_val}A) vượt ngưỡng {threshold}A."
+        }
+        # Gửi đích danh cho Client đó
+        socketio.emit('alert_trigger', msg, room=sid)
+
+    # Tự động tắt thiết bị khi vượt ngưỡng (mỗi lần vượt ngưỡng chỉ 1 lệnh)
+    if shutdown:
+        success = False
+        try:
+            logging.warning(f"Auto-shutdown: {display_name} (Current: {current_val}A exceeds alert threshold)")
+            success, result = send_rpc_to_device(device_id, "OFF")
+            if success:
+                logging.info(f"Auto-shutdown successful for {device_id}")
+            else:
+                logging.error(f"Auto-shutdown failed for {device_id}: {result}")
+        except Exception as e:
+            logging.error(f"Error during auto-shutdown for {device_id}: {e}")
+        alert_engine.report_shutdown(device_id, success)
+    return None
+
+def persist_energy(event):
+    """Stage 4: ENERGY-Total -> hourly kWh (SQLite + forecast feedback)."""
+    if event["energy_total"] is None:
+        return None
+    ts_ms, total_energy = event["energy_total"]
+    # Giờ địa phương, làm tròn xuống giây (như khi còn đi qua chuỗi ISO của process_new_energy)
+    record_energy(event["device_id"], total_energy, datetime.fromtimestamp(ts_ms // 1000))
+    return None
+
+def broadcast_update(event):
+    """Stage 5: activity log emit ngay; dashboard update đưa vào broadcaster để gom theo cửa sổ."""
+    device_id = event["device_id"]
+
+    # Nếu có thay đổi trạng thái POWER, gửi log về FE
+    if event["power_change"] is not None:
+        power_val = event["power_change"]
+        display_name = event["name"]
+        action = "Bật thiết bị" if power_val == "ON" else "Tắt thiết bị"
+        
+        log_entry = {
+            'id': f'log-{int(time.time() * 1000)}',
+            'action': action,
+            'deviceId': device_id,
+            'deviceName': display_name,
+            'user': 'Hệ thống',
+            'timestamp': datetime.now().isoformat(),
+            'details': f'Trạng thái: {power_val}'
+        }
+        
+        # Broadcast log đến tất cả clients
+        socketio.emit('activity_log', log_entry, room='logs')
+        activity_logger.info("Activity log sent: %s - %s", action, display_name)
+
+    # Broadcast Data to dashboard (chỉ field thay đổi, gom theo cửa sổ)
+    dashboard_broadcaster.publish(device_id, {
+        "telemetry": event["telemetry"],
+        "attributes": event["attributes"],
+        "metadata": event["metadata"]
+    }, received_at=event["received_at"])
+    return None
+
+dashboard_broadcaster = DashboardBroadcaster(socketio.emit, window=DASHBOARD_BROADCAST_WINDOW_MS / 1000,
+                                             observe_latency=FRAME_TO_EMIT_SECONDS.observe)
+
+broadcast_stage = Stage("broadcast", broadcast_update, workers=1, maxsize=INGEST_QUEUE_SIZE, drop_when_full=True)
+alert_stage = Stage("alert", handle_alerts, workers=INGEST_ALERT_WORKERS, maxsize=INGEST_QUEUE_SIZE,
+                    partition_key=lambda event: event["device_id"])
+downstream_stages = [alert_stage, broadcast_stage]
+if FORECAST_ENABLED:
+    persist_stage = Stage("persist", persist_energy, workers=1, maxsize=INGEST_QUEUE_SIZE)
+    downstream_stages.insert(1, persist_stage)
+state_stage = Stage("state", update_device_state, workers=1, maxsize=INGEST_QUEUE_SIZE, outputs=downstream_stages)
+# Queue parse đầy: frame có ENERGY-Total (kWh theo giờ) được đợi thêm thay vì bỏ ngay
+parse_stage = Stage("parse", parse_frame, workers=1, maxsize=INGEST_QUEUE_SIZE, outputs=[state_stage],
+                    keep=lambda message: "ENERGY-Total" in message)
+ingest_pipeline = IngestPipeline([parse_stage, state_stage] + downstream_stages)
+for stage in ingest_pipeline.stages:
+    profiler.instrument("ingest", stage, "handler")
+
+REGISTRY.callback("ingest_stage_queue_depth", "Items waiting in each ingest stage", "gauge",
+                  lambda: {(stage.name,): stage.qsize() for stage in ingest_pipeline.stages}, ("stage",))
+REGISTRY.callback("ingest_stage_items_total", "Items per ingest stage by outcome", "counter",
+                  lambda: {(stage.name, outcome): getattr(stage, outcome)
+                           for stage in ingest_pipeline.stages
+                           for outcome in ("processed", "dropped", "dropped_kept", "errors")}, ("stage", "outcome"))
+REGISTRY.callback("log_queue_depth", "Log records waiting for the writer thread", "gauge",
+                  lambda: log_queue_handler.queue.qsize())
+REGISTRY.callback("log_records_dropped_total", "INFO log records dropped because the log queue was full", "counter",
+                  lambda: log_queue_handler.dropped)
+
 def start_websocket():
     """Start WebSocket connection for real-time updates."""
     ws_url = f"wss://app.coreiot.io/api/ws/plugins/telemetry?token={JWT_TOKEN}"
     
     def on_message(ws, message):
-        global latest_data, subscription_to_device_map
-        try:
-            data = json.loads(message)
-            subscription_id = data.get("subscriptionId")
-            device_id = subscription_to_device_map.get(subscription_id)
-            
-            if not device_id:
-                if "errorCode" in data and data["errorCode"] != 0:
-                    logging.error(f"WebSocket server error: {data.get('errorMsg', 'Unknown')}")
-                return
-
-            if "data" in data:
-                telemetry_data = data.get("data", {})
-                
-                if device_id not in latest_data:
-                    metadata = get_or_assign_metadata(device_id)
-                    latest_data[device_id] = {"telemetry": {}, "attributes": {"POWER": "N/A"}, "metadata": metadata}
-
-                # Process Telemetry
-                telemetry_keys_found = {key: telemetry_data[key][0][1] for key in TELEMETRY_KEYS if key in telemetry_data}
-                if telemetry_keys_found:
-                    latest_data[device_id]["telemetry"].update(telemetry_keys_found)
-                    logging.info(f"Real-time telemetry for {device_id}: {telemetry_keys_found}")
-                    
-                    # Emit update via Socket.IO
-                    # socketio.emit('device_update', {
-                    #     'device_id': device_id,
-                    #     'telemetry': latest_data[device_id]["telemetry"],
-                    #     'attributes': latest_data[device_id]["attributes"]
-                    # }, room='device_updates')
-
-                    # === ALERT LOGIC: Check threshold và auto-shutdown ===
-                    if "ENERGY-Current" in telemetry_keys_found:
-                        current_val = float(telemetry_keys_found["ENERGY-Current"])
-                        display_name = latest_data[device_id]["metadata"]["name"]
-
-                        # Duyệt qua từng client đang kết nối để xem ai cần cảnh báo
-                        for sid, threshold in client_thresholds.items():
-                            if current_val > threshold:
-                                msg = {
-                                    "level": "DANGER",
-                                    "device_id": device_id,
-                                    "current": current_val,
-                                    "threshold": threshold,
-                                    "message": f"{display_name} (Dòng {current_val}A) vượt ngưỡng {threshold}A."
-                                }
-                                # Gửi đích danh cho Client đó
-                                socketio.emit('alert_trigger', msg, room=sid)
-                                
-                                # Tự động tắt thiết bị khi vượt ngưỡng
-                                try:
-                                    logging.warning(f"Auto-shutdown: {display_name} (Current: {current_val}A > Threshold: {threshold}A)")
-                                    success, result = send_rpc_to_device(device_id, "OFF")
-                                    if success:
-                                        logging.info(f"Auto-shutdown successful for {device_id}")
-                                    else:
-                                        logging.error(f"Auto-shutdown failed for {device_id}: {result}")
-                                except Exception as e:
-                                    logging.error(f"Error during auto-shutdown for {device_id}: {e}")
-                                
-                                # Chỉ tắt một lần, thoát vòng lặp
-                                break
-
-                # Process Attribute (POWER)
-                if "POWER" in telemetry_data:
-                    power_val = telemetry_data["POWER"][0][1]
-                    old_power = latest_data[device_id]["attributes"].get("POWER", "N/A")
-                    latest_data[device_id]["attributes"]["POWER"] = power_val
-                    logging.info(f"Real-time attribute for {device_id}: POWER = {power_val}")
-                    
-                    # Emit update via Socket.IO
-                    # socketio.emit('device_update', {
-                    #     'device_id': device_id,
-                    #     'telemetry': latest_data[device_id]["telemetry"],
-                    #     'attributes': latest_data[device_id]["attributes"]
-                    # }, room='device_updates')
-
-                    # Nếu có thay đổi trạng thái POWER, gửi log về FE
-                    if old_power != "N/A" and old_power != power_val:
-                        display_name = latest_data[device_id]["metadata"]["name"]
-                        action = "Bật thiết bị" if power_val == "ON" else "Tắt thiết bị"
-                        
-                        log_entry = {
-                            'id': f'log-{int(time.time() * 1000)}',
-                            'action': action,
-                            'deviceId': device_id,
-                            'deviceName': display_name,
-                            'user': 'Hệ thống',
-                            'timestamp': datetime.now().isoformat(),
-                            'details': f'Trạng thái: {power_val}'
-                        }
-                        
-                        # Broadcast log đến tất cả clients
-                        socketio.emit('activity_log', log_entry, room='logs')
-                        logging.info(f"Activity log sent: {action} - {display_name}")
-
-                # Process ENERGY-Total for forecast
-                if FORECAST_ENABLED and "ENERGY-Total" in telemetry_data:
-                    ts_ms = telemetry_data["ENERGY-Total"][0][0]
-                    iso_ts = datetime.fromtimestamp(ts_ms / 1000).strftime("%Y-%m-%dT%H:%M:%SZ")
-                    process_new_energy(device_id, telemetry_data["ENERGY-Total"][0][1], iso_ts)
-                
-                # Broadcast Data to dashboard
-                socketio.emit('dashboard_update', {
-                    "device_id": device_id,
-                    "data": latest_data[device_id],
-                    "timestamp": datetime.now().isoformat()
-                }, room='dashboard')
-            
-        except json.JSONDecodeError as e:
-            logging.error(f"Error decoding WebSocket message: {e}")
-        except Exception as e:
-            logging.error(f"Error processing WebSocket message: {e}")
+        # Reader thread chỉ enqueue; mọi xử lý nằm trong ingest pipeline
+        WS_FRAMES.inc()
+        if not ingest_pipeline.submit(message) and parse_stage.dropped % 100 == 1:
+            logging.warning(f"Ingest queue full, dropped {parse_stage.dropped} WebSocket frames so far")
     
     def on_error(ws, error):
         logging.error(f"WebSocket error: {error}")
@@ -540,12 +840,17 @@ def home():
         "/check-data": "Get all device data",
         "/check-token": "Verify JWT token",
         "/control/<device_id>/<on|off>": "Control specific device",
-        "/control/group/<on|off>": "Control all devices"
+        "/control/group/<on|off>": "Control all devices",
+        "/metrics": "Prometheus metrics",
+        "/health": "Readiness (history loaded, forecast server models ready)",
+        "/admin/profile": "Start/inspect on-demand cProfile capture (ingest | forecast)"
     }
     
     if FORECAST_ENABLED:
-        endpoints["/forecast"] = "Trigger AI forecast"
+        endpoints["/forecast"] = "Trigger AI forecast (budget_ms, format=columnar)"
+        endpoints["/forecast/jobs"] = "Submit async forecast job (POST), poll /forecast/jobs/<job_id>"
         endpoints["/forecast/summary"] = "Get simplified forecast result (Fast)"
+        endpoints["/forecast/history"] = "Get forecast history (start, end, limit)"
         endpoints["/hourly"] = "Get hourly kWh data"
     
     return jsonify({
@@ -563,31 +868,18 @@ def home():
 @app.route('/check-data', methods=['GET'])
 def check_data():
     """API to check data (returns all devices in group)."""
-    if not verify_token():
+    if not verify_token_cached():
         return jsonify({"status": "error", "message": "Invalid JWT_TOKEN"}), 401
     
-    if not latest_data:
+    if APP_ROLE != "api" and not device_registry:
         logging.warning("/check-data called but no data cached yet. Forcing fetch.")
         devices = get_devices_from_group()
         for device_id in devices:
             get_device_telemetry(device_id)
             get_device_attributes(device_id)
-            
-    data_array = []
-    for device_id, info in latest_data.items():
-        meta = info.get("metadata", {"type": "unknown", "name": "Unknown", "location": "N/A"})
-        
-        data_array.append({
-            "type": meta["type"],
-            "name": meta["name"],
-            "location": meta["location"],
-            "id": device_id,
-            "attributes": info.get("attributes", {}),
-            "telemetry": info.get("telemetry", {})
-        })
-
-    logging.info(f"API response for /check-data: {len(data_array)} devices")
-    return jsonify({"status": "success", "data": data_array})
+
+    version, _, body = device_snapshot.get()
+    return make_cached_response(body, f"devices-{version}")
 
 @app.route('/check-token', methods=['GET'])
 def check_token():
@@ -634,19 +926,65 @@ def control_group_devices(command):
     except Exception as e:
         return jsonify({"status": "error", "message": f"Error getting device list: {e}"}), 500
 
-    results = []
-    all_success = True
     cmd_upper = command.upper()
+    batch_id = f"group-{int(time.time() * 1000)}"
+    deadline = time.monotonic() + GROUP_CONTROL_DEADLINE
+    total = len(device_ids)
 
+    def emit_device_result(future, device_id):
+        """Đẩy kết quả từng thiết bị về FE ngay khi có (kể cả sau khi HTTP đã trả về)."""
+        try:
+            success, result = future.result()
+        except Exception as e:
+            success, result = False, {"status": "error", "message": str(e), "device_id": device_id}
+        socketio.emit('group_control_result', {
+            "batch_id": batch_id,
+            "command_sent": cmd_upper,
+            "device_id": device_id,
+            "success": success,
+            "result": result,
+            "total_devices": total
+        }, room='dashboard')
+
+    # Gửi song song qua worker pool, mỗi lệnh bị giới hạn bởi deadline chung
+    futures = {}
     for device_id in device_ids:
-        success, result = send_rpc_to_device(device_id, cmd_upper)
-        results.append(result)
-        if not success:
+        future = submit_rpc(send_rpc_to_device, device_id, cmd_upper, deadline=deadline)
+        future.add_done_callback(lambda f, d=device_id: emit_device_result(f, d))
+        futures[future] = device_id
+
+    def collect(future):
+        try:
+            return future.result()
+        except Exception as e:
+            return False, {"status": "error", "message": str(e), "device_id": futures[future]}
+
+    results = []
+    all_success = True
+    collected = set()
+    try:
+        for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+            success, result = collect(future)
+            collected.add(future)
+            results.append(result)
+            if not success:
+                all_success = False
+    except FuturesTimeoutError:
+        pending = 0
+        for future, device_id in futures.items():
+            if future in collected:
+                continue
             all_success = False
-        time.sleep(0.1)
-        
+            if future.done():
+                results.append(collect(future)[1])
+            else:
+                pending += 1
+                results.append({"status": "pending", "message": "Deadline reached, result will be pushed via Socket.IO.", "device_id": device_id})
+        logging.warning(f"Group control {batch_id}: deadline reached with {pending} devices pending")
+
     summary = {
         "status": "success" if all_success else "partial_failure",
+        "batch_id": batch_id,
         "command_sent": cmd_upper,
         "total_devices": len(device_ids),
         "results": results
@@ -654,170 +992,494 @@ def control_group_devices(command):
     
     return jsonify(summary), 200 if all_success else 207
 
+# === OBSERVABILITY ===
+
+@app.before_request
+def mark_first_request():
+    if "first_request" not in startup.phases:
+        startup.mark("first_request")
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Readiness: 200 khi forecast dùng được (forecast_server đã nạp model), 503 khi chưa.
+    Kèm các mốc khởi động của app và forecast_server.
+    """
+    body = {"status": "ok", "role": APP_ROLE, "uptime_seconds": startup.uptime(), "startup": dict(startup.phases)}
+    ready = True
+    if FORECAST_ENABLED:
+        body["history_hours"] = len(hourly_kwh_global)
+        forecast_health = forecast_client.check_health()
+        body["forecast"] = forecast_health or {"Ready": False, "Error": "AI Server not responding"}
+        ready = bool(forecast_health and forecast_health.get("Ready"))
+    body["ready"] = ready
+    if not ready:
+        body["status"] = "starting"
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Bật cProfile cho N giây xử lý ingest hoặc N lần forecast tiếp theo.
+    POST {"target": "ingest", "seconds": 30} | {"target": "forecast", "calls": 3}
+    GET -> trạng thái + file .prof của lần capture gần nhất.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "Profiling is disabled (ADMIN_TOKEN not set)"}), 404
+    if request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "Invalid admin token"}), 403
+    if request.method == 'GET':
+        return jsonify({"status": "success", "data": profiler.status()})
+
+    body = request.get_json(silent=True) or {}
+    target = body.get("target", "ingest")
+    try:
+        calls = int(body["calls"]) if body.get("calls") else None
+        seconds = float(body["seconds"]) if body.get("seconds") else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "calls/seconds must be numbers"}), 400
+    if not calls and not seconds:
+        return jsonify({"status": "error", "message": "calls or seconds is required"}), 400
+    if (seconds and not 0 < seconds <= PROFILE_MAX_SECONDS) or (calls and not 0 < calls <= PROFILE_MAX_CALLS):
+        return jsonify({"status": "error", "message": f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}], "
+                                                      f"calls in (0, {PROFILE_MAX_CALLS}]"}), 400
+
+    if target == "ingest":
+        try:
+            return jsonify({"status": "success", "data": profiler.start("ingest", calls=calls, seconds=seconds)})
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": str(e)}), 409
+    if target == "forecast" and FORECAST_ENABLED:
+        # forecast_with_ensemble chạy trong forecast_server -> gửi control message "Profile"
+        result = forecast_client.send_control({"Type": "Profile", "Calls": calls, "Seconds": seconds})
+        if result is None or "Error" in result:
+            return jsonify({"status": "error", "message": (result or {}).get("Error", "AI Server not responding")}), 502
+        return jsonify({"status": "success", "data": result})
+    return jsonify({"status": "error", "message": "target must be 'ingest' or 'forecast'"}), 400
+
 # === FORECAST ENDPOINTS (if enabled) ===
 
 if FORECAST_ENABLED:
-    @app.route('/forecast', methods=['GET'])
-    def trigger_forecast():
-        """Manually trigger AI forecast."""
+    # GET /forecast đợi job tối đa bao lâu (s) trước khi trả về job_id để poll
+    FORECAST_WAIT_TIMEOUT = float(os.getenv("FORECAST_WAIT_TIMEOUT", "40"))
+    # Ngân sách thời gian mặc định của GET /forecast (ms, ghi đè bằng ?budget_ms=): hết hạn mà ensemble
+    # chưa xong thì trả dự báo baseline (Degraded), kết quả ensemble đến sau qua 'forecast_result'.
+    # 0 = không giới hạn (đợi FORECAST_WAIT_TIMEOUT rồi trả 202 + job_id như cũ)
+    FORECAST_LATENCY_BUDGET_MS = float(os.getenv("FORECAST_LATENCY_BUDGET_MS", "0"))
+    # Precompute: mỗi khi đóng 1 giờ, chạy forecast nền sau FORECAST_PRECOMPUTE_DELAY + 0..FORECAST_PRECOMPUTE_JITTER
+    # giây (các thiết bị đóng cùng giờ gộp vào 1 lần chạy) -> /forecast trả kết quả có sẵn ngay.
+    # Chạy ở process đóng giờ (APP_ROLE=all/ingest); process api không thấy giờ được đóng, chỉ đọc kết quả
+    # ingest đã publish vào forecast_store (vẫn forecast khi có request mà chưa có kết quả).
+    FORECAST_PRECOMPUTE_ENABLED = os.getenv("FORECAST_PRECOMPUTE", "1") == "1" and APP_ROLE != "api"
+    FORECAST_PRECOMPUTE_DELAY = float(os.getenv("FORECAST_PRECOMPUTE_DELAY", "30"))
+    FORECAST_PRECOMPUTE_JITTER = float(os.getenv("FORECAST_PRECOMPUTE_JITTER", "30"))
+
+    # Kết quả ensemble gần nhất theo snapshot: {snapshot_key: result}
+    ensemble_results = {}
+
+    def ensemble_result(snapshot_key):
+        """Kết quả ensemble của snapshot: của worker này, hoặc worker khác đã publish vào forecast_store."""
+        result = ensemble_results.get(snapshot_key)
+        if result is None:
+            latest = forecast_store.latest()
+            if latest and latest["snapshot_key"] == snapshot_key and not (latest["result"] or {}).get("Degraded"):
+                result = latest["result"]
+        return result
+
+    def run_forecast(recent_history, consumed, snapshot_key=None):
+        """Gọi AI Server 1 lần (chạy trong worker của forecast_jobs)."""
         global predicted_details_cache
-        logging.info("--- MANUAL FORECAST TRIGGERED ---")
-        
+        logging.info(f"Sending request to AI Server... (Consumed: {consumed:.2f} kWh)")
+
+        start = time.perf_counter()
+        result = forecast_client.predict(recent_history, consumed)
+        ok = bool(result) and "Error" not in result
+        FORECAST_RTT_SECONDS.observe(time.perf_counter() - start, "success" if ok else "error")
+        if not ok:
+            if result and "RetryAfter" in result:
+                raise RuntimeError(f"AI Server busy, retry after {result['RetryAfter']}s")
+            return None
+
+        result["ComputedAt"] = datetime.now().isoformat(timespec='seconds')
+        predicted_details_cache = result.get("PredictedHourlyDetails", {})
+        if shared_state is not None:
+            # Process ingest cần chi tiết dự báo để gửi feedback khi đóng giờ
+            shared_state.replace_map("predicted_details", predicted_details_cache)
+        ensemble_results.clear()
+        ensemble_results[snapshot_key] = result
+        version = forecast_store.update(result, consumed, snapshot_key=snapshot_key)
+        logging.info(f"FORECAST SUCCESS (v{version}) -> Bill: {result['PredictedBillVND']:,} VND")
+        return result
+
+    def on_forecast_job_complete(job):
+        """Push kết quả job cho các client trong room 'forecast'."""
+        socketio.emit('forecast_result', job.to_dict(), room='forecast')
+
+    forecast_jobs = ForecastJobManager(on_complete=on_forecast_job_complete)
+    REGISTRY.callback("forecast_jobs_inflight", "Forecast jobs currently running", "gauge",
+                      forecast_jobs.inflight)
+
+    def result_age(created_at):
+        """Số giây từ created_at (ISO) tới bây giờ."""
+        return max(0, int((datetime.now() - datetime.fromisoformat(created_at)).total_seconds()))
+
+    def latest_forecast_age():
+        latest = forecast_store.latest()
+        return result_age(latest["created_at"]) if latest else float("nan")
+
+    REGISTRY.callback("forecast_result_age_seconds", "Age of the latest forecast result (precomputed or on demand)",
+                      "gauge", latest_forecast_age)
+
+    def forecast_snapshot():
+        """(snapshot_key, recent_history, consumed) của dữ liệu hiện tại, hoặc None nếu chưa có dữ liệu."""
+        refresh_hourly_series()
         with lock:
             if len(hourly_kwh_global) < 1:
-                return jsonify({"status": "error", "message": "Not enough data"}), 400
+                return None
             
             now = datetime.now()
             start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            consumed = sum(v for k, v in hourly_kwh_global.items() if datetime.fromisoformat(k) >= start_of_month)
-            recent_history = dict(sorted(hourly_kwh_global.items(), key=lambda x: x[0], reverse=True)[:1200])
+            # APP_ROLE=ingest/api: version "hourly" dùng chung -> ingest và các worker cùng snapshot_key cho cùng dữ liệu
+            if APP_ROLE == "api":
+                data_version = hourly_synced_version[0]
+            elif APP_ROLE == "ingest":
+                data_version = shared_state.version("hourly")
+            else:
+                data_version = hourly_kwh_global.version
+            snapshot_key = f"{to_key(start_of_month)}-v{data_version}"
+            consumed = hourly_kwh_global.range_sum(to_key(start_of_month))
+            recent_history = dict(hourly_kwh_global.tail(1200))
+        return snapshot_key, recent_history, consumed
+
+    def submit_forecast_job(snapshot=None):
+        """Tạo job forecast cho snapshot dữ liệu hiện tại, hoặc join job cùng snapshot đang chạy.
+        Trả về (job, joined), hoặc None nếu chưa có dữ liệu."""
+        snapshot = snapshot or forecast_snapshot()
+        if snapshot is None:
+            return None
+        snapshot_key, recent_history, consumed = snapshot
+        return forecast_jobs.submit(snapshot_key, lambda: run_forecast(recent_history, consumed, snapshot_key))
+
+    forecast_precomputer = None
+    if FORECAST_PRECOMPUTE_ENABLED:
+        forecast_precomputer = ForecastPrecomputer(submit_forecast_job, delay=FORECAST_PRECOMPUTE_DELAY,
+                                                   jitter=FORECAST_PRECOMPUTE_JITTER,
+                                                   on_outcome=FORECAST_PRECOMPUTE.inc)
+
+    # Baseline của snapshot gần nhất (các request cùng snapshot dùng lại): {snapshot_key: result}
+    baseline_cache = {}
+
+    # Body /forecast đã encode (+ bản nén) theo (kết quả, shape): các request join cùng job
+    # hoặc đọc lại cùng kết quả không serialize/nén lại
+    FORECAST_BODY_CACHE_MAX_ENTRIES = 16
+    forecast_bodies = {}
+
+    def forecast_columns(result):
+        """Shape dạng cột: PredictedHourlyDetails {giờ: {model: kWh}} -> {model: [kWh theo giờ]}, kèm start/step."""
+        details = result.get("PredictedHourlyDetails") or {}
+        timestamps = sorted(details)
+        columns = {key: value for key, value in result.items() if key != "PredictedHourlyDetails"}
+        columns["start"] = timestamps[0] if timestamps else result.get("Start")
+        columns["step"] = 3600
+        if timestamps:
+            models = list(details[timestamps[0]])
+            columns["PredictedHourlyDetails"] = {model: [details[ts].get(model) for ts in timestamps]
+                                                 for model in models}
+        return columns
+
+    def forecast_response(result, cache=True):
+        """Response /forecast theo shape (rows | columnar) và Accept-Encoding."""
+        shape = "columnar" if wants_columnar() else "rows"
+        entry = forecast_bodies.get((id(result), shape)) if cache else None
+        if entry is None or entry[0] is not result:
+            body = EncodedBody(encode_json(forecast_columns(result) if shape == "columnar" else result))
+            entry = (result, body, f"forecast-{hashlib.md5(body.identity).hexdigest()[:16]}-{shape}")
+            if cache:
+                if len(forecast_bodies) >= FORECAST_BODY_CACHE_MAX_ENTRIES:
+                    forecast_bodies.clear()
+                forecast_bodies[(id(result), shape)] = entry
+        response = make_cached_response(entry[1], entry[2], vary_accept=True)
+        if result.get("ComputedAt"):
+            response.headers['Age'] = str(result_age(result["ComputedAt"]))
+        return response
+
+    def degraded_forecast(snapshot, job, reason):
+        """Trả về dự báo baseline thay cho job chưa xong/lỗi; cập nhật summary tới khi ensemble thay thế."""
+        snapshot_key, recent_history, consumed = snapshot
+        # Đọc version trước khi kiểm tra job: ensemble xong sau bước kiểm tra -> version đã tăng -> không ghi đè
+        store_version = forecast_store.version()
+        if job.status == "done":  # ensemble vừa xong
+            return forecast_response(job.result)
+        ensemble = ensemble_result(snapshot_key)
+        if ensemble is not None:  # dữ liệu chưa đổi từ lần ensemble trước
+            return forecast_response(ensemble)
+
+        result = baseline_cache.get(snapshot_key)
+        if result is None:
+            result = baseline_forecast(recent_history, consumed)
+            baseline_cache.clear()
+            baseline_cache[snapshot_key] = result
+
+        FORECAST_DEGRADED.inc(reason)
+        forecast_store.update(result, consumed, if_version=store_version, snapshot_key=snapshot_key)
+        logging.warning(f"FORECAST DEGRADED ({reason}) job {job.id} -> Bill: {result['PredictedBillVND']:,} VND")
+        body = dict(result, job_id=job.id, degraded_reason=reason, poll_url=f"/forecast/jobs/{job.id}")
+        if job.error:
+            body["message"] = job.error
+        return forecast_response(body, cache=False)
 
-        logging.info(f"Sending request to AI Server... (Consumed: {consumed:.2f} kWh)")
-        
-        result = forecast_client.predict(recent_history, consumed)
-        
-        if result:
-            predicted_details_cache = result.get("PredictedHourlyDetails", {})
-            logging.info(f"FORECAST SUCCESS -> Bill: {result['PredictedBillVND']:,} VND")
-            
-            try:
-                with open("forecast_result.json", "w", encoding='utf-8') as f:
-                    json.dump(result, f, indent=4, ensure_ascii=False)
-            except:
-                pass
-            
-            return jsonify(result)
-        else:
-            return jsonify({"status": "error", "message": "AI Server not responding"}), 500
+    @app.route('/forecast', methods=['GET'])
+    def trigger_forecast():
+        """Manually trigger AI forecast (đợi kết quả; request đồng thời dùng chung 1 job).
+        Dữ liệu chưa đổi từ lần forecast trước (vd: đã precompute sau khi đóng giờ) -> trả ngay kết quả đó,
+        tuổi kết quả ở header Age và field ComputedAt; ?refresh=1 để chạy lại.
+        ?budget_ms=: hết hạn (hoặc AI Server lỗi) thì trả dự báo baseline có "Degraded": true."""
+        try:
+            budget_ms = float(request.args.get('budget_ms', FORECAST_LATENCY_BUDGET_MS))
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid budget_ms"}), 400
+
+        snapshot = forecast_snapshot()
+        if snapshot is None:
+            return jsonify({"status": "error", "message": "Not enough data"}), 400
+        precomputed = ensemble_result(snapshot[0])
+        if precomputed is not None and request.args.get('refresh') != '1':
+            return forecast_response(precomputed)
+
+        job, joined = submit_forecast_job(snapshot)
+        logging.info(f"--- MANUAL FORECAST TRIGGERED --- job {job.id}{' (joined in-flight job)' if joined else ''}")
+
+        if not job.wait(budget_ms / 1000 if budget_ms > 0 else FORECAST_WAIT_TIMEOUT):
+            if budget_ms > 0:
+                return degraded_forecast(snapshot, job, "timeout")
+            return jsonify({"status": "pending", "job_id": job.id,
+                            "message": "Forecast still running, poll /forecast/jobs/<job_id>."}), 202
+        if job.status == "done":
+            return forecast_response(job.result)
+        return degraded_forecast(snapshot, job, "error")
+
+    @app.route('/forecast/jobs', methods=['POST'])
+    def submit_forecast():
+        """Submit forecast job, trả về job_id ngay (kết quả: poll hoặc Socket.IO 'forecast_result')."""
+        submitted = submit_forecast_job()
+        if submitted is None:
+            return jsonify({"status": "error", "message": "Not enough data"}), 400
+
+        job, joined = submitted
+        return jsonify({
+            "status": "accepted",
+            "job_id": job.id,
+            "joined": joined,
+            "poll_url": f"/forecast/jobs/{job.id}"
+        }), 202
+
+    @app.route('/forecast/jobs/<string:job_id>', methods=['GET'])
+    def get_forecast_job(job_id):
+        """Trạng thái / kết quả của forecast job."""
+        job = forecast_jobs.get(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Job not found"}), 404
+        return jsonify(job.to_dict())
 
     @app.route('/forecast/summary', methods=['GET'])
     def get_forecast_summary():
-        """API trả về tóm tắt kết quả dự báo (đọc từ cache)."""  
+        """API trả về tóm tắt kết quả dự báo (đọc từ bộ nhớ)."""
+        latest = forecast_store.latest()
+        if latest is None:
+            return jsonify({
+                "status": "empty", 
+                "message": "Chưa có dữ liệu dự báo. Vui lòng nhấn nút 'Dự báo' trước."
+            }), 404
+        response = make_cached_response(latest["summary_body"], f"forecast-{latest['version']}-{latest['created_at']}")
+        response.headers['Age'] = str(result_age(latest["created_at"]))
+        return response
+
+    @app.route('/forecast/history', methods=['GET'])
+    def get_forecast_history_api():
+        """Lịch sử các lần forecast (mới nhất trước). Query: start, end (ISO), limit."""
         try:
-            # Kiểm tra xem file kết quả có tồn tại không
-            if os.path.exists("forecast_result.json"):
-                with open("forecast_result.json", "r", encoding='utf-8') as f:
-                    full_result = json.load(f)
-                
-                # Trích xuất 3 thông số bạn yêu cầu
-                summary_data = {
-                    "tien_can_tra_vnd": full_result.get("PredictedBillVND", 0),
-                    "tong_kwh_du_doan_duoc": full_result.get("TotalKwhForecasted", 0),
-                    "tong_kwh_ca_thang": full_result.get("TotalKwhMonth", 0)
-                }
-                
-                return jsonify({
-                    "status": "success",
-                    "data": summary_data
-                })
-            else:
-                return jsonify({
-                    "status": "empty", 
-                    "message": "Chưa có dữ liệu dự báo. Vui lòng nhấn nút 'Dự báo' trước."
-                }), 404
-                
-        except Exception as e:
-            logging.error(f"Error reading forecast summary: {e}")
-            return jsonify({"status": "error", "message": str(e)}), 500
+            limit = min(int(request.args.get('limit', 100)), 1000)
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid limit"}), 400
+        rows = get_forecast_history(request.args.get('start'), request.args.get('end'), limit)
+        return jsonify({"status": "success", "data": rows})
 
     # Giá điện (VND/kWh)
     PRICE_PER_KWH = 2500
 
-    @app.route('/energy', methods=['GET'])
-    def get_energy_data():
-        """API trả về dữ liệu tiêu thụ điện theo giờ với chi phí."""
-        period = request.args.get('period', 'day')
-        
-        # Tính toán mốc thời gian CHẶN DƯỚI (start_time)
-        now = datetime.now()
-        
+    # Cache response /energy theo (start, end, bucket); xóa khi có giờ mới được lưu
+    ENERGY_CACHE_MAX_ENTRIES = 64
+    energy_cache = {"version": -1, "entries": {}}
+
+    def resolve_energy_range(args, now):
+        """Xác định [start, end] từ ?start=&end= (ISO) hoặc ?period=day|week|month|year."""
         start_of_this_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         start_of_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        
+
+        if args.get('start'):
+            start_time = datetime.fromisoformat(args['start'])
+            end_time = datetime.fromisoformat(args['end']) if args.get('end') else now
+            return start_time, end_time
+
+        period = args.get('period', 'day')
         if period == 'day':
             start_time = start_of_today
-            
         elif period == 'week':
             seven_days_ago = now - timedelta(days=7)
             start_time = max(seven_days_ago, start_of_this_month)
-            
         elif period == 'month':
             start_time = start_of_this_month
-            
+        elif period == 'year':
+            start_time = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
         else:
             start_time = now - timedelta(hours=24)
+        return start_time, now
+
+    @app.route('/energy', methods=['GET'])
+    def get_energy_data():
+        """
+        API trả về dữ liệu tiêu thụ điện với chi phí.
+        Query: period=day|week|month|year hoặc start=&end= (ISO), bucket=hour|day|week (mặc định hour).
+        format=columnar (hoặc Accept: application/vnd.columnar+json): {"start", "step", "consumption", "cost"}
+        thay cho list {timestamp, consumption, cost}; bucket không có dữ liệu = null.
+        """
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in BUCKETS:
+            return jsonify({"status": "error", "message": f"Invalid bucket. Use one of {list(BUCKETS)}"}), 400
+        try:
+            start_time, end_time = resolve_energy_range(request.args, datetime.now())
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid start/end: {e}"}), 400
 
-        response_data = []
+        shape = "columnar" if wants_columnar() else "rows"
+        cache_key = (to_key(start_time), to_key(end_time), bucket, shape)
+        refresh_hourly_series()
 
         with lock:
-            # Sort dữ liệu
-            sorted_items = sorted(hourly_kwh_global.items(), key=lambda x: x[0])
-            recent_items = sorted_items[-750:]
-            
-            for iso_ts, kwh in recent_items:
-                try:
-                    dt_obj = datetime.fromisoformat(iso_ts)
-                    if dt_obj >= start_time:
-                        response_data.append({
+            version = hourly_kwh_global.version
+            if energy_cache["version"] != version or len(energy_cache["entries"]) >= ENERGY_CACHE_MAX_ENTRIES:
+                energy_cache["version"] = version
+                energy_cache["entries"] = {}
+
+            body = energy_cache["entries"].get(cache_key)
+            if body is None:
+                sums = hourly_kwh_global.bucket_sums(start_time, end_time, bucket)
+                if shape == "columnar":
+                    start, step, values = to_columns(sums, bucket)
+                    response_data = {
+                        "start": start,
+                        "step": step,
+                        "consumption": [None if kwh is None else round(kwh, 4) for kwh in values],
+                        "cost": [None if kwh is None else round(kwh * PRICE_PER_KWH, 2) for kwh in values]
+                    }
+                else:
+                    response_data = [
+                        {
                             "timestamp": iso_ts,
-                            "consumption": kwh,
-                            "cost": kwh * PRICE_PER_KWH
-                        })
-                except ValueError:
-                    continue
+                            "consumption": round(kwh, 4),
+                            "cost": round(kwh * PRICE_PER_KWH, 2)
+                        }
+                        for iso_ts, kwh in sums
+                    ]
+                # Nén (gzip/br) làm ngoài lock, lần đầu có client xin, rồi giữ trong cache entry
+                body = EncodedBody(json.dumps(response_data, separators=(',', ':')).encode('utf-8'))
+                energy_cache["entries"][cache_key] = body
 
-        return jsonify(response_data)
+        return make_cached_response(body, f"energy-{version}-{'-'.join(cache_key)}", vary_accept=True)
 
 # === SOCKET.IO EVENT HANDLERS ===
 
+def set_client_threshold(sid, threshold):
+    """Nhiều process: ghi vào shared store (ingest tự đồng bộ); 1 process: ghi thẳng vào alert_engine."""
+    if shared_state is not None:
+        shared_state.put_map("thresholds", {sid: threshold})
+    else:
+        alert_engine.set_threshold(sid, threshold)
+
+def remove_client_threshold(sid):
+    if shared_state is not None:
+        shared_state.delete_map_field("thresholds", sid)
+    else:
+        alert_engine.remove_client(sid)
+
+def sync_thresholds(interval=1.0):
+    """Process ingest: đồng bộ ngưỡng từ shared store vào alert_engine khi version đổi."""
+    synced_version = None
+    while True:
+        try:
+            version = shared_state.version("thresholds")
+            if version != synced_version:
+                alert_engine.replace_thresholds(shared_state.get_map("thresholds"))
+                synced_version = version
+        except Exception as e:
+            logging.error(f"Threshold sync error: {e}")
+        time.sleep(interval)
+
 @socketio.on('connect')
 def handle_connect():
     """Client connected to Socket.IO server."""
-    logging.info(f"Client connected: {request.sid}")
+    client_logger.info("Client connected: %s", request.sid)
+    SOCKETIO_CLIENTS.inc()
     emit('response', {'data': 'Connected to Socket.IO server'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Client disconnected from Socket.IO server."""
-    logging.info(f"Client disconnected: {request.sid}")
+    client_logger.info("Client disconnected: %s", request.sid)
+    SOCKETIO_CLIENTS.dec()
     # Xóa threshold của user khi họ thoát để tránh rác bộ nhớ
-    if request.sid in client_thresholds:
-        del client_thresholds[request.sid]
+    remove_client_threshold(request.sid)
 
 @socketio.on('join_dashboard')
 def handle_join_dashboard():
     """Client join dashboard room để nhận realtime updates."""
     join_room('dashboard')
-    logging.info(f"Client {request.sid} joined room 'dashboard'")
+    client_logger.info("Client %s joined room 'dashboard'", request.sid)
     
-    # Gửi ngay dữ liệu Snapshot hiện có cho client mới vào
-    data_list = []
-    for device_id, info in latest_data.items():
-        meta = info.get("metadata", {"type": "unknown", "name": "Unknown", "location": "N/A"})
-        data_list.append({
-            "id": device_id,
-            "type": meta["type"],
-            "name": meta["name"],
-            "location": meta["location"],
-            "attributes": info.get("attributes", {}),
-            "telemetry": info.get("telemetry", {})
-        })
-    emit('dashboard_update', {"data": data_list})
+    # Gửi ngay dữ liệu Snapshot hiện có cho client mới vào (dùng lại snapshot đã cache)
+    _, snapshot, _ = device_snapshot.get()
+    emit('dashboard_update', {"data": snapshot["data"]})
 
 @socketio.on('join_logs')
 def handle_join_logs():
     """Client join logs room để nhận activity logs realtime."""
     join_room('logs')
-    logging.info(f"Client {request.sid} joined room 'logs'")
+    client_logger.info("Client %s joined room 'logs'", request.sid)
+
+@socketio.on('join_forecast')
+def handle_join_forecast():
+    """Client join room 'forecast' để nhận kết quả forecast job (forecast_result)."""
+    join_room('forecast')
+    client_logger.info("Client %s joined room 'forecast'", request.sid)
+
+@socketio.on('request_forecast')
+def handle_request_forecast():
+    """Client yêu cầu forecast qua Socket.IO; kết quả được push qua 'forecast_result'."""
+    if not FORECAST_ENABLED:
+        emit('forecast_job', {"status": "error", "message": "Forecast disabled"})
+        return
+
+    join_room('forecast')
+    submitted = submit_forecast_job()
+    if submitted is None:
+        emit('forecast_job', {"status": "error", "message": "Not enough data"})
+        return
+    job, joined = submitted
+    emit('forecast_job', {**job.to_dict(include_result=False), "joined": joined})
 
 @socketio.on('set_alert_threshold')
 def handle_set_threshold(data):
     """Client gửi ngưỡng cảnh báo lên server."""
     try:
         threshold = float(data.get('threshold', 100))
-        client_thresholds[request.sid] = threshold
+        set_client_threshold(request.sid, threshold)
         join_room('alert')
-        logging.info(f"Client {request.sid} set threshold: {threshold}A")
+        client_logger.info("Client %s set threshold: %sA", request.sid, threshold)
         
         # Emit activity log
         log_entry = {
@@ -837,14 +1499,14 @@ def handle_set_threshold(data):
 @socketio.on('subscribe_devices')
 def handle_subscribe_devices():
     """Client subscribes to device updates (legacy support)."""
-    logging.info(f"Client {request.sid} subscribed to device updates")
+    client_logger.info("Client %s subscribed to device updates", request.sid)
     emit('response', {'data': 'Subscribed to device updates'})
     join_room('device_updates')
 
 @socketio.on('unsubscribe_devices')
 def handle_unsubscribe_devices():
     """Client unsubscribes from device updates (legacy support)."""
-    logging.info(f"Client {request.sid} unsubscribed from device updates")
+    client_logger.info("Client %s unsubscribed from device updates", request.sid)
     leave_room('device_updates')
 
 # === MAIN ===
@@ -859,16 +1521,33 @@ if __name__ == "__main__":
     print(" Realtime Alerts Enabled: True")
     print("=" * 60)
     
-    # Start background threads
-    threading.Thread(target=periodic_data_logger, daemon=True).start()
-    threading.Thread(target=start_websocket, daemon=True).start()
+    print(f" Role: {APP_ROLE}" + (f" (shared state: {SHARED_STATE_URL})" if shared_state is not None else ""))
+    print("=" * 60)
+    
+    # Start background threads (chỉ process ingest kết nối CoreIoT)
+    if APP_ROLE in ("all", "ingest"):
+        if shared_state is not None:
+            # Restart process ingest: lấy lại trạng thái thiết bị cuối cùng từ shared store
+            for device_id, entry in shared_state.get_map("devices").items():
+                device_registry.load(device_id, entry)
+                if entry.get("metadata"):
+                    DEVICE_METADATA_CACHE[device_id] = entry["metadata"]
+            device_snapshot.bump()
+        ingest_pipeline.start()
+        dashboard_broadcaster.start()
+        threading.Thread(target=periodic_data_logger, daemon=True).start()
+        threading.Thread(target=start_websocket, daemon=True).start()
+        if shared_state is not None:
+            state_publisher.start()
+            threading.Thread(target=sync_thresholds, daemon=True).start()
     
-    # Initialize dummy data if forecast enabled
-    if FORECAST_ENABLED:
-        init_dummy_data()
+        # Lịch sử thật từ SQLite; chỉ sinh dummy data khi chưa có giờ nào
+        if FORECAST_ENABLED and hydrate_hourly_series() == 0:
+            init_dummy_data()
     
-    print("🔌 Server starting on http://0.0.0.0:5000")
+    print(f"🔌 Server starting on http://0.0.0.0:{PORT}")
     print("=" * 60)
     
-    # Run Socket.IO server
-    socketio.run(app, debug=True, port=5000, host='0.0.0.0', allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # Run Socket.IO server (reloader tắt khi chạy nhiều process để không nhân đôi process)
+    socketio.run(app, debug=APP_ROLE == "all", use_reloader=APP_ROLE == "all", port=PORT, host='0.0.0.0',
+                 allow_unsafe_werkzeug=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+# baseline_forecast.py
+# Dự báo dự phòng (vài ms, chạy ngay trong app, không cần forecast_server) khi ensemble
+# không trả lời kịp ngân sách thời gian của /forecast hoặc server không chạy.
+#
+# Model "HourOfWeekProfile": kWh của 1 giờ = trung bình các giờ cùng (thứ, giờ) trong
+# BASELINE_WEEKS tuần gần nhất; (thứ, giờ) chưa có dữ liệu -> trung bình cùng giờ trong ngày
+# -> trung bình chung. Với BASELINE_WEEKS=1 chính là seasonal-naive (lag 168h).
+# Khoảng dự báo giống forecast_server: từ giờ sau giờ cuối có dữ liệu đến cuối tháng.
+import calendar
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from billing import calculate_vietnam_electricity_bill
+
+KEY_FORMAT = "%Y-%m-%dT%H:00:00"
+BASELINE_MODEL = "HourOfWeekProfile"
+BASELINE_WEEKS = int(os.getenv("BASELINE_WEEKS", "4"))
+
+
+def _end_of_month(origin):
+    # = (origin + MonthEnd(0)).floor('h') bên forecast_server: ngày cuối tháng, cùng giờ với origin
+    return origin.replace(day=calendar.monthrange(origin.year, origin.month)[1])
+
+
+def hour_of_week_profile(history, weeks=BASELINE_WEEKS):
+    """
+    history: {key: kWh}. Trả về (predict(dt) -> kWh, origin) với origin là giờ cuối có dữ liệu,
+    hoặc (None, None) nếu history rỗng.
+    """
+    if not history:
+        return None, None
+    origin = datetime.strptime(max(history), KEY_FORMAT)
+    since = origin - timedelta(weeks=weeks)
+
+    by_week_hour, by_hour = defaultdict(list), defaultdict(list)
+    for key, kwh in history.items():
+        if kwh is None:
+            continue
+        ts = datetime.strptime(key, KEY_FORMAT)
+        if ts <= since:
+            continue
+        by_week_hour[(ts.weekday(), ts.hour)].append(kwh)
+        by_hour[ts.hour].append(kwh)
+
+    values = [kwh for group in by_hour.values() for kwh in group]
+    overall = sum(values) / len(values) if values else 0.0
+    week_hour_mean = {k: sum(v) / len(v) for k, v in by_week_hour.items()}
+    hour_mean = {k: sum(v) / len(v) for k, v in by_hour.items()}
+
+    def predict(ts):
+        mean = week_hour_mean.get((ts.weekday(), ts.hour))
+        if mean is None:
+            mean = hour_mean.get(ts.hour, overall)
+        return max(mean, 0.0)
+
+    return predict, origin
+
+
+def baseline_forecast(history, consumed_kwh, weeks=BASELINE_WEEKS):
+    """
+    Dự báo đến cuối tháng, cùng các field với kết quả của forecast_server
+    (trừ PredictedHourlyDetails: không có model con nên không gửi feedback), đánh dấu "Degraded".
+    """
+    predict, origin = hour_of_week_profile(history, weeks)
+    hourly, start = [], None
+    if predict is not None:
+        end = _end_of_month(origin)
+        ts = origin + timedelta(hours=1)
+        start = ts.strftime(KEY_FORMAT) if ts <= end else None
+        while ts <= end:
+            hourly.append(round(predict(ts), 4))
+            ts += timedelta(hours=1)
+
+    total_forecasted = sum(hourly)
+    total_month = consumed_kwh + total_forecasted
+    return {
+        "PredictedBillVND": round(calculate_vietnam_electricity_bill(total_month)),
+        "TotalKwhForecasted": round(total_forecasted, 2),
+        "TotalKwhMonth": round(total_month, 2),
+        "HourlyPredictions": hourly,
+        "Start": start,
+        "Strategy": "baseline",
+        "Model": BASELINE_MODEL,
+        "Degraded": True,
+    }
@@ -0,0 +1,108 @@
+# batch_forecast.py
+# Dự báo recursive đến cuối tháng cho nhiều chuỗi cùng lúc (request "PredictBatch").
+# Ở mỗi bước, feature của mọi chuỗi còn đang dự báo được xếp thành 1 ma trận
+# -> scaler.transform và mỗi model chỉ chạy 1 lần/bước cho cả batch thay vì 1 lần/chuỗi.
+#
+# Feature giống forecast_server.forecast_with_ensemble: lag 24/48/168h và trung bình
+# [t-48h, t-25h] lấy từ lịch sử + các giờ đã dự báo, giờ không có dữ liệu thì dùng giá trị
+# mới nhất (last_known). Mỗi chuỗi chỉ cần 168 giờ cuối của lịch sử, lưu trong 1 mảng
+# (n_series, 168 + số giờ dự báo) mà cột 167 là giờ cuối có dữ liệu (origin) của mọi chuỗi.
+import time
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend',
+            'kwh_lag_24h', 'kwh_lag_48h', 'kwh_lag_168h',
+            'kwh_rolling_mean_24h']
+TARGET = 'kwh_hour'
+HISTORY_WINDOW = 168
+
+
+def _future_hours(origin):
+    end_of_month = (origin + pd.offsets.MonthEnd(0)).floor('h')
+    if origin >= end_of_month:
+        return pd.DatetimeIndex([])
+    return pd.date_range(start=origin + pd.Timedelta(hours=1), end=end_of_month, freq='h')
+
+
+def forecast_batch(histories, scaler, ensemble, step_observer=None):
+    """
+    histories: list DataFrame (index datetime, cột TARGET, không rỗng).
+    Trả về list dict {"start", "predictions", "details": {model: list}} theo thứ tự đầu vào;
+    "start" là giờ dự báo đầu tiên (các giờ sau liên tiếp từng giờ).
+    step_observer(seconds, n_series): gọi sau mỗi bước (metrics).
+    """
+    n = len(histories)
+    origins, futures = [], []
+    for history_df in histories:
+        origin = history_df.index.max()
+        origins.append(origin)
+        futures.append(_future_hours(origin))
+    horizons = np.array([len(f) for f in futures], dtype=np.int64)
+    # Chuỗi dài nhất lên đầu: ở bước k các chuỗi còn dự báo là 1 prefix -> dùng slice, không copy
+    order = np.argsort(-horizons, kind="stable")
+    h_max = int(horizons.max()) if n else 0
+
+    width = HISTORY_WINDOW + h_max
+    values = np.zeros((n, width))
+    present = np.zeros((n, width), dtype=bool)
+    calendar = np.zeros((n, h_max, 4))
+    for row, i in enumerate(order):
+        series = histories[i][TARGET]
+        series = series[~series.index.duplicated(keep='last')]
+        offsets = ((series.index - origins[i]) // pd.Timedelta(hours=1)).to_numpy() + HISTORY_WINDOW - 1
+        keep = offsets >= 0
+        values[row, offsets[keep]] = series.to_numpy(dtype=float)[keep]
+        present[row, offsets[keep]] = True
+        future = futures[i]
+        if len(future):
+            calendar[row, :len(future)] = np.column_stack(
+                [future.hour, future.dayofweek, future.month, (future.dayofweek >= 5).astype(int)])
+
+    predictions = np.zeros((n, h_max))
+    details = {}
+    active_counts = np.searchsorted(-horizons[order], -np.arange(h_max), side='left')
+    for k in range(h_max):
+        step_start = time.perf_counter()
+        m = int(active_counts[k])
+        col = HISTORY_WINDOW + k
+        v, p = values[:m], present[:m]
+        last_known = v[:, col - 1]
+
+        def lag(hours):
+            return np.where(p[:, col - hours], v[:, col - hours], last_known)
+
+        window_present = p[:, col - 48:col - 24]
+        window_values = v[:, col - 48:col - 24]
+        window_valid = window_present & ~np.isnan(window_values)
+        valid_count = window_valid.sum(axis=1)
+        rolling = np.where(
+            window_present.any(axis=1),
+            np.where(valid_count > 0,
+                     np.where(window_valid, window_values, 0).sum(axis=1) / np.maximum(valid_count, 1),
+                     0.0),
+            last_known)
+
+        X = np.column_stack([calendar[:m, k], lag(24), lag(48), lag(168), rolling])
+        X = np.nan_to_num(X, nan=0.0)
+        scaled = scaler.transform(pd.DataFrame(X, columns=FEATURES))
+        step_predictions, step_details = ensemble.predict_conservative_batch(scaled)
+
+        values[:m, col] = step_predictions
+        present[:m, col] = True
+        predictions[:m, k] = step_predictions
+        for model, model_values in step_details.items():
+            details.setdefault(model, np.zeros((n, h_max)))[:m, k] = model_values
+        if step_observer is not None:
+            step_observer(time.perf_counter() - step_start, m)
+
+    results = [None] * n
+    for row, i in enumerate(order):
+        h = int(horizons[i])
+        results[i] = {
+            "start": futures[i][0].isoformat() if h else None,
+            "predictions": predictions[row, :h].tolist(),
+            "details": {model: model_values[row, :h].tolist() for model, model_values in details.items()},
+        }
+    return results
@@ -0,0 +1,373 @@
+# benchmark.py
+# Benchmark các đường nóng của forecast và ingest, chạy offline:
+#   - calculate_vietnam_electricity_bill
+#   - model.predict theo batch size, ModelEnsemble.predict_*
+#   - forecast_with_ensemble / forecast_direct: horizon (lịch sử kết thúc ngày 1 -> 30 của tháng) và kích thước lịch sử (168 -> 10k giờ)
+#   - process_new_energy, save_hourly_kwh
+#   - ingest state (device_registry): state + alert + persist mỗi frame, build snapshot /check-data,
+#     bytes RAM mỗi thiết bị, với hàng nghìn thiết bị
+#
+# Mọi thứ chạy trong thư mục tạm: lịch sử tổng hợp cố định (seed), model nhỏ được train
+# lại mỗi lần chạy (cùng seed -> cùng model), DB/log riêng. Không cần mạng hay file .pkl thật.
+#
+#   python benchmark.py                        # đầy đủ, ghi benchmarks/<commit>-<time>.json
+#   python benchmark.py --quick                # ít case hơn, vài chục giây
+#   python benchmark.py --only forecast        # chỉ các case có tên chứa 'forecast'
+#   python benchmark.py --compare old.json     # so sánh với lần chạy trước
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED = 42
+
+FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend',
+            'kwh_lag_24h', 'kwh_lag_48h', 'kwh_lag_168h',
+            'kwh_rolling_mean_24h']
+TARGET = 'kwh_hour'
+
+HORIZON_DAYS = (1, 8, 15, 22, 30)
+HISTORY_SIZES = (168, 720, 2000, 10000)
+BATCH_SIZES = (1, 8, 64, 512, 4096)
+
+
+# --- Dữ liệu & model tổng hợp ---
+
+def synthetic_history(end, hours, seed=SEED):
+    """kWh theo giờ kết thúc tại `end`: chu kỳ ngày + tuần + nhiễu, cố định theo seed."""
+    index = pd.date_range(end=pd.Timestamp(end).floor('h'), periods=hours, freq='h')
+    rng = np.random.RandomState(seed)
+    hour = index.hour.to_numpy()
+    daily = np.select([hour < 6, hour < 9, hour < 17, hour < 22], [0.1, 0.9, 0.35, 1.5], 0.6)
+    weekly = np.where(index.dayofweek.to_numpy() >= 5, 1.2, 1.0)
+    values = np.round(daily * weekly * rng.uniform(0.8, 1.2, size=hours), 4)
+    return pd.DataFrame({TARGET: values}, index=index)
+
+
+def train_tiny_models(workdir, seed=SEED):
+    """Train bộ model nhỏ (cùng loại với train_forecast_models) vào workdir/models + scaler.pkl + ensemble_model.pkl."""
+    import joblib
+    import xgboost as xgb
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import LinearRegression
+    from sklearn.neural_network import MLPRegressor
+    from sklearn.preprocessing import StandardScaler
+    from train_forecast_models import create_features, train_direct_model
+
+    history = synthetic_history("2024-01-01", 24 * 120, seed)
+    df = create_features(history)
+    scaler = StandardScaler()
+    X = scaler.fit_transform(df[FEATURES])
+    y = df[TARGET]
+
+    os.makedirs(os.path.join(workdir, "models"), exist_ok=True)
+    models = {
+        "model_xgb.pkl": xgb.XGBRegressor(n_estimators=30, max_depth=4, learning_rate=0.1, random_state=seed, n_jobs=1),
+        "model_rf.pkl": RandomForestRegressor(n_estimators=10, max_depth=8, random_state=seed, n_jobs=1),
+        "model_mlp.pkl": MLPRegressor(hidden_layer_sizes=(16,), max_iter=100, random_state=seed),
+        "model_lr.pkl": LinearRegression(),
+    }
+    for filename, model in models.items():
+        model.fit(X, y)
+        joblib.dump(model, os.path.join(workdir, "models", filename))
+    joblib.dump(scaler, os.path.join(workdir, "scaler.pkl"))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from ensemble_model import ModelEnsemble
+        joblib.dump(ModelEnsemble(), "ensemble_model.pkl")
+        train_direct_model(history, n_estimators=30, max_depth=4, origin_step=24, horizons_per_origin=24, n_jobs=1)
+    finally:
+        os.chdir(cwd)
+    return X
+
+
+# --- Đo thời gian ---
+
+def measure(fn, repeat=5, number=1, warmup=1):
+    """Chạy fn() `number` lần cho mỗi mẫu, `repeat` mẫu. Trả về thống kê giây / 1 lần gọi."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "mean_s": statistics.fmean(samples),
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "max_s": max(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+class Suite:
+    def __init__(self, only=None):
+        self.only = only
+        self.results = []
+
+    def wants(self, name):
+        return not self.only or any(part in name for part in self.only)
+
+    def run(self, name, fn, params=None, items=None, extra=None, **kwargs):
+        """extra: các số đo khác (không phải thời gian) ghi kèm vào kết quả, vd: bytes_per_device."""
+        if not self.wants(name):
+            return
+        stats = measure(fn, **kwargs)
+        result = {"name": name, "params": params or {}, **stats, **(extra or {})}
+        if items:
+            result["items"] = items
+            result["per_item_s"] = stats["median_s"] / items
+        self.results.append(result)
+        label = ", ".join(f"{k}={v}" for k, v in (params or {}).items())
+        suffix = "".join(f"  {k}={v}" for k, v in (extra or {}).items())
+        print(f"  {name:<36} {label:<32} median {stats['median_s'] * 1000:10.3f} ms{suffix}")
+
+
+# --- Các nhóm benchmark ---
+
+def bench_billing(suite, forecast_server, quick):
+    for kwh in (50, 150, 450, 900, 2000):
+        suite.run("billing", lambda: forecast_server.calculate_vietnam_electricity_bill(kwh),
+                  {"kwh": kwh}, repeat=5, number=20000)
+
+
+def bench_models(suite, forecast_server, X, quick):
+    ensemble = forecast_server.ensemble_model
+    models = {"RandomForest": ensemble.rf_model, "XGBoost": ensemble.xgb_model, "MLP": ensemble.mlp_model}
+    if ensemble.has_lr:
+        models["LinearRegression"] = ensemble.lr_model
+    batch_sizes = BATCH_SIZES[:3] if quick else BATCH_SIZES
+    for model_name, model in models.items():
+        for batch in batch_sizes:
+            rows = np.resize(X, (batch, X.shape[1]))
+            suite.run("model_predict", lambda: model.predict(rows),
+                      {"model": model_name, "batch": batch}, items=batch, repeat=5, number=20 if batch <= 64 else 3)
+
+    row = X[:1]
+    for method in ("predict_all", "predict_best", "predict_robust", "predict_conservative"):
+        suite.run("ensemble", lambda: getattr(ensemble, method)(row), {"method": method}, repeat=5, number=50)
+
+
+def bench_forecast(suite, forecast_server, quick):
+    def forecast(history):
+        return forecast_server.forecast_with_ensemble(history.copy())
+
+    # Horizon: lịch sử 720 giờ kết thúc 23h ngày d -> dự báo tới cuối tháng (tháng 31 ngày)
+    for day in (HORIZON_DAYS[::2] if quick else HORIZON_DAYS):
+        history = synthetic_history(f"2024-03-{day:02d} 23:00", 720)
+        horizon = len(pd.date_range(history.index.max() + pd.Timedelta(hours=1), "2024-03-31 23:00", freq='h'))
+        suite.run("forecast_horizon", lambda: forecast(history),
+                  {"end_day": day, "horizon_hours": horizon, "history_hours": 720},
+                  items=horizon or None, repeat=1 if horizon > 240 else 3, number=1)
+
+    # Strategy 'direct': cùng các horizon, 1 lần predict cho cả tháng
+    if forecast_server.direct_bundle is not None:
+        for day in (HORIZON_DAYS[::2] if quick else HORIZON_DAYS):
+            history = synthetic_history(f"2024-03-{day:02d} 23:00", 720)
+            horizon = len(pd.date_range(history.index.max() + pd.Timedelta(hours=1), "2024-03-31 23:00", freq='h'))
+            suite.run("forecast_direct_horizon",
+                      lambda: forecast_server.forecast_direct(history.copy()),
+                      {"end_day": day, "horizon_hours": horizon, "history_hours": 720},
+                      items=horizon or None, repeat=5, number=1)
+
+    # Kích thước lịch sử: horizon cố định 24 giờ (lịch sử kết thúc 23h ngày 30)
+    for size in (HISTORY_SIZES[:2] if quick else HISTORY_SIZES):
+        history = synthetic_history("2024-03-30 23:00", size)
+        suite.run("forecast_history_size", lambda: forecast(history),
+                  {"history_hours": size, "horizon_hours": 24}, items=24, repeat=3, number=1)
+
+
+def bench_storage(suite, app, database, quick):
+    # save_hourly_kwh với bảng đã có sẵn N dòng
+    database.init_db()
+    for prefill in ((168,) if quick else (168, 10000)):
+        with database.lock, database.sqlite3.connect(database.DB_PATH) as conn:
+            conn.execute("DELETE FROM hourly_kwh")
+            conn.executemany("INSERT INTO hourly_kwh (timestamp, kwh) VALUES (?, ?)",
+                             [(ts.strftime("%Y-%m-%dT%H:00:00"), 0.5)
+                              for ts in pd.date_range(end="2024-03-01", periods=prefill, freq='h')])
+        counter = iter(range(10 ** 9))
+        suite.run("save_hourly_kwh", lambda: database.save_hourly_kwh(
+            f"2025-{1 + next(counter) % 12:02d}-01T00:00:00", 0.5), {"table_rows": prefill}, repeat=5, number=50)
+
+    # process_new_energy: mỗi giờ 6 mẫu ENERGY-Total, mẫu đầu giờ mới ghi 1 dòng SQLite
+    readings = 600 if quick else 3000
+    start = datetime(2025, 1, 1)
+
+    def feed():
+        app.previous_energy.clear()
+        total = 100.0
+        for i in range(readings):
+            total += 0.05
+            ts = start + pd.Timedelta(minutes=10 * i)
+            app.process_new_energy("bench-device", str(total), ts.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    suite.run("process_new_energy", feed, {"readings": readings, "readings_per_hour": 6},
+              items=readings, repeat=3, number=1)
+
+
+def bench_device_state(suite, app, quick):
+    """
+    Ingest với N thiết bị, frame giống WebSocket CoreIoT (giá trị dạng chuỗi):
+    update_device_state + handle_alerts (+ persist_energy) mỗi frame, build + encode snapshot
+    /check-data khi mọi thiết bị / 10% thiết bị đã đổi, và RAM state mỗi thiết bị (tracemalloc).
+    """
+    if not suite.wants("device_state"):
+        return
+    rng = np.random.RandomState(SEED)
+    app.alert_engine.set_threshold("bench", 1e9)  # không thiết bị nào vượt ngưỡng -> không RPC
+    stages = [app.update_device_state, app.handle_alerts]
+    if app.FORECAST_ENABLED:
+        stages.append(app.persist_energy)
+    start_ms = int(datetime(2025, 1, 1).timestamp() * 1000)
+
+    def frames(device_ids, step):
+        ts = start_ms + step * 1000  # cùng 1 giờ: persist không ghi SQLite
+        values = rng.uniform(0, 1, size=(len(device_ids), 6))
+        return [{"device_id": device_id, "received_at": 0, "data": {
+            "ENERGY-Voltage": [[ts, f"{215 + 10 * v[0]:.1f}"]], "ENERGY-Current": [[ts, f"{5 * v[1]:.3f}"]],
+            "ENERGY-Power": [[ts, f"{1000 * v[2]:.1f}"]], "ENERGY-Today": [[ts, f"{v[3]:.3f}"]],
+            "ENERGY-Total": [[ts, f"{100 + v[4]:.3f}"]], "ENERGY-Factor": [[ts, f"{v[5]:.2f}"]],
+            "POWER": [[ts, "ON"]]}} for device_id, v in zip(device_ids, values)]
+
+    def ingest(batch):
+        for frame in batch:
+            event = stages[0](frame)
+            for stage in stages[1:]:
+                stage(event)
+
+    for devices in ((1000,) if quick else (1000, 5000)):
+        device_ids = [f"bench-{devices}-{i}" for i in range(devices)]
+        for device_id in device_ids:
+            app.get_or_assign_metadata(device_id)  # metadata dùng chung với cache, không tính vào state
+        first = frames(device_ids, 0)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        ingest(first)
+        bytes_per_device = (tracemalloc.get_traced_memory()[0] - before) // devices
+        tracemalloc.stop()
+        del first
+
+        batch = frames(device_ids, 1)
+        suite.run("device_state_frame", lambda: ingest(batch), {"devices": devices, "stages": len(stages)},
+                  items=len(batch), extra={"bytes_per_device": bytes_per_device}, repeat=5, number=1)
+
+        for share in (100, 10):
+            changed = [app.device_registry.get(device_id) for device_id in device_ids[:devices * share // 100]]
+
+            def rebuild():
+                for device in changed:
+                    device.version += 1  # như khi giá trị thay đổi: phần tử + JSON của thiết bị build lại
+                app.device_snapshot.bump()
+                app.device_snapshot.get()
+            suite.run("device_snapshot_rebuild", rebuild, {"devices": devices, "changed_pct": share},
+                      repeat=5, number=1)
+    app.alert_engine.remove_client("bench")
+
+
+# --- Chạy & so sánh ---
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    versions = {}
+    for module in ("numpy", "pandas", "sklearn", "xgboost", "joblib"):
+        try:
+            versions[module] = __import__(module).__version__
+        except Exception:
+            versions[module] = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+        "seed": SEED
+    }
+
+
+def compare(old_path, results):
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+    print(f"\nSo sánh với {old_path} (median, >1 = chậm hơn):")
+    for result in results:
+        previous = old.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if previous:
+            ratio = result["median_s"] / previous["median_s"] if previous["median_s"] else float("inf")
+            print(f"  {result['name']:<24} {json.dumps(result['params']):<60} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast/ingest hot path benchmarks")
+    parser.add_argument("--quick", action="store_true", help="fewer cases (smoke run)")
+    parser.add_argument("--only", nargs="*", help="run only benchmarks whose name contains one of these")
+    parser.add_argument("--output", help="JSON output path (default: benchmarks/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    info = environment_info()
+    output = args.output or os.path.join(
+        BACKEND_DIR, "benchmarks", f"{info['commit'] or 'local'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    output = os.path.abspath(output)
+
+    workdir = tempfile.mkdtemp(prefix="smartplug-bench-")
+    cwd = os.getcwd()
+    suite = Suite(args.only)
+    try:
+        print(f"Training tiny models in {workdir} ...")
+        X = train_tiny_models(workdir)
+
+        # forecast_server / app / database đọc file theo đường dẫn tương đối -> chạy trong workdir
+        os.chdir(workdir)
+        for key, value in (("JWT_TOKEN", "bench"), ("DEVICE_ID", "bench"), ("GROUP_ID", "bench")):
+            os.environ.setdefault(key, value)
+        os.environ["FORECAST_PRECOMPUTE"] = "0"  # process_new_energy không được kích forecast nền
+        import forecast_server
+        import database
+        import app
+        forecast_server.load_models()
+
+        print("Running benchmarks ...")
+        bench_billing(suite, forecast_server, args.quick)
+        bench_models(suite, forecast_server, X, args.quick)
+        bench_forecast(suite, forecast_server, args.quick)
+        bench_storage(suite, app, database, args.quick)
+        bench_device_state(suite, app, args.quick)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": dict(info, quick=args.quick), "results": suite.results}, f, indent=2)
+    print(f"\nSaved {len(suite.results)} results to {output}")
+
+    if args.compare:
+        compare(args.compare, suite.results)
+
+
+if __name__ == "__main__":
+    main()
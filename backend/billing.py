@@ -0,0 +1,25 @@
+# billing.py
+# Tính tiền điện sinh hoạt theo bậc thang (dùng chung cho forecast_server và dự báo dự phòng của app).
+
+
+def calculate_vietnam_electricity_bill(total_kwh):
+    tiers = [
+        (100, 1984),   # Bậc 1
+        (100, 2050),   # Bậc 2
+        (200, 2380),   # Bậc 3
+        (200, 2998),   # Bậc 4
+        (200, 3350),   # Bậc 5
+        (float('inf'), 3460)  # Bậc 6
+    ]
+    
+    bill = 0
+    kwh_remaining = total_kwh
+    
+    for tier_limit, price in tiers:
+        if kwh_remaining <= 0:
+            break
+        kwh_in_tier = min(kwh_remaining, tier_limit)
+        bill += kwh_in_tier * price
+        kwh_remaining -= kwh_in_tier
+    
+    return bill * 1.08  # VAT 8%
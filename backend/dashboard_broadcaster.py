@@ -0,0 +1,91 @@
+# dashboard_broadcaster.py
+import logging
+import threading
+import time
+from datetime import datetime
+
+
+class DashboardBroadcaster:
+    """
+    Gom các update của thiết bị theo cửa sổ thời gian (mặc định 250 ms) và
+    emit 1 lần cho cả room, chỉ gồm các field đã thay đổi so với lần gửi trước.
+
+    Giá trị mới ghi đè giá trị cũ chưa kịp gửi, nên client chậm (hoặc khi emit
+    mất nhiều thời gian hơn cửa sổ) chỉ nhận giá trị mới nhất. Số emit/giây chỉ
+    phụ thuộc vào cửa sổ, không phụ thuộc tần suất frame.
+    Snapshot đầy đủ chỉ gửi khi client join (xem handle_join_dashboard).
+    observe_latency(seconds): nếu có, gọi cho mỗi thiết bị được emit với thời gian
+    từ frame sớm nhất đang chờ (received_at, time.monotonic()) tới lúc emit.
+    """
+
+    SECTIONS = ("telemetry", "attributes", "metadata")
+
+    def __init__(self, emit, window=0.25, event='dashboard_update', room='dashboard', observe_latency=None):
+        self._emit = emit
+        self._observe_latency = observe_latency
+        self.window = window
+        self.event = event
+        self.room = room
+        self._lock = threading.Lock()
+        self._pending = {}     # device_id -> {section: {key: value}}
+        self._pending_since = {}  # device_id -> received_at của frame sớm nhất đang chờ
+        self._last_sent = {}   # device_id -> {section: {key: value}}
+        self._started = False
+        self.flushes = 0
+
+    def publish(self, device_id, changes, received_at=None):
+        """changes: {section: {key: value}} -> chỉ giữ lại field khác với lần gửi trước."""
+        with self._lock:
+            sent = self._last_sent.get(device_id, {})
+            pending = self._pending.setdefault(device_id, {})
+            for section, values in changes.items():
+                sent_section = sent.get(section, {})
+                for key, value in values.items():
+                    if key in sent_section and sent_section[key] == value:
+                        # Quay về giá trị đã gửi -> bỏ update đang chờ
+                        pending.get(section, {}).pop(key, None)
+                    else:
+                        pending.setdefault(section, {})[key] = value
+            if not any(pending.values()):
+                del self._pending[device_id]
+                self._pending_since.pop(device_id, None)
+            elif received_at is not None and device_id not in self._pending_since:
+                self._pending_since[device_id] = received_at
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            since, self._pending_since = self._pending_since, {}
+            for device_id, delta in pending.items():
+                sent = self._last_sent.setdefault(device_id, {})
+                for section, values in delta.items():
+                    sent.setdefault(section, {}).update(values)
+
+        if not pending:
+            return 0
+
+        self._emit(self.event, {
+            "updates": [{"device_id": device_id, "data": delta} for device_id, delta in pending.items()],
+            "timestamp": datetime.now().isoformat()
+        }, room=self.room)
+        self.flushes += 1
+        if self._observe_latency is not None:
+            now = time.monotonic()
+            for received_at in since.values():
+                self._observe_latency(now - received_at)
+        return len(pending)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="dashboard-broadcaster", daemon=True).start()
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Dashboard broadcast error: {e}")
+            time.sleep(max(0, self.window - (time.monotonic() - started)))
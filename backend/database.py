@@ -3,10 +3,22 @@ import os
 from threading import Lock
 
 DB_PATH = "data/power_history.db"
-os.makedirs("data", exist_ok=True)
 lock = Lock()
+_init_lock = Lock()
+_initialized = False
+
+def _connect():
+    """Connection tới DB; lần đầu gọi mới tạo thư mục/bảng (import module không đụng tới đĩa)."""
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_db()
+                _initialized = True
+    return sqlite3.connect(DB_PATH, check_same_thread=False)
 
 def init_db():
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
     with sqlite3.connect(DB_PATH, check_same_thread=False) as conn:
         conn.execute("""CREATE TABLE IF NOT EXISTS hourly_kwh (
             timestamp TEXT PRIMARY KEY,
@@ -17,29 +29,124 @@ def init_db():
             r2_rf REAL, r2_xgb REAL, r2_mlp REAL, r2_lr REAL,
             note TEXT
         )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS forecast_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            consumed_kwh REAL,
+            total_kwh_forecasted REAL,
+            total_kwh_month REAL,
+            bill_vnd INTEGER,
+            horizon_hours INTEGER
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_forecast_history_created_at ON forecast_history (created_at)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS model_updates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            updated_at TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            new_hours INTEGER,
+            xgb_trees_added INTEGER,
+            seconds REAL,
+            note TEXT
+        )""")
         conn.commit()
 
 def save_hourly_kwh(timestamp_iso: str, kwh: float):
     with lock:
-        with sqlite3.connect(DB_PATH, check_same_thread=False) as conn:
+        with _connect() as conn:
             conn.execute("INSERT OR REPLACE INTO hourly_kwh (timestamp, kwh) VALUES (?, ?)",
                         (timestamp_iso, round(kwh, 6)))
             conn.commit()
 
 def get_all_history():
-    with sqlite3.connect(DB_PATH, check_same_thread=False) as conn:
+    with _connect() as conn:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute("SELECT timestamp, kwh FROM hourly_kwh ORDER BY timestamp")
         rows = cur.fetchall()
         return {row["timestamp"]: row["kwh"] for row in rows}
 
+def iter_history(start_iso=None, batch_size=5000):
+    """Stream (timestamp, kwh) theo thứ tự thời gian, đọc từng batch thay vì fetchall cả bảng."""
+    query = "SELECT timestamp, kwh FROM hourly_kwh"
+    params = []
+    if start_iso:
+        query += " WHERE timestamp >= ?"
+        params.append(start_iso)
+    query += " ORDER BY timestamp"
+    with _connect() as conn:
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+def get_history_range(start_iso=None, end_iso=None):
+    """hourly_kwh trong [start, end] (theo thứ tự thời gian)."""
+    query = "SELECT timestamp, kwh FROM hourly_kwh WHERE 1=1"
+    params = []
+    if start_iso:
+        query += " AND timestamp >= ?"
+        params.append(start_iso)
+    if end_iso:
+        query += " AND timestamp <= ?"
+        params.append(end_iso)
+    query += " ORDER BY timestamp"
+    with _connect() as conn:
+        return {timestamp: kwh for timestamp, kwh in conn.execute(query, params)}
+
 def log_training_result(date_str, scores: dict, note=""):
-    with sqlite3.connect(DB_PATH, check_same_thread=False) as conn:
+    with _connect() as conn:
         conn.execute("""INSERT OR REPLACE INTO training_log 
             (date, r2_rf, r2_xgb, r2_mlp, r2_lr, note)
             VALUES (?, ?, ?, ?, ?, ?)""",
             (date_str, scores['rf'], scores['xgb'], scores['mlp'], scores['lr'], note))
         conn.commit()
 
-init_db()
\ No newline at end of file
+FORECAST_HISTORY_COLUMNS = ["id", "created_at", "consumed_kwh", "total_kwh_forecasted",
+                            "total_kwh_month", "bill_vnd", "horizon_hours"]
+
+def save_forecast_result(created_at_iso: str, consumed_kwh: float, total_kwh_forecasted: float,
+                         total_kwh_month: float, bill_vnd: int, horizon_hours: int):
+    with lock:
+        with _connect() as conn:
+            cur = conn.execute("""INSERT INTO forecast_history
+                (created_at, consumed_kwh, total_kwh_forecasted, total_kwh_month, bill_vnd, horizon_hours)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (created_at_iso, consumed_kwh, total_kwh_forecasted, total_kwh_month, bill_vnd, horizon_hours))
+            conn.commit()
+            return cur.lastrowid
+
+def get_forecast_history(start_iso=None, end_iso=None, limit=100):
+    """Lịch sử forecast (mới nhất trước), lọc theo created_at trong [start, end]."""
+    query = f"SELECT {', '.join(FORECAST_HISTORY_COLUMNS)} FROM forecast_history WHERE 1=1"
+    params = []
+    if start_iso:
+        query += " AND created_at >= ?"
+        params.append(start_iso)
+    if end_iso:
+        query += " AND created_at <= ?"
+        params.append(end_iso)
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+
+    with _connect() as conn:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute(query, params)]
+
+def log_model_update(updated_at_iso: str, last_timestamp: str, new_hours: int,
+                     xgb_trees_added: int, seconds: float, note=""):
+    with lock:
+        with _connect() as conn:
+            conn.execute("""INSERT INTO model_updates
+                (updated_at, last_timestamp, new_hours, xgb_trees_added, seconds, note)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (updated_at_iso, last_timestamp, new_hours, xgb_trees_added, seconds, note))
+            conn.commit()
+
+def get_last_model_update():
+    """Lần incremental update gần nhất (dict) hoặc None."""
+    with _connect() as conn:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM model_updates ORDER BY id DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
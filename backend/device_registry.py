@@ -0,0 +1,203 @@
+# device_registry.py
+# Trạng thái mới nhất của các thiết bị trong process ingest (thay cho latest_data: dict lồng dict).
+#
+# Telemetry số được parse sang float 1 lần lúc nhận frame và lưu theo cột trong 2 array('d') chung
+# cho cả registry (mỗi thiết bị 1 hàng TELEMETRY_KEYS ô): giá trị và thời điểm cập nhật (ms, theo ts
+# của CoreIoT). Mỗi thiết bị chỉ còn 1 object __slots__ (metadata, POWER, vị trí hàng).
+#   - ô chưa từng nhận: updated_at = 0 -> không có trong "telemetry" (như dict cũ)
+#   - nhận "N/A" / giá trị không phải số: NaN -> trả "N/A"
+# Serialize ra đúng các shape cũ: entry() = {"telemetry", "attributes", "metadata"} (shared state),
+# device_list() = danh sách của /check-data và join_dashboard. Giá trị telemetry là số (trước là
+# chuỗi CoreIoT gửi), frontend vẫn parseFloat/Number được.
+# Mỗi thiết bị giữ phần tử danh sách + JSON đã encode của lần serialize trước (theo version của
+# thiết bị), nên build lại snapshot chỉ tốn công cho các thiết bị đã đổi.
+#
+# Ghi: stage "state" (1 worker) + thread polling; thêm thiết bị có lock, ghi 1 ô là 1 thao tác
+# array nên không cần lock như latest_data trước đây.
+import json
+import threading
+import time
+from array import array
+
+NOT_AVAILABLE = "N/A"
+NAN = float("nan")
+UNKNOWN_METADATA = {"type": "unknown", "name": "Unknown", "location": "N/A"}
+
+
+def device_list_item(device_id, entry):
+    """{"telemetry", "attributes", "metadata"} -> 1 phần tử của /check-data."""
+    meta = entry.get("metadata") or UNKNOWN_METADATA
+    return {
+        "type": meta["type"],
+        "name": meta["name"],
+        "location": meta["location"],
+        "id": device_id,
+        "attributes": dict(entry.get("attributes", {})),
+        "telemetry": dict(entry.get("telemetry", {}))
+    }
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_item(item):
+    return _json_encoder.encode(item).encode('utf-8')
+
+
+class DeviceState:
+    __slots__ = ("device_id", "row", "metadata", "power", "power_updated_at", "version", "cached")
+
+    def __init__(self, device_id, row, metadata):
+        self.device_id = device_id
+        self.row = row                # offset của hàng trong DeviceRegistry.values / updated_at
+        self.metadata = metadata
+        self.power = NOT_AVAILABLE
+        self.power_updated_at = 0
+        self.version = 0              # tăng sau mỗi lần giá trị trả ra API đổi
+        self.cached = None            # (version, phần tử device_list, JSON bytes | None)
+
+
+class DeviceRegistry:
+    """
+    Dùng gần như dict device_id -> DeviceState (get / in / len / iter); đọc giá trị qua
+    value() / field_updated_at() / telemetry() của registry.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.index = {key: i for i, key in enumerate(self.fields)}
+        self.values = array('d')
+        self.updated_at = array('d')
+        self._devices = {}
+        self._blank_values = array('d', [NAN] * self.width)
+        self._blank_updated = array('d', [0.0] * self.width)
+        self._lock = threading.Lock()
+
+    # --- dict-like API ---
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def __iter__(self):
+        return iter(list(self._devices))
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def add(self, device_id, metadata):
+        """Thêm thiết bị (chưa có telemetry, POWER = "N/A"); đã có thì trả về DeviceState cũ."""
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                row = len(self.values)
+                self.values.extend(self._blank_values)
+                self.updated_at.extend(self._blank_updated)
+                device = self._devices[device_id] = DeviceState(device_id, row, metadata)
+            return device
+
+    # --- ghi ---
+    def update(self, device, data):
+        """
+        data: như frame WebSocket CoreIoT {key: [[ts_ms, value], ...]} (lấy mẫu đầu, ts_ms None -> giờ
+        hiện tại), key ngoài `fields` bị bỏ qua. Giá trị str/int/float -> float, "N/A" / không phải số -> NaN.
+        Trả về (telemetry đã parse {key: float | "N/A"}, changed).
+        """
+        values, updated_at, index, row = self.values, self.updated_at, self.index, device.row
+        parsed = {}
+        changed = False
+        for key, samples in data.items():
+            i = index.get(key)
+            if i is None:
+                continue
+            ts_ms, raw = samples[0]
+            try:
+                value = float(raw)
+            except (TypeError, ValueError):
+                value = NAN
+            pos = row + i
+            if not changed:
+                old = values[pos]
+                # NaN -> NaN ("N/A" lặp lại) không tính là thay đổi
+                changed = not updated_at[pos] or (old != value and (old == old or value == value))
+            values[pos] = value
+            updated_at[pos] = ts_ms or time.time() * 1000
+            parsed[key] = value if value == value else NOT_AVAILABLE
+        if changed:
+            device.version += 1
+        return parsed, changed
+
+    def set_power(self, device, value, ts_ms=None):
+        """Trả về giá trị POWER cũ."""
+        old, device.power = device.power, value
+        device.power_updated_at = ts_ms or time.time() * 1000
+        if old != value:
+            device.version += 1
+        return old
+
+    # --- đọc ---
+    def value(self, device, key):
+        """float (NaN nếu chưa có / "N/A")."""
+        return self.values[device.row + self.index[key]]
+
+    def field_updated_at(self, device, key):
+        """Thời điểm (ms) nhận giá trị gần nhất của key, None nếu chưa từng nhận."""
+        return self.updated_at[device.row + self.index[key]] or None
+
+    def telemetry(self, device):
+        """{key: float | "N/A"} các field đã từng nhận (shape "telemetry" cũ)."""
+        end = device.row + self.width
+        return {key: value if value == value else NOT_AVAILABLE
+                for key, value, ts in zip(self.fields, self.values[device.row:end], self.updated_at[device.row:end])
+                if ts}
+
+    def entry(self, device_id):
+        """Shape cũ của latest_data[device_id] (ghi vào shared state)."""
+        device = self._devices[device_id]
+        return {"telemetry": self.telemetry(device), "attributes": {"POWER": device.power},
+                "metadata": device.metadata}
+
+    def device_list(self):
+        """
+        Danh sách thiết bị theo shape của /check-data và join_dashboard. Phần tử của thiết bị
+        không đổi từ lần gọi trước được dùng lại (caller không được sửa).
+        """
+        items = []
+        for device in list(self._devices.values()):
+            cached = device.cached
+            if cached is None or cached[0] != device.version:
+                # Đọc version trước khi build: ghi xen giữa -> version mới hơn -> lần sau build lại
+                version = device.version
+                cached = device.cached = (version, {
+                    "type": device.metadata["type"],
+                    "name": device.metadata["name"],
+                    "location": device.metadata["location"],
+                    "id": device.device_id,
+                    "attributes": {"POWER": device.power},
+                    "telemetry": self.telemetry(device)
+                }, None)
+            items.append(cached[1])
+        return items
+
+    def encode_device_list(self, items):
+        """JSON array của `items` (kết quả device_list()), dùng lại JSON đã encode của phần tử không đổi."""
+        parts = []
+        for item in items:
+            device = self._devices.get(item["id"])
+            cached = device.cached if device is not None else None
+            if cached is None or cached[1] is not item:
+                parts.append(encode_item(item))
+                continue
+            if cached[2] is None:
+                cached = device.cached = (cached[0], item, encode_item(item))
+            parts.append(cached[2])
+        return b"[" + b",".join(parts) + b"]"
+
+    def load(self, device_id, entry):
+        """Nạp lại 1 thiết bị từ shape cũ (vd: shared state lúc restart); thời điểm = lúc nạp."""
+        device = self.add(device_id, entry.get("metadata") or UNKNOWN_METADATA)
+        self.update(device, {key: [[None, value]] for key, value in entry.get("telemetry", {}).items()})
+        self.set_power(device, entry.get("attributes", {}).get("POWER", NOT_AVAILABLE))
+        return device
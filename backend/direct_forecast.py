@@ -0,0 +1,96 @@
+# direct_forecast.py
+# Dự báo trực tiếp nhiều bước (horizon là 1 feature): 1 model dự báo kWh tại origin + h
+# chỉ từ dữ liệu đã biết tại origin, nên cả phần còn lại của tháng là 1 lần predict
+# vector hóa (không lặp đệ quy, sai số không cộng dồn theo từng bước).
+#
+# Feature cho mỗi giờ đích t = origin + h:
+#   hour, dayofweek, month, is_weekend   (lịch của giờ đích)
+#   horizon                              (h, tính bằng giờ)
+#   kwh_same_hour_last_day               (giờ gần nhất <= origin cùng giờ trong ngày với t)
+#   kwh_same_hour_last_week              (giờ gần nhất <= origin cùng giờ trong tuần với t)
+#   kwh_mean_24h, kwh_mean_168h          (trung bình 24h / 168h tính đến origin)
+import numpy as np
+import pandas as pd
+
+TARGET = 'kwh_hour'
+DIRECT_FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend', 'horizon',
+                   'kwh_same_hour_last_day', 'kwh_same_hour_last_week',
+                   'kwh_mean_24h', 'kwh_mean_168h']
+MAX_HORIZON = 744  # 31 ngày
+DIRECT_MODEL_PATH = "models/model_direct.pkl"
+
+
+def hourly_values(history_df):
+    """Chuỗi kWh liên tục theo giờ (giờ thiếu được ffill/bfill) -> (mảng giá trị, origin)."""
+    series = history_df[TARGET].sort_index()
+    series = series[~series.index.duplicated(keep='last')].asfreq('h').ffill().bfill()
+    return series.to_numpy(dtype=float), series.index[-1]
+
+
+def build_direct_features(values, origin, horizons):
+    """
+    values: kWh theo giờ, phần tử cuối là giờ origin. horizons: mảng h >= 1.
+    Trả về DataFrame DIRECT_FEATURES, 1 dòng cho mỗi horizon.
+    """
+    horizons = np.asarray(horizons, dtype=np.int64)
+    n = len(values)
+    last = n - 1
+    targets = pd.DatetimeIndex(origin + pd.to_timedelta(horizons, unit='h'))
+
+    day_idx = last + horizons - 24 * ((horizons + 23) // 24)
+    week_idx = last + horizons - 168 * ((horizons + 167) // 168)
+    same_day = values[np.clip(day_idx, 0, last)]
+    same_week = np.where(week_idx >= 0, values[np.clip(week_idx, 0, last)], same_day)
+
+    return pd.DataFrame({
+        'hour': targets.hour,
+        'dayofweek': targets.dayofweek,
+        'month': targets.month,
+        'is_weekend': (targets.dayofweek >= 5).astype(int),
+        'horizon': horizons,
+        'kwh_same_hour_last_day': same_day,
+        'kwh_same_hour_last_week': same_week,
+        'kwh_mean_24h': np.full(len(horizons), values[-24:].mean()),
+        'kwh_mean_168h': np.full(len(horizons), values[-168:].mean()),
+    }, columns=DIRECT_FEATURES)
+
+
+def make_training_set(series, origin_step=6, horizons_per_origin=48, max_horizon=MAX_HORIZON, seed=42):
+    """
+    Tập train từ chuỗi kWh theo giờ (pd.Series index datetime): origin cách nhau origin_step giờ,
+    mỗi origin lấy ngẫu nhiên horizons_per_origin horizon trong [1, max_horizon].
+    Trả về (X DataFrame, y ndarray, origin index của mỗi dòng để chia train/test theo thời gian).
+    """
+    series = series.sort_index().asfreq('h').ffill().bfill()
+    values = series.to_numpy(dtype=float)
+    rng = np.random.RandomState(seed)
+
+    frames, targets, origins = [], [], []
+    for origin_pos in range(168, len(values) - 1, origin_step):
+        limit = min(max_horizon, len(values) - 1 - origin_pos)
+        horizons = rng.randint(1, limit + 1, size=min(horizons_per_origin, limit))
+        frames.append(build_direct_features(values[:origin_pos + 1], series.index[origin_pos], horizons))
+        targets.append(values[origin_pos + horizons])
+        origins.append(np.full(len(horizons), origin_pos))
+    return pd.concat(frames, ignore_index=True), np.concatenate(targets), np.concatenate(origins)
+
+
+def predict_to_end_of_month(bundle, history_df):
+    """
+    bundle: dict {"model", "features", "max_horizon"} (models/model_direct.pkl).
+    Trả về (total_kwh, hourly_predictions, hourly_details) giống forecast_with_ensemble.
+    """
+    values, origin = hourly_values(history_df)
+    # Cùng mốc kết thúc với forecast_with_ensemble để 2 strategy so sánh được với nhau
+    end_of_month = (origin + pd.offsets.MonthEnd(0)).floor('h')
+    hours = int((end_of_month - origin) / pd.Timedelta(hours=1))
+    if hours <= 0:
+        return 0, [], {}
+
+    horizons = np.arange(1, min(hours, bundle.get("max_horizon", MAX_HORIZON)) + 1)
+    features = build_direct_features(values, origin, horizons)[bundle.get("features", DIRECT_FEATURES)]
+    predictions = np.round(np.maximum(bundle["model"].predict(features).astype(float), 0), 4).tolist()
+
+    timestamps = origin + pd.to_timedelta(horizons, unit='h')
+    details = {ts.isoformat(): {"Direct": value} for ts, value in zip(timestamps, predictions)}
+    return sum(predictions), predictions, details
@@ -1,5 +1,24 @@
 import joblib
+import time
 import numpy as np
+from metrics import REGISTRY
+
+MODEL_INFERENCE_SECONDS = REGISTRY.histogram(
+    "forecast_model_inference_seconds", "predict() time per model",
+    ("model",), buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+)
+
+def _timed_predict(name, model, input_data):
+    start = time.perf_counter()
+    value = model.predict(input_data)[0]
+    MODEL_INFERENCE_SECONDS.observe(time.perf_counter() - start, name)
+    return value
+
+def _timed_predict_batch(name, model, input_data):
+    start = time.perf_counter()
+    values = np.asarray(model.predict(input_data), dtype=np.float64)
+    MODEL_INFERENCE_SECONDS.observe(time.perf_counter() - start, name)
+    return values
 
 class ModelEnsemble:
     def __init__(self):
@@ -7,6 +26,8 @@ class ModelEnsemble:
         self.rf_model = joblib.load("models/model_rf.pkl")
         self.xgb_model = joblib.load("models/model_xgb.pkl")
         self.mlp_model = joblib.load("models/model_mlp.pkl")
+        # Scaler đi cùng ensemble_model.pkl -> cặp model/scaler nạp lên luôn khớp nhau
+        self.scaler = joblib.load("scaler.pkl")
         
         # [OPTIONAL] Vẫn load LR để backward compatible
         try:
@@ -27,14 +48,14 @@ class ModelEnsemble:
     def predict_all(self, input_data):
         """Dự đoán từ các mô hình tốt"""
         preds = {
-            "RandomForest": self.rf_model.predict(input_data)[0],
-            "XGBoost": self.xgb_model.predict(input_data)[0],
-            "MLP": self.mlp_model.predict(input_data)[0],
+            "RandomForest": _timed_predict("RandomForest", self.rf_model, input_data),
+            "XGBoost": _timed_predict("XGBoost", self.xgb_model, input_data),
+            "MLP": _timed_predict("MLP", self.mlp_model, input_data),
         }
         
         # [OPTIONAL] Thêm LR chỉ để so sánh (không tham gia ensemble)
         if self.has_lr:
-            preds["LinearRegression"] = self.lr_model.predict(input_data)[0]
+            preds["LinearRegression"] = _timed_predict("LinearRegression", self.lr_model, input_data)
         
         preds = {model: float(round(value, 4)) for model, value in preds.items()}
         return preds
@@ -118,20 +139,7 @@ class ModelEnsemble:
         xgb_pred = all_preds["XGBoost"]
         rf_pred = all_preds["RandomForest"]
         
-        # 1. Lấy điểm số hiện tại (được cập nhật qua feedback)
-        score_xgb = self.model_scores.get("XGBoost", 1.0)
-        score_rf = self.model_scores.get("RandomForest", 0.95)
-        
-        # 2. Tính tổng để chuẩn hóa trọng số
-        total_score = score_xgb + score_rf
-        
-        # Tránh lỗi chia cho 0 (dù khó xảy ra vì min score là 0.3)
-        if total_score == 0:
-            weight_xgb = 0.55
-            weight_rf = 0.45
-        else:
-            weight_xgb = score_xgb / total_score
-            weight_rf = score_rf / total_score
+        weight_xgb, weight_rf = self._conservative_weights()
             
         # 3. Tính Weighted Average
         conservative_pred = (xgb_pred * weight_xgb + rf_pred * weight_rf)
@@ -143,6 +151,37 @@ class ModelEnsemble:
         
         return conservative_pred, all_preds
 
+    def _conservative_weights(self):
+        # 1. Lấy điểm số hiện tại (được cập nhật qua feedback)
+        score_xgb = self.model_scores.get("XGBoost", 1.0)
+        score_rf = self.model_scores.get("RandomForest", 0.95)
+        
+        # 2. Tính tổng để chuẩn hóa trọng số
+        total_score = score_xgb + score_rf
+        
+        # Tránh lỗi chia cho 0 (dù khó xảy ra vì min score là 0.3)
+        if total_score == 0:
+            return 0.55, 0.45
+        return score_xgb / total_score, score_rf / total_score
+
+    def predict_all_batch(self, input_data):
+        """Như predict_all cho nhiều dòng: {model: mảng prediction}, mỗi model chỉ predict 1 lần"""
+        preds = {
+            "RandomForest": _timed_predict_batch("RandomForest", self.rf_model, input_data),
+            "XGBoost": _timed_predict_batch("XGBoost", self.xgb_model, input_data),
+            "MLP": _timed_predict_batch("MLP", self.mlp_model, input_data),
+        }
+        if self.has_lr:
+            preds["LinearRegression"] = _timed_predict_batch("LinearRegression", self.lr_model, input_data)
+        return {model: np.round(values, 4) for model, values in preds.items()}
+
+    def predict_conservative_batch(self, input_data):
+        """Như predict_conservative cho nhiều dòng -> (mảng prediction, {model: mảng})"""
+        all_preds = self.predict_all_batch(input_data)
+        weight_xgb, weight_rf = self._conservative_weights()
+        conservative = all_preds["XGBoost"] * weight_xgb + all_preds["RandomForest"] * weight_rf
+        return np.round(np.maximum(0, conservative), 4), all_preds
+
     def update_scores(self, predicted_details, actual_value):
         """
         Cập nhật scores CHỈ cho models trong ensemble
@@ -0,0 +1,167 @@
+# forecast_jobs.py
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ForecastJob:
+    """Một lần chạy forecast; nhiều request cùng snapshot dữ liệu dùng chung 1 job."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "running"   # running | done | error
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.waiters = 1
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "waiters": self.waiters
+        }
+        if self.status == "error":
+            data["error"] = self.error
+        if include_result and self.status == "done":
+            data["result"] = self.result
+        return data
+
+
+class ForecastJobManager:
+    """
+    Single-flight: submit(key, fn) với key đang chạy -> trả về job đang chạy
+    thay vì chạy forecast mới. fn() trả về result (dict) hoặc None nếu lỗi.
+    on_complete(job) được gọi sau khi job xong (vd: push qua Socket.IO).
+    """
+
+    def __init__(self, on_complete=None, max_workers=1, max_jobs=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="forecast-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()   # job_id -> job (giữ max_jobs job gần nhất)
+        self._inflight = {}          # key -> job
+        self._on_complete = on_complete
+        self._max_jobs = max_jobs
+
+    def submit(self, key, fn):
+        """Trả về (job, joined). joined=True nếu đã có job cùng key đang chạy."""
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                job.waiters += 1
+                return job, True
+
+            job = ForecastJob(key)
+            self._inflight[key] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.status == "running":
+                    break
+                del self._jobs[oldest_id]
+
+        self._executor.submit(self._run, job, fn)
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def inflight(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def _run(self, job, fn):
+        try:
+            result = fn()
+            if result is None:
+                job.status, job.error = "error", "AI Server not responding"
+            else:
+                job.status, job.result = "done", result
+        except Exception as e:
+            logging.error(f"Forecast job {job.id} failed: {e}")
+            job.status, job.error = "error", str(e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+            job._done.set()
+
+        if self._on_complete:
+            try:
+                self._on_complete(job)
+            except Exception as e:
+                logging.error(f"Forecast job {job.id} on_complete error: {e}")
+
+
+class ForecastPrecomputer:
+    """
+    Chạy forecast nền khi dữ liệu đầu vào đổi (app: mỗi lần process_new_energy đóng 1 giờ).
+    trigger() hẹn 1 lần chạy sau delay + jitter ngẫu nhiên (0..jitter giây):
+      - đã có lần hẹn chưa chạy -> gộp vào lần đó (lúc chạy mới lấy snapshot, nên gồm cả giờ vừa đóng)
+      - đang chạy -> bỏ qua (skip-if-running)
+    submit() -> (job, joined) hoặc None (chưa có dữ liệu), như submit_forecast_job của app.
+    """
+
+    def __init__(self, submit, delay=30.0, jitter=30.0, on_outcome=None):
+        self._submit = submit
+        self.delay = delay
+        self.jitter = jitter
+        self._on_outcome = on_outcome or (lambda outcome: None)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._running = False
+        self.last_run_at = None
+
+    def trigger(self):
+        """Trả về True nếu đã hẹn 1 lần chạy mới."""
+        with self._lock:
+            if self._running:
+                outcome = "skipped_running"
+            elif self._timer is not None:
+                outcome = "coalesced"
+            else:
+                self._timer = threading.Timer(self.delay + random.uniform(0, self.jitter), self._run)
+                self._timer.daemon = True
+                self._timer.start()
+                outcome = "scheduled"
+        self._on_outcome(outcome)
+        return outcome == "scheduled"
+
+    def pending(self):
+        with self._lock:
+            return self._timer is not None or self._running
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+            self._running = True
+        outcome = "error"
+        try:
+            submitted = self._submit()
+            if submitted is None:
+                outcome = "no_data"
+            else:
+                job, _ = submitted
+                job.wait()
+                outcome = "done" if job.status == "done" else "error"
+        except Exception as e:
+            logging.error(f"Forecast precompute failed: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+                self.last_run_at = time.time()
+        self._on_outcome(outcome)
@@ -1,20 +1,87 @@
 import asyncio
 import websockets
 import json
-import pandas as pd
-import numpy as np
-import joblib
-from ensemble_model import ModelEnsemble
+import os
+import threading
+import time
+from metrics import REGISTRY, start_http_server
+from profiling import Profiler
+from startup import StartupTimer
+from billing import calculate_vietnam_electricity_bill
+from request_scheduler import RequestScheduler, Overloaded
+
+# Khởi động nhanh: socket mở ngay, pandas/sklearn/xgboost + model chỉ được import/nạp trong
+# load_models() ở thread nền. Client gửi {"Type": "Health"} để biết lúc nào forecast được;
+# request forecast đến sớm thì đợi model tối đa MODEL_WAIT_SECONDS.
+startup = StartupTimer(REGISTRY, log=print)
+
+# MODEL_FORMAT=compact: đọc models/compact (model_artifact.py export) bằng mmap thay vì unpickle
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "pickle")
+MODEL_WAIT_SECONDS = float(os.getenv("MODEL_WAIT_SECONDS", "60"))
+
+# Strategy mặc định: "recursive" (ensemble, lặp từng giờ) hoặc "direct" (model multi-horizon, 1 lần predict).
+# Request có thể chọn riêng bằng field "Strategy".
+FORECAST_STRATEGY = os.getenv("FORECAST_STRATEGY", "recursive")
+
+# Admission control (request_scheduler.py): tối đa FORECAST_WORKERS forecast chạy song song,
+# FORECAST_QUEUE_SIZE request chờ; quá thì trả {"Error": "Server busy", "RetryAfter": giây} ngay.
+# Feedback / ReloadModels đi lane "priority" riêng, Health trả lời thẳng trên event loop.
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", str(os.cpu_count() or 1)))
+FORECAST_QUEUE_SIZE = int(os.getenv("FORECAST_QUEUE_SIZE", "8"))
+PRIORITY_QUEUE_SIZE = int(os.getenv("PRIORITY_QUEUE_SIZE", "64"))
+
+ensemble_model = None
+scaler = None
+direct_bundle = None
+models_ready = threading.Event()
+model_load_error = None
+# ensemble_model + scaler luôn đổi cùng nhau; forecast chạy trong thread nên đọc qua current_models()
+models_lock = threading.Lock()
+
+def current_models():
+    with models_lock:
+        return ensemble_model, scaler
 
 # --- Tải các mô hình và preprocessors ---
-try:
-    ensemble_model = joblib.load("ensemble_model.pkl")
-    scaler = joblib.load("scaler.pkl")
-except FileNotFoundError:
-    print("Lỗi: Vui lòng chạy 'train_forecast_models.py' và 'run_ensemble.py' trước.")
-    exit()
+def load_models():
+    """Import thư viện nặng + nạp ensemble/scaler, rồi direct model (chạy 1 lần lúc khởi động)."""
+    global ensemble_model, scaler, direct_bundle, model_load_error
+    try:
+        import joblib
+        import pandas  # noqa: F401  (mọi request forecast đều cần, import luôn ở đây)
+        if MODEL_FORMAT == "compact":
+            from model_artifact import CompactEnsemble
+            loaded = CompactEnsemble()
+            loaded_scaler = loaded.scaler
+        else:
+            loaded = joblib.load("ensemble_model.pkl")
+            # ensemble_model.pkl cũ (chưa mang scaler) -> scaler.pkl
+            loaded_scaler = getattr(loaded, "scaler", None) or joblib.load("scaler.pkl")
+    except Exception as e:
+        if isinstance(e, FileNotFoundError) and MODEL_FORMAT == "compact":
+            model_load_error = "Vui lòng chạy 'python model_artifact.py export' trước."
+        elif isinstance(e, FileNotFoundError):
+            model_load_error = "Vui lòng chạy 'train_forecast_models.py' và 'run_ensemble.py' trước."
+        else:
+            model_load_error = f"Model load failed: {e}"
+        print(f"Lỗi: {model_load_error}")
+        models_ready.set()
+        return
+
+    with models_lock:
+        ensemble_model, scaler = loaded, loaded_scaler
+    print(f"Đã tải Ensemble Model và Scaler ({MODEL_FORMAT}).")
+    startup.mark("models_ready")
+    models_ready.set()
 
-print("Đã tải Ensemble Model và Scaler.")
+    # Direct model nạp sau cùng: trong lúc chờ, request "direct" chạy recursive
+    from direct_forecast import DIRECT_MODEL_PATH
+    try:
+        direct_bundle = joblib.load(DIRECT_MODEL_PATH)
+        print("Đã tải Direct multi-horizon model.")
+    except FileNotFoundError:
+        if FORECAST_STRATEGY == "direct":
+            print(f"Cảnh báo: thiếu {DIRECT_MODEL_PATH}, dùng strategy 'recursive'.")
 
 # Tên các cột (giống hệt lúc train)
 FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend',
@@ -22,31 +89,68 @@ FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend',
             'kwh_rolling_mean_24h']
 TARGET = 'kwh_hour'
 
-# --- Hàm tính tiền điện ---
-def calculate_vietnam_electricity_bill(total_kwh):
-    tiers = [
-        (100, 1984),   # Bậc 1
-        (100, 2050),   # Bậc 2
-        (200, 2380),   # Bậc 3
-        (200, 2998),   # Bậc 4
-        (200, 3350),   # Bậc 5
-        (float('inf'), 3460)  # Bậc 6
-    ]
-    
-    bill = 0
-    kwh_remaining = total_kwh
-    
-    for tier_limit, price in tiers:
-        if kwh_remaining <= 0:
-            break
-        kwh_in_tier = min(kwh_remaining, tier_limit)
-        bill += kwh_in_tier * price
-        kwh_remaining -= kwh_in_tier
-    
-    return bill * 1.08  # VAT 8%
+# --- Metrics (GET http://<host>:FORECAST_METRICS_PORT/metrics) ---
+FORECAST_METRICS_PORT = int(os.getenv("FORECAST_METRICS_PORT", "8081"))
+STEP_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+REQUESTS = REGISTRY.counter("forecast_server_requests_total", "Requests by message type and outcome", ("type", "outcome"))
+REQUEST_SECONDS = REGISTRY.histogram("forecast_server_request_seconds", "Request handling time by message type",
+                                     ("type",), buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+STEP_SECONDS = REGISTRY.histogram("forecast_step_seconds", "One recursive forecast step (features + scale + ensemble)",
+                                  buckets=STEP_BUCKETS)
+HORIZON_HOURS = REGISTRY.histogram("forecast_horizon_hours", "Hours forecast per request",
+                                   buckets=(24, 72, 168, 336, 504, 744))
+BATCH_SERIES = REGISTRY.histogram("forecast_batch_series", "Series per PredictBatch request",
+                                  buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+BATCH_STEP_SECONDS = REGISTRY.histogram("forecast_batch_step_seconds",
+                                        "One batched recursive step (all series of a PredictBatch request)",
+                                        buckets=STEP_BUCKETS)
+scheduler = RequestScheduler(REGISTRY)
+scheduler.add_lane("forecast", FORECAST_WORKERS, FORECAST_QUEUE_SIZE)
+scheduler.add_lane("priority", 1, PRIORITY_QUEUE_SIZE)
+CONNECTIONS = REGISTRY.gauge("forecast_server_connections", "Open WebSocket connections")
+FEEDBACK_POINTS = REGISTRY.counter("forecast_feedback_points_total", "Feedback points applied to model scores")
+
+# --- Profiling theo yêu cầu (control message {"Type": "Profile", "Calls": N} hoặc "Seconds": N) ---
+profiler = Profiler(os.getenv("PROFILE_DIR", "profiles"))
 
-# --- Hàm dự báo ---
-async def forecast_with_ensemble(history_df):
+def reload_models():
+    """Nạp lại models/*.pkl + scaler.pkl sau incremental_update.py, giữ model_scores đã học từ feedback."""
+    global ensemble_model, scaler, direct_bundle
+    import joblib
+    from direct_forecast import DIRECT_MODEL_PATH
+    from ensemble_model import ModelEnsemble
+    from model_artifact import CompactEnsemble, export_ensemble
+    from model_io import atomic_dump
+    fresh = ModelEnsemble()
+    fresh.model_scores = dict(ensemble_model.model_scores)
+    new_scaler = fresh.scaler
+    atomic_dump(fresh, "ensemble_model.pkl")
+    if isinstance(ensemble_model, CompactEnsemble):
+        # Xuất lại artifact compact với cùng tùy chọn (float32 / max_depth) rồi mmap bản mới
+        manifest = ensemble_model.manifest
+        export_ensemble(fresh, new_scaler, ensemble_model.directory,
+                        float32=manifest["float32"], max_depth=manifest["max_depth"])
+        fresh = CompactEnsemble(ensemble_model.directory)
+        new_scaler = fresh.scaler
+    if os.path.exists(DIRECT_MODEL_PATH):
+        direct_bundle = joblib.load(DIRECT_MODEL_PATH)
+    # Đổi model + scaler cùng lúc để không request nào thấy cặp lệch nhau
+    with models_lock:
+        ensemble_model, scaler = fresh, new_scaler
+
+def save_ensemble():
+    """Lưu model_scores sau feedback: artifact compact chỉ ghi lại manifest."""
+    from model_artifact import CompactEnsemble
+    from model_io import atomic_dump
+    if isinstance(ensemble_model, CompactEnsemble):
+        ensemble_model.save_scores()
+    else:
+        atomic_dump(ensemble_model, "ensemble_model.pkl")
+
+# --- Hàm dự báo (chạy trong worker của lane "forecast") ---
+def forecast_with_ensemble(history_df):
+    import pandas as pd
+    model, model_scaler = current_models()
     history_df.sort_index(inplace=True)
     start_time = history_df.index.max()
     end_of_month = (start_time + pd.offsets.MonthEnd(0)).floor('h') 
@@ -61,7 +165,9 @@ async def forecast_with_ensemble(history_df):
     hourly_predictions = [] 
     hourly_details = {} 
 
+    HORIZON_HOURS.observe(len(future_timestamps))
     for ts in future_timestamps:
+        step_start = time.perf_counter()
         temp_features = {
             'hour': ts.hour, 
             'dayofweek': ts.dayofweek, 
@@ -101,97 +207,260 @@ async def forecast_with_ensemble(history_df):
             temp_features['kwh_rolling_mean_24h'] = forecast_df.iloc[-1][TARGET]
         
         features_row_df = pd.DataFrame([temp_features], columns=FEATURES).fillna(0)
-        scaled_features = scaler.transform(features_row_df)
+        scaled_features = model_scaler.transform(features_row_df)
         
-        prediction, details = ensemble_model.predict_conservative(scaled_features)
+        prediction, details = model.predict_conservative(scaled_features)
         
         hourly_predictions.append(prediction)
         hourly_details[ts.isoformat()] = details
         
         new_row = pd.DataFrame({TARGET: [prediction]}, index=[ts])
         forecast_df = pd.concat([forecast_df, new_row])
+        STEP_SECONDS.observe(time.perf_counter() - step_start)
 
     total_kwh_forecasted = sum(hourly_predictions)
     return total_kwh_forecasted, hourly_predictions, hourly_details
 
+def forecast_direct(history_df):
+    """Strategy 'direct': dự báo cả phần còn lại của tháng bằng 1 lần predict vector hóa."""
+    from direct_forecast import predict_to_end_of_month
+    total_kwh_forecasted, hourly_predictions, hourly_details = predict_to_end_of_month(direct_bundle, history_df)
+    HORIZON_HOURS.observe(len(hourly_predictions))
+    return total_kwh_forecasted, hourly_predictions, hourly_details
+
+def history_frame(history_raw):
+    """{timestamp: kwh} -> DataFrame cột TARGET, index datetime đã sort (rỗng nếu không có dữ liệu)."""
+    import pandas as pd
+    if not history_raw:
+        print("Cảnh báo: Không có dữ liệu lịch sử.")
+        return pd.DataFrame(columns=[TARGET])
+    history_df = pd.DataFrame.from_dict(history_raw, orient='index', columns=[TARGET])
+    history_df.index = pd.to_datetime(history_df.index)
+    history_df.sort_index(inplace=True)
+    return history_df
+
+def predict_batch(data):
+    """
+    Request "PredictBatch": {"Series": [{"Id", "History", "ConsumedThisMonth"}, ...], "IncludeDetails": bool}.
+    Response dạng cột: mỗi field là 1 list theo thứ tự "Ids"; chuỗi lịch sử rỗng nằm trong "Errors".
+    """
+    from batch_forecast import forecast_batch
+    ids, histories, consumed, errors = [], [], [], {}
+    for position, item in enumerate(data["Series"]):
+        series_id = str(item.get("Id", position))
+        history_df = history_frame(item.get("History"))
+        if history_df.empty:
+            errors[series_id] = "Empty history data"
+            continue
+        ids.append(series_id)
+        histories.append(history_df)
+        consumed.append(float(item.get("ConsumedThisMonth", 0)))
+
+    BATCH_SERIES.observe(len(histories))
+    model, model_scaler = current_models()
+    results = forecast_batch(histories, model_scaler, model,
+                             step_observer=lambda seconds, _: BATCH_STEP_SECONDS.observe(seconds))
+    totals = [sum(result["predictions"]) for result in results]
+    for result in results:
+        HORIZON_HOURS.observe(len(result["predictions"]))
+
+    response = {
+        "Ids": ids,
+        "Start": [result["start"] for result in results],
+        "TotalKwhForecasted": [round(total, 2) for total in totals],
+        "TotalKwhMonth": [round(c + total, 2) for c, total in zip(consumed, totals)],
+        "PredictedBillVND": [round(calculate_vietnam_electricity_bill(c + total)) for c, total in zip(consumed, totals)],
+        "HourlyPredictions": [result["predictions"] for result in results],
+        "Strategy": "recursive"
+    }
+    if data.get("IncludeDetails"):
+        models = results[0]["details"].keys() if results else []
+        response["PredictedHourlyDetails"] = {model: [result["details"].get(model, []) for result in results]
+                                              for model in models}
+    if errors:
+        response["Errors"] = errors
+    return response
+
+def predict_to_end_of_month(data):
+    """Request "PredictToEndOfMonth" -> response (dict có "Error" nếu lịch sử rỗng)."""
+    kwh_consumed_this_month = float(data["ConsumedThisMonth"])
+    history_df = history_frame(data["History"])
+    if history_df.empty:
+        return {"Error": "Empty history data"}
+
+    strategy = data.get("Strategy", FORECAST_STRATEGY)
+    if strategy == "direct" and direct_bundle is None:
+        strategy = "recursive"
+    forecast_fn = forecast_direct if strategy == "direct" else forecast_with_ensemble
+    with profiler.section("forecast"):
+        total_kwh_forecasted, hourly_preds, hourly_details = forecast_fn(history_df)
+    
+    total_monthly_kwh = kwh_consumed_this_month + total_kwh_forecasted
+    final_bill_vnd = calculate_vietnam_electricity_bill(total_monthly_kwh)
+    
+    return {
+        "PredictedBillVND": round(final_bill_vnd),
+        "TotalKwhForecasted": round(total_kwh_forecasted, 2),
+        "TotalKwhMonth": round(total_monthly_kwh, 2),
+        "HourlyPredictions": hourly_preds,
+        "PredictedHourlyDetails": hourly_details,
+        "Strategy": strategy
+    }
+
+def profiled_batch(data):
+    with profiler.section("forecast"):
+        return predict_batch(data)
+
+def apply_feedback(data):
+    """Request "Feedback": cập nhật model_scores theo giá trị thực -> số điểm đã dùng."""
+    predicted_details_all = data["PredictedDetails"]
+    actual_kwh_all = data["ActualKwh"]
+    model, _ = current_models()
+    
+    updated_count = 0
+    for timestamp, actual_value in actual_kwh_all.items():
+        if timestamp in predicted_details_all:
+            predicted_details_hour = predicted_details_all[timestamp]
+            model.update_scores(predicted_details_hour, float(actual_value))
+            updated_count += 1
+
+    FEEDBACK_POINTS.inc(amount=updated_count)
+    if updated_count > 0:
+        save_ensemble()
+        print(f"--> MODEL UPDATED: {updated_count} points feedback processed.")
+    return updated_count
+
+# Message cần model đã nạp xong
+MODEL_REQUEST_TYPES = {"PredictToEndOfMonth", "PredictBatch", "Feedback", "ReloadModels"}
+
+async def wait_for_models():
+    """Đợi load_models() xong (tối đa MODEL_WAIT_SECONDS) -> True nếu model dùng được."""
+    if not models_ready.is_set():
+        await asyncio.get_running_loop().run_in_executor(None, models_ready.wait, MODEL_WAIT_SECONDS)
+    return models_ready.is_set() and model_load_error is None
+
+def health():
+    return {
+        "Ready": models_ready.is_set() and model_load_error is None,
+        "Error": model_load_error,
+        "ModelFormat": MODEL_FORMAT,
+        "DirectModel": direct_bundle is not None,
+        "Startup": dict(startup.phases),
+        "Scheduler": scheduler.status(),
+        "UptimeSeconds": startup.uptime()
+    }
+
 # --- Xử lý WebSocket ---
 async def receive_data(websocket):
+    CONNECTIONS.inc()
     try:
         async for message in websocket:
+            request_type = "Unknown"
+            request_start = time.perf_counter()
             try:
                 data = json.loads(message)
+                request_type = str(data.get("Type"))
                 print(f"Received Request: {data.get('Type')}") 
 
+                if request_type in MODEL_REQUEST_TYPES and not await wait_for_models():
+                    REQUESTS.inc(request_type, "not_ready")
+                    await websocket.send(json.dumps({"Error": model_load_error or "Models not ready", "Ready": False}))
+                    await websocket.close()
+                    return
+
                 if data.get("Type") == "PredictToEndOfMonth":
-                    history_raw = data["History"]
-                    kwh_consumed_this_month = float(data["ConsumedThisMonth"])
-                    
-                    if not history_raw:
-                        print("Cảnh báo: Không có dữ liệu lịch sử.")
-                        history_df = pd.DataFrame(columns=[TARGET])
-                    else:
-                        history_df = pd.DataFrame.from_dict(history_raw, orient='index', columns=[TARGET])
-                        history_df.index = pd.to_datetime(history_df.index)
-                        history_df.sort_index(inplace=True)
-
-                    if history_df.empty:
-                         await websocket.send(json.dumps({"Error": "Empty history data"}))
+                    response = await scheduler.run("forecast", predict_to_end_of_month, data)
+
+                    if "Error" in response:
+                         REQUESTS.inc(request_type, "empty_history")
+                         await websocket.send(json.dumps(response))
                          await websocket.close()
                          return
 
-                    total_kwh_forecasted, hourly_preds, hourly_details = await forecast_with_ensemble(history_df)
-                    
-                    total_monthly_kwh = kwh_consumed_this_month + total_kwh_forecasted
-                    final_bill_vnd = calculate_vietnam_electricity_bill(total_monthly_kwh)
-                    
-                    response = {
-                        "PredictedBillVND": round(final_bill_vnd),
-                        "TotalKwhForecasted": round(total_kwh_forecasted, 2),
-                        "TotalKwhMonth": round(total_monthly_kwh, 2),
-                        "HourlyPredictions": hourly_preds,
-                        "PredictedHourlyDetails": hourly_details 
-                    }
                     await websocket.send(json.dumps(response))
+                    REQUESTS.inc(request_type, "success")
+                    REQUEST_SECONDS.observe(time.perf_counter() - request_start, request_type)
                     
-                    print(f"--> SENT FORECAST: {response['TotalKwhMonth']} kWh | Bill: {response['PredictedBillVND']:,} VND")
+                    print(f"--> SENT FORECAST ({response['Strategy']}): {response['TotalKwhMonth']} kWh | Bill: {response['PredictedBillVND']:,} VND")
+                    startup.mark("first_forecast")
                     
                     # Đóng connection sau khi gửi response
                     await websocket.close()
                     return
 
+                elif data.get("Type") == "PredictBatch":
+                    response = await scheduler.run("forecast", profiled_batch, data)
+                    await websocket.send(json.dumps(response))
+                    REQUESTS.inc(request_type, "success")
+                    REQUEST_SECONDS.observe(time.perf_counter() - request_start, request_type)
+                    print(f"--> SENT BATCH FORECAST: {len(response['Ids'])} series, {len(response.get('Errors', {}))} empty")
+                    startup.mark("first_forecast")
+                    await websocket.close()
+                    return
+
                 elif data.get("Type") == "Feedback":
-                    predicted_details_all = data["PredictedDetails"]
-                    actual_kwh_all = data["ActualKwh"]
-                    
-                    updated_count = 0
-                    for timestamp, actual_value in actual_kwh_all.items():
-                        if timestamp in predicted_details_all:
-                            predicted_details_hour = predicted_details_all[timestamp]
-                            ensemble_model.update_scores(predicted_details_hour, float(actual_value))
-                            updated_count += 1
-
-                    if updated_count > 0:
-                        joblib.dump(ensemble_model, "ensemble_model.pkl")
-                        print(f"--> MODEL UPDATED: {updated_count} points feedback processed.")
+                    updated_count = await scheduler.run("priority", apply_feedback, data)
                     
                     await websocket.send(json.dumps({"Status": f"Feedback received, {updated_count} points updated."}))
+                    REQUESTS.inc(request_type, "success")
+                    REQUEST_SECONDS.observe(time.perf_counter() - request_start, request_type)
                     
                     # Đóng connection sau feedback
                     await websocket.close()
                     return
 
+                elif data.get("Type") == "Health":
+                    await websocket.send(json.dumps(health()))
+                    REQUESTS.inc(request_type, "success")
+                    await websocket.close()
+                    return
+
+                elif data.get("Type") == "Profile":
+                    try:
+                        status = profiler.start("forecast", calls=data.get("Calls"), seconds=data.get("Seconds"))
+                        await websocket.send(json.dumps({"Status": "Profiling started", "Profile": status}))
+                    except (ValueError, RuntimeError) as e:
+                        await websocket.send(json.dumps({"Error": str(e), "Profile": profiler.status()}))
+                    REQUESTS.inc(request_type, "success")
+                    await websocket.close()
+                    return
+
+                elif data.get("Type") == "ReloadModels":
+                    await scheduler.run("priority", reload_models)
+                    print("--> MODELS RELOADED (incremental update).")
+                    await websocket.send(json.dumps({"Status": "Models reloaded", "ModelScores": current_models()[0].model_scores}))
+                    REQUESTS.inc(request_type, "success")
+                    await websocket.close()
+                    return
+
                 else:
+                    REQUESTS.inc(request_type, "unknown_type")
                     print("Unknown message type.")
 
+            except Overloaded as e:
+                # Hàng đợi đầy: từ chối ngay thay vì để request chờ tới timeout của client
+                REQUESTS.inc(request_type, "rejected")
+                print(f"Rejected {request_type}: {e}")
+                await websocket.send(json.dumps({"Error": "Server busy", "RetryAfter": e.retry_after, "Lane": e.lane}))
+                await websocket.close()
+                return
+
             except Exception as e:
+                REQUESTS.inc(request_type, "error")
                 print(f"Error processing message: {e}")
                 
     except Exception as e:
         # Bỏ qua lỗi keepalive ping timeout
         if "keepalive ping timeout" not in str(e).lower():
             print(f"WebSocket error: {e}")
+    finally:
+        CONNECTIONS.dec()
 
 async def main():
+    # Nạp model song song với việc mở socket; "Health" trả lời ngay cả khi chưa nạp xong
+    threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+    start_http_server(FORECAST_METRICS_PORT)
+    print(f"Metrics on http://0.0.0.0:{FORECAST_METRICS_PORT}/metrics")
     server = await websockets.serve(
         receive_data, 
         "0.0.0.0", 
@@ -200,7 +469,8 @@ async def main():
         ping_timeout=60,
         close_timeout=10
     )
-    print("Forecast Server running on port 8080 (Conservative Strategy)")
+    startup.mark("listening")
+    print(f"Forecast Server running on port 8080 (Strategy: {FORECAST_STRATEGY}, models {'ready' if models_ready.is_set() else 'loading'})")
     await server.wait_closed()
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+# forecast_store.py
+import json
+import logging
+import threading
+from datetime import datetime
+
+
+def summarize(bill_vnd, total_kwh_forecasted, total_kwh_month):
+    """3 thông số mà /forecast/summary trả về."""
+    return {
+        "tien_can_tra_vnd": bill_vnd,
+        "tong_kwh_du_doan_duoc": total_kwh_forecasted,
+        "tong_kwh_ca_thang": total_kwh_month
+    }
+
+
+class ForecastStore:
+    """
+    Kết quả forecast mới nhất giữ trong RAM kèm version (đọc summary O(1), body đã encode sẵn).
+    Mỗi lần cập nhật ghi thêm 1 dòng gọn vào bảng SQLite forecast_history.
+    Kết quả dự phòng (result["Degraded"], baseline_forecast.py) chỉ giữ trong RAM tới khi
+    kết quả ensemble thay thế, không ghi vào lịch sử.
+    Kết quả dự phòng ghi với if_version = version() đọc trước đó: nếu giữa chừng đã có kết quả
+    ensemble mới hơn (job xong ngay sau khi request hết budget) thì bỏ qua, không ghi đè.
+
+    shared_state (APP_ROLE=api, nhiều worker): kết quả mới nhất được publish vào map `shared_name`
+    (field "latest"), version = version của map đó; worker khác nạp lại khi version đổi.
+    """
+
+    def __init__(self, save_history=None, load_history=None, shared_state=None, shared_name="forecast"):
+        self._save_history = save_history
+        self._load_history = load_history
+        self._shared = shared_state
+        self._shared_name = shared_name
+        self._shared_version = None
+        self._lock = threading.Lock()
+        self._latest = None   # dict: version, created_at, result, summary, summary_body, snapshot_key
+        self._loaded = False
+
+    def update(self, result, consumed_kwh, if_version=None, snapshot_key=None):
+        """Trả về version mới, hoặc None nếu bỏ qua (xem if_version ở docstring class)."""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        summary = summarize(result.get("PredictedBillVND", 0),
+                            result.get("TotalKwhForecasted", 0),
+                            result.get("TotalKwhMonth", 0))
+        with self._lock:
+            if self._shared is not None:
+                self._sync_shared()
+            latest = self._latest
+            if (if_version is not None and latest is not None and latest["version"] != if_version
+                    and not (latest["result"] or {}).get("Degraded")):
+                return None
+            if self._shared is not None:
+                self._shared.replace_map(self._shared_name, {"latest": {
+                    "created_at": created_at, "result": result, "summary": summary, "snapshot_key": snapshot_key
+                }})
+                version = self._shared_version = self._shared.version(self._shared_name)
+            else:
+                version = (latest["version"] if latest else 0) + 1
+            self._latest = self._entry(version, created_at, result, summary, snapshot_key)
+            self._loaded = True
+
+        if self._save_history and not result.get("Degraded"):
+            try:
+                self._save_history(created_at, round(consumed_kwh, 4), summary["tong_kwh_du_doan_duoc"],
+                                   summary["tong_kwh_ca_thang"], summary["tien_can_tra_vnd"],
+                                   len(result.get("HourlyPredictions", [])))
+            except Exception as e:
+                logging.error(f"Error saving forecast history: {e}")
+        return version
+
+    def version(self):
+        """Version của entry mới nhất (0 nếu chưa có)."""
+        latest = self.latest()
+        return latest["version"] if latest else 0
+
+    def latest(self):
+        """Entry mới nhất hoặc None. Lần đầu (sau restart) lấy summary từ dòng cuối trong SQLite."""
+        latest = self._latest
+        if self._shared is None and (latest is not None or self._loaded):
+            return latest
+
+        with self._lock:
+            if self._shared is not None:
+                self._sync_shared()
+            if not self._loaded and self._load_history:
+                try:
+                    rows = self._load_history(limit=1)
+                    if rows:
+                        row = rows[0]
+                        summary = summarize(row["bill_vnd"], row["total_kwh_forecasted"], row["total_kwh_month"])
+                        self._latest = self._entry(1, row["created_at"], None, summary)
+                except Exception as e:
+                    logging.error(f"Error loading latest forecast from history: {e}")
+            self._loaded = True
+            return self._latest
+
+    def _sync_shared(self):
+        """Gọi khi giữ self._lock: nạp kết quả do worker khác publish nếu version map đã đổi."""
+        try:
+            version = self._shared.version(self._shared_name)
+            if version == self._shared_version:
+                return
+            published = self._shared.get_map(self._shared_name).get("latest")
+        except Exception as e:
+            logging.error(f"Error reading shared forecast: {e}")
+            return
+        self._shared_version = version
+        if published:
+            self._latest = self._entry(version, published["created_at"], published["result"],
+                                       published["summary"], published.get("snapshot_key"))
+            self._loaded = True
+
+    @staticmethod
+    def _entry(version, created_at, result, summary, snapshot_key=None):
+        body = {"status": "success", "data": summary, "created_at": created_at}
+        if result is not None and result.get("Degraded"):
+            body.update(degraded=True, model=result.get("Model"))
+        return {
+            "version": version,
+            "created_at": created_at,
+            "result": result,
+            "snapshot_key": snapshot_key,
+            "summary": summary,
+            "summary_body": json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        }
@@ -0,0 +1,165 @@
+# hourly_series.py
+import bisect
+from datetime import datetime, timedelta
+
+KEY_FORMAT = "%Y-%m-%dT%H:00:00"
+BUCKETS = ("hour", "day", "week")
+BUCKET_SECONDS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+
+def to_key(dt):
+    return dt.strftime(KEY_FORMAT)
+
+
+def floor_to_bucket(dt, bucket):
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    if bucket == "hour":
+        return dt
+    dt = dt.replace(hour=0)
+    if bucket == "day":
+        return dt
+    return dt - timedelta(days=dt.weekday())  # week: bắt đầu từ thứ Hai
+
+
+def next_bucket(dt, bucket):
+    if bucket == "hour":
+        return dt + timedelta(hours=1)
+    if bucket == "day":
+        return dt + timedelta(days=1)
+    return dt + timedelta(days=7)
+
+
+def to_columns(items, bucket="hour"):
+    """
+    list (bucket_start_key, value) đã sort (vd: bucket_sums) -> (start_key, step_seconds, values)
+    trên lưới đều từ bucket đầu tới bucket cuối; bucket không có dữ liệu = None.
+    """
+    step = BUCKET_SECONDS[bucket]
+    if not items:
+        return None, step, []
+    start = datetime.fromisoformat(items[0][0])
+    last = datetime.fromisoformat(items[-1][0])
+    values = [None] * (int((last - start).total_seconds()) // step + 1)
+    for key, value in items:
+        values[int((datetime.fromisoformat(key) - start).total_seconds()) // step] = value
+    return items[0][0], step, values
+
+
+class HourlySeries:
+    """
+    kWh theo giờ, key dạng ISO '%Y-%m-%dT%H:00:00' (sort theo chuỗi = sort theo thời gian).
+
+    Dùng như dict (get / [] / in / len / items) nhưng giữ thêm danh sách key
+    đã sort và prefix sum, nên truy vấn theo khoảng và tổng theo bucket chỉ
+    tốn O(log n) mỗi bucket. `version` tăng mỗi lần ghi (dùng để invalidate cache).
+    Không tự lock: caller giữ lock của app khi ghi.
+    """
+
+    def __init__(self, items=None):
+        self._values = {}
+        self._keys = []
+        self._prefix = [0.0]  # _prefix[i] = tổng _keys[:i]
+        self.version = 0
+        if items:
+            self.load(items)
+
+    def load(self, items, presorted=False):
+        """
+        Nạp lại toàn bộ dữ liệu (vd: đọc lại từ SQLite), version vẫn tăng.
+        presorted=True: items là iterable (key, value) đã theo thứ tự key (vd: database.iter_history),
+        đọc lần lượt không cần gom hết vào list để sort.
+        """
+        self._values = {}
+        self._keys = []
+        self._prefix = [0.0]
+        pairs = items.items() if isinstance(items, dict) else items
+        for key, value in (pairs if presorted else sorted(pairs)):
+            self._values[key] = value
+            self._keys.append(key)
+            self._prefix.append(self._prefix[-1] + value)
+        self.version += 1
+
+    # --- dict-like API ---
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key in self._values:
+            self._values[key] = value
+            self._rebuild_prefix(bisect.bisect_left(self._keys, key))
+        else:
+            idx = bisect.bisect_left(self._keys, key)
+            self._keys.insert(idx, key)
+            self._values[key] = value
+            if idx == len(self._keys) - 1:
+                self._prefix.append(self._prefix[-1] + value)
+            else:
+                self._prefix.append(0.0)
+                self._rebuild_prefix(idx)
+        self.version += 1
+
+    def items(self):
+        """Các cặp (key, kWh) theo thứ tự thời gian."""
+        return [(key, self._values[key]) for key in self._keys]
+
+    def keys(self):
+        return list(self._keys)
+
+    def _rebuild_prefix(self, start):
+        for i in range(start, len(self._keys)):
+            self._prefix[i + 1] = self._prefix[i] + self._values[self._keys[i]]
+
+    # --- range queries ---
+    def _index_range(self, start_key=None, end_key=None):
+        """Vị trí [lo, hi) của các key trong [start_key, end_key] (end_key tính cả)."""
+        lo = 0 if start_key is None else bisect.bisect_left(self._keys, start_key)
+        hi = len(self._keys) if end_key is None else bisect.bisect_right(self._keys, end_key)
+        return lo, max(lo, hi)
+
+    def range_items(self, start_key=None, end_key=None):
+        lo, hi = self._index_range(start_key, end_key)
+        return [(key, self._values[key]) for key in self._keys[lo:hi]]
+
+    def range_sum(self, start_key=None, end_key=None):
+        lo, hi = self._index_range(start_key, end_key)
+        return self._prefix[hi] - self._prefix[lo]
+
+    def tail(self, n):
+        """n giờ gần nhất."""
+        return [(key, self._values[key]) for key in self._keys[-n:]] if n > 0 else []
+
+    def bucket_sums(self, start, end, bucket="hour"):
+        """
+        Tổng kWh theo bucket (hour/day/week) trong [start, end].
+        Trả về list (bucket_start_key, kwh) cho các bucket có dữ liệu.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Invalid bucket '{bucket}'. Use one of {BUCKETS}")
+
+        lo, hi = self._index_range(to_key(start), to_key(end))
+        if lo >= hi:
+            return []
+        if bucket == "hour":
+            return [(key, self._values[key]) for key in self._keys[lo:hi]]
+
+        result = []
+        bucket_start = floor_to_bucket(datetime.fromisoformat(self._keys[lo]), bucket)
+        while lo < hi:
+            boundary = bisect.bisect_left(self._keys, to_key(next_bucket(bucket_start, bucket)), lo, hi)
+            if boundary > lo:
+                result.append((to_key(bucket_start), self._prefix[boundary] - self._prefix[lo]))
+                lo = boundary
+                bucket_start = next_bucket(bucket_start, bucket)
+            else:
+                # Bỏ qua khoảng trống: nhảy thẳng tới bucket chứa key kế tiếp
+                bucket_start = floor_to_bucket(datetime.fromisoformat(self._keys[lo]), bucket)
+        return result
@@ -0,0 +1,288 @@
+# incremental_update.py
+# Cập nhật model từ các giờ mới trong hourly_kwh kể từ lần cập nhật trước, không train lại từ đầu:
+#   - scaler: partial_fit (mean/var cộng dồn), sau đó đổi tham số của các model cũ cho khớp
+#     scale mới (ngưỡng split của cây, hệ số LR, lớp đầu MLP). Feature rời rạc (giờ, thứ, tháng,
+#     cuối tuần) giữ scale cũ: ngưỡng split của XGBoost (hist) trên các feature này chính là giá trị
+#     dữ liệu, đổi affine + ép float32 làm lật phép so sánh 'x < ngưỡng' tại đúng các giá trị đó.
+#     Feature liên tục: dự báo cũ chỉ lệch ở điểm sát ngưỡng (so sánh float32); lệch quá
+#     REMAP_TOLERANCE (kWh) thì dừng, không ghi model.
+#   - XGBoost: thêm XGB_EXTRA_TREES cây fit trên các giờ mới (xgb_model=booster cũ)
+#   - MLP: partial_fit vài epoch trên các giờ mới
+#   - Direct model (nếu có): thêm cây từ các cặp (origin, horizon) trong khoảng mới
+#   - RandomForest, LinearRegression: chỉ đổi tham số theo scaler mới
+# Ghi kết quả như 1 transaction: mọi file mới (ensemble_model.pkl kèm scaler, scaler.pkl, models/*.pkl,
+# direct model) được dump vào models/staging, rồi ghi models/staging/commit.json (os.replace = điểm
+# commit, kèm dòng model_updates). commit_staged() chuyển từng file vào chỗ thật và ghi model_updates;
+# dừng giữa chừng thì lần chạy sau làm tiếp (stage chưa có commit.json thì bỏ). ensemble_model.pkl
+# được thay đầu tiên và tự mang scaler -> forecast_server không bao giờ ghép ensemble cũ với scaler mới.
+# Xong thì gửi "ReloadModels" cho forecast_server (server ghi lại ensemble_model.pkl, giữ model_scores);
+# nếu server không chạy thì tự xuất lại models/compact nếu đang dùng.
+#
+#   python incremental_update.py                     # 1 lần (cron / systemd timer)
+#   python incremental_update.py --every-hours 24    # tự lặp
+import argparse
+import copy
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from database import get_history_range, get_last_model_update, log_model_update
+from direct_forecast import DIRECT_MODEL_PATH, make_training_set
+from model_artifact import COMPACT_DIR, artifact_exists, export_ensemble, read_manifest
+from model_io import atomic_dump
+from train_forecast_models import create_features, MODEL_SPECS
+
+FEATURES = ['hour', 'dayofweek', 'month', 'is_weekend',
+            'kwh_lag_24h', 'kwh_lag_48h', 'kwh_lag_168h',
+            'kwh_rolling_mean_24h']
+TARGET = 'kwh_hour'
+KEY_FORMAT = "%Y-%m-%dT%H:00:00"
+
+XGB_EXTRA_TREES = int(os.getenv("XGB_EXTRA_TREES", "20"))
+MLP_EPOCHS = int(os.getenv("MLP_UPDATE_EPOCHS", "5"))
+MIN_NEW_HOURS = int(os.getenv("MIN_NEW_HOURS", "24"))
+REMAP_TOLERANCE = float(os.getenv("REMAP_TOLERANCE", "0.01"))
+# Feature lịch (giá trị nguyên): không đổi scale khi partial_fit
+DISCRETE_FEATURES = ('hour', 'dayofweek', 'month', 'is_weekend')
+CONTEXT_HOURS = 192  # lag 168h + rolling 24h cần dữ liệu trước khoảng mới
+STAGING_DIR = os.path.join("models", "staging")
+COMMIT_FILE = "commit.json"
+
+
+# --- Đổi tham số model theo scaler mới ---
+# z = (x - mean) / scale (cũ), z' = (x - mean') / scale' (mới)  =>  z' = a * z + c
+
+def keep_discrete_scaling(old_scaler, new_scaler, features=FEATURES, discrete=DISCRETE_FEATURES):
+    """Trả mean/var/scale của các feature rời rạc về giá trị cũ -> a = 1, c = 0, ngưỡng giữ nguyên."""
+    idx = [features.index(name) for name in discrete]
+    for attr in ("mean_", "var_", "scale_"):
+        getattr(new_scaler, attr)[idx] = getattr(old_scaler, attr)[idx]
+    return new_scaler
+
+def scaler_affine(old_scaler, new_scaler):
+    a = old_scaler.scale_ / new_scaler.scale_
+    c = (old_scaler.mean_ - new_scaler.mean_) / new_scaler.scale_
+    return a, c
+
+def remap_sklearn_trees(estimators, a, c):
+    """Split 'z_j <= t' tương đương 'z'_j <= a_j * t + c_j' (a > 0)."""
+    for estimator in estimators:
+        tree = estimator.tree_
+        feature, threshold = tree.feature, tree.threshold   # threshold là view, ghi thẳng vào cây
+        split = feature >= 0
+        threshold[split] = a[feature[split]] * threshold[split] + c[feature[split]]
+
+def remap_xgb(model, a, c):
+    booster = model.get_booster()
+    dump = json.loads(booster.save_raw(raw_format="json"))
+    for tree in dump["learner"]["gradient_booster"]["model"]["trees"]:
+        conditions = tree["split_conditions"]
+        for i, (left, feature) in enumerate(zip(tree["left_children"], tree["split_indices"])):
+            if left != -1:  # node lá: split_conditions là giá trị lá, không đổi
+                conditions[i] = float(a[feature] * conditions[i] + c[feature])
+    booster.load_model(bytearray(json.dumps(dump).encode("utf-8")))
+
+def remap_linear(model, a, c):
+    """w·z + b = (w/a)·z' + (b - Σ w·c/a)."""
+    coef = np.asarray(model.coef_, dtype=float)
+    model.intercept_ = model.intercept_ - np.sum(coef * c / a)
+    model.coef_ = coef / a
+
+def remap_mlp(model, a, c):
+    weights = model.coefs_[0]                     # (n_features, n_hidden)
+    model.intercepts_[0] = model.intercepts_[0] - (c / a) @ weights
+    model.coefs_[0] = weights / a[:, None]
+
+
+# --- Dữ liệu mới ---
+
+def load_new_data(since_key):
+    """
+    (features của các giờ > since_key, chuỗi kWh gồm cả phần context, key giờ mới nhất).
+    since_key None -> toàn bộ lịch sử.
+    """
+    start_key = None
+    if since_key:
+        start_key = (datetime.strptime(since_key, KEY_FORMAT) - timedelta(hours=CONTEXT_HOURS)).strftime(KEY_FORMAT)
+    history = get_history_range(start_key)
+    if not history:
+        return None, None, None
+    series = pd.Series(history, dtype=float)
+    series.index = pd.to_datetime(series.index)
+    series = series.sort_index().asfreq('h').ffill()
+
+    features = create_features(series.to_frame(name=TARGET))
+    if since_key:
+        features = features[features.index > pd.Timestamp(since_key)]
+    return features, series, max(history)
+
+
+# --- Commit (staging -> file thật) ---
+
+def stage_files(files, update, staging_dir=STAGING_DIR):
+    """
+    files: [(đường dẫn thật, object)] theo thứ tự sẽ thay; update: tham số log_model_update.
+    Dump tất cả vào staging_dir, ghi commit.json cuối cùng (từ lúc này update coi như đã commit).
+    """
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    entries = []
+    for i, (path, obj) in enumerate(files):
+        staged = f"{i}-{os.path.basename(path)}"
+        atomic_dump(obj, os.path.join(staging_dir, staged))
+        entries.append([staged, path])
+    commit_path = os.path.join(staging_dir, COMMIT_FILE)
+    with open(f"{commit_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"files": entries, "update": update}, f, indent=2)
+    os.replace(f"{commit_path}.tmp", commit_path)
+
+def commit_staged(staging_dir=STAGING_DIR):
+    """Chuyển các file đã stage vào chỗ thật + ghi model_updates. Gọi lại sau khi bị dừng giữa chừng vẫn đúng."""
+    commit_path = os.path.join(staging_dir, COMMIT_FILE)
+    if not os.path.exists(commit_path):
+        shutil.rmtree(staging_dir, ignore_errors=True)   # stage dở: file thật chưa bị đụng tới
+        return None
+    with open(commit_path, encoding="utf-8") as f:
+        commit = json.load(f)
+    for staged, path in commit["files"]:
+        staged = os.path.join(staging_dir, staged)
+        if os.path.exists(staged):   # chưa chuyển ở lần trước
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            os.replace(staged, path)
+    update = commit["update"]
+    last = get_last_model_update()
+    if not last or (last["updated_at"], last["last_timestamp"]) != (update["updated_at_iso"], update["last_timestamp"]):
+        log_model_update(**update)
+    shutil.rmtree(staging_dir)
+    return update
+
+
+# --- Update ---
+
+def run_update(since_key=None, extra_trees=XGB_EXTRA_TREES, mlp_epochs=MLP_EPOCHS,
+               min_new_hours=MIN_NEW_HOURS, notify=True):
+    started = time.perf_counter()
+    if commit_staged() is not None:
+        print("Finished committing an interrupted update")
+    if since_key is None:
+        last = get_last_model_update()
+        since_key = last["last_timestamp"] if last else None
+
+    features, series, last_key = load_new_data(since_key)
+    if features is None or len(features) < min_new_hours:
+        print(f"Skip: {0 if features is None else len(features)} new hours since {since_key} (< {min_new_hours})")
+        return None
+
+    X_raw, y = features[FEATURES], features[TARGET].to_numpy()
+    print(f"Incremental update: {len(features)} new hours ({features.index[0]} -> {features.index[-1]})")
+
+    # 1. Scaler cộng dồn + đổi tham số các model cũ cho khớp scale mới
+    old_scaler = joblib.load("scaler.pkl")
+    new_scaler = keep_discrete_scaling(old_scaler, copy.deepcopy(old_scaler).partial_fit(X_raw))
+    a, c = scaler_affine(old_scaler, new_scaler)
+
+    models = {name: joblib.load(MODEL_SPECS[name][1]) for name in ("xgb", "rf", "mlp")}
+    X_old = old_scaler.transform(X_raw)
+    before = {name: models[name].predict(X_old) for name in ("xgb", "rf")}
+    has_lr = os.path.exists(MODEL_SPECS["lr"][1])
+    if has_lr:
+        models["lr"] = joblib.load(MODEL_SPECS["lr"][1])
+        remap_linear(models["lr"], a, c)
+    remap_sklearn_trees(models["rf"].estimators_, a, c)
+    remap_xgb(models["xgb"], a, c)
+    remap_mlp(models["mlp"], a, c)
+
+    X = new_scaler.transform(X_raw)
+    for name, predicted in before.items():
+        drift = float(np.max(np.abs(models[name].predict(X) - predicted)))
+        if drift > REMAP_TOLERANCE:
+            raise RuntimeError(f"{name}: remap changed predictions by up to {drift:.4f} kWh "
+                               f"(> REMAP_TOLERANCE={REMAP_TOLERANCE}), models not saved")
+
+    # 2. XGBoost: thêm cây trên dữ liệu mới
+    trees_before = models["xgb"].get_booster().num_boosted_rounds()
+    extended = xgb.XGBRegressor(**{**models["xgb"].get_params(), "n_estimators": extra_trees})
+    extended.fit(X, y, xgb_model=models["xgb"].get_booster())
+    models["xgb"] = extended
+
+    # 3. MLP: partial_fit (không hỗ trợ early_stopping; model train với early_stopping thì best_loss_ là None)
+    models["mlp"].set_params(early_stopping=False)
+    if getattr(models["mlp"], "best_loss_", None) is None:
+        models["mlp"].best_loss_ = np.inf
+    for _ in range(mlp_epochs):
+        models["mlp"].partial_fit(X, y)
+
+    # 4. Direct model: thêm cây từ các origin trong khoảng mới (feature không scale)
+    direct_files = []
+    direct_rows = 0
+    if os.path.exists(DIRECT_MODEL_PATH) and len(series) > 168 + 1:
+        bundle = joblib.load(DIRECT_MODEL_PATH)
+        X_direct, y_direct, _ = make_training_set(series, origin_step=1, horizons_per_origin=24)
+        if len(X_direct):
+            direct = xgb.XGBRegressor(**{**bundle["model"].get_params(), "n_estimators": extra_trees})
+            direct.fit(X_direct[bundle["features"]], y_direct, xgb_model=bundle["model"].get_booster())
+            direct_files.append((DIRECT_MODEL_PATH, dict(bundle, model=direct)))
+            direct_rows = len(X_direct)
+
+    # 5. Stage + commit: ensemble_model.pkl (mang scaler mới) thay trước, rồi scaler.pkl, models/*.pkl
+    files = []
+    ensemble = None
+    if os.path.exists("ensemble_model.pkl"):
+        ensemble = joblib.load("ensemble_model.pkl")
+        ensemble.rf_model, ensemble.xgb_model, ensemble.mlp_model = models["rf"], models["xgb"], models["mlp"]
+        if has_lr:
+            ensemble.lr_model, ensemble.has_lr = models["lr"], True
+        ensemble.scaler = new_scaler
+        files.append(("ensemble_model.pkl", ensemble))
+    files.append(("scaler.pkl", new_scaler))
+    files += [(MODEL_SPECS[name][1], model) for name, model in models.items()] + direct_files
+
+    seconds = round(time.perf_counter() - started, 2)
+    trees_added = models["xgb"].get_booster().num_boosted_rounds() - trees_before
+    note = f"direct_rows={direct_rows}"
+    stage_files(files, {"updated_at_iso": datetime.now().isoformat(timespec='seconds'), "last_timestamp": last_key,
+                        "new_hours": len(features), "xgb_trees_added": trees_added, "seconds": seconds,
+                        "note": note})
+    commit_staged()
+
+    # 6. forecast_server nạp lại; nếu không kết nối được thì tự xuất lại models/compact (nếu đang dùng)
+    reloaded = False
+    if notify:
+        from websocket_forecast import forecast_client
+        result = forecast_client.send_control({"Type": "ReloadModels"}, timeout=60)
+        reloaded = bool(result) and "Error" not in result
+    if not reloaded and ensemble is not None and artifact_exists(COMPACT_DIR):
+        manifest = read_manifest(COMPACT_DIR)
+        ensemble.model_scores = dict(manifest["model_scores"])
+        export_ensemble(ensemble, new_scaler, COMPACT_DIR,
+                        float32=manifest["float32"], max_depth=manifest["max_depth"])
+
+    print(f"Done in {seconds}s: +{trees_added} XGB trees, MLP {mlp_epochs} epochs, {note}, server_reloaded={reloaded}")
+    return {"new_hours": len(features), "last_timestamp": last_key, "xgb_trees_added": trees_added,
+            "direct_rows": direct_rows, "server_reloaded": reloaded, "seconds": seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental model update from new hourly_kwh rows")
+    parser.add_argument("--since", help="override last update timestamp (YYYY-MM-DDTHH:00:00)")
+    parser.add_argument("--every-hours", type=float, help="run repeatedly with this interval")
+    parser.add_argument("--no-notify", action="store_true", help="do not ask forecast_server to reload")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            run_update(since_key=args.since, notify=not args.no_notify)
+        except Exception as e:
+            if not args.every_hours:
+                raise
+            print(f"Incremental update failed: {e}")
+        if not args.every_hours:
+            break
+        args.since = None
+        time.sleep(args.every_hours * 3600)
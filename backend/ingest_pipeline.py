@@ -0,0 +1,128 @@
+# ingest_pipeline.py
+import logging
+import queue
+import threading
+
+
+class Stage:
+    """
+    Một bước trong pipeline ingest: queue giới hạn + worker threads riêng.
+
+    - handler(item) trả về item cho các stage phía sau (outputs), hoặc None để dừng.
+    - partition_key(item): nếu có, mỗi worker có queue riêng và item cùng key
+      luôn vào cùng worker -> giữ thứ tự theo thiết bị.
+    - drop_when_full: True -> queue đầy thì bỏ item (dữ liệu mới sẽ thay thế),
+      False -> block producer (backpressure lan ngược về stage trước).
+    - keep(item): khi put không block (drop_when_full / IngestPipeline.submit), item có keep() = True
+      (vd: frame có ENERGY-Total, bỏ là mất kWh của giờ đó) không bị bỏ ngay mà đợi tối đa
+      keep_timeout giây; vẫn đầy thì tính vào dropped_kept (ngoài dropped).
+
+    Counter processed / dropped / dropped_kept / errors cập nhật dưới lock (nhiều worker + producer).
+    """
+
+    def __init__(self, name, handler, workers=1, maxsize=1000, outputs=None,
+                 partition_key=None, drop_when_full=False, keep=None, keep_timeout=1.0):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.outputs = outputs or []
+        self.partition_key = partition_key
+        self.drop_when_full = drop_when_full
+        self.keep = keep
+        self.keep_timeout = keep_timeout
+
+        num_queues = self.workers if partition_key else 1
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in range(num_queues)]
+
+        self.processed = 0
+        self.dropped = 0
+        self.dropped_kept = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+        self._started = False
+
+    def _count(self, outcome):
+        with self._counter_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def put(self, item, block=None, timeout=None):
+        """Đưa item vào stage. Trả False nếu bị bỏ do queue đầy."""
+        if block is None:
+            block = not self.drop_when_full
+
+        q = self.queues[0]
+        if self.partition_key:
+            q = self.queues[hash(self.partition_key(item)) % len(self.queues)]
+
+        try:
+            q.put(item, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            pass
+        kept = not block and self.keep is not None and self.keep(item)
+        if kept:
+            try:
+                q.put(item, timeout=self.keep_timeout)
+                return True
+            except queue.Full:
+                self._count("dropped_kept")
+        self._count("dropped")
+        return False
+
+    def qsize(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            q = self.queues[i % len(self.queues)]
+            threading.Thread(target=self._run, args=(q,), name=f"ingest-{self.name}-{i}", daemon=True).start()
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                self._count("errors")
+                logging.error(f"Ingest stage '{self.name}' error: {e}")
+                continue
+            finally:
+                q.task_done()
+
+            self._count("processed")
+            if result is not None:
+                for stage in self.outputs:
+                    stage.put(result)
+
+
+class IngestPipeline:
+    """Gom các stage; stage đầu tiên nhận frame thô từ WebSocket reader thread."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.entry = stages[0]
+
+    def submit(self, frame):
+        """Gọi từ reader thread: chỉ enqueue, không block (trừ item keep() của stage đầu khi queue đầy)."""
+        return self.entry.put(frame, block=False)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        logging.info(f"Ingest pipeline started: {', '.join(f'{s.name}x{s.workers}' for s in self.stages)}")
+
+    def stats(self):
+        return {
+            stage.name: {
+                "queue_depth": stage.qsize(),
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "dropped": stage.dropped,
+                "dropped_kept": stage.dropped_kept,
+                "errors": stage.errors
+            }
+            for stage in self.stages
+        }
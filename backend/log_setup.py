@@ -0,0 +1,112 @@
+# log_setup.py
+# Logging không chặn thread xử lý telemetry:
+#   logger.info(...) -> filter lấy mẫu theo category -> queue -> thread ghi file (RotatingFileHandler)
+#
+# Các dòng telemetry nên dùng logger theo category (logging.getLogger("telemetry"), ...)
+# và truyền args kiểu %s thay vì f-string: khi dòng bị lấy mẫu bỏ qua thì dict
+# không bị repr, còn dòng được giữ thì được format ở thread ghi file.
+# Vì format trễ, không sửa các object truyền vào args sau khi đã log.
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Giới hạn số dòng/giây cho mỗi category (tên logger, vd: 'telemetry').
+    WARNING trở lên luôn được giữ. Dòng giữ lại tiếp theo ghi kèm số dòng đã bỏ.
+    """
+
+    def __init__(self, rate=5.0, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._lock = threading.Lock()
+        self._buckets = {}      # category -> [tokens, last_refill, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [+{suppressed} similar lines suppressed]"
+        return True
+
+    def suppressed(self):
+        with self._lock:
+            return {name: bucket[2] for name, bucket in self._buckets.items()}
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Đẩy record vào queue có giới hạn, không format ở thread gọi log.
+    Queue đầy: INFO/DEBUG bị bỏ (đếm vào `dropped`), WARNING+ chờ đến khi có chỗ.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format ở thread ghi file (QueueListener), chỉ giữ traceback dạng text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_dir="logs", filename="telemetry.log", level=logging.INFO,
+                  max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000,
+                  sampled_categories=("telemetry", "activity", "clients"), sample_rate=5.0):
+    """
+    Cấu hình root logger: QueueHandler -> QueueListener -> RotatingFileHandler.
+    Các logger trong `sampled_categories` bị giới hạn `sample_rate` dòng/giây mỗi category.
+    Trả về (listener, queue_handler); listener đã được start.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, filename), maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # Filter gắn vào logger (không phải handler) để dòng bị bỏ không tốn công format
+    rate_filter = RateLimitFilter(rate=sample_rate)
+    for category in sampled_categories:
+        logging.getLogger(category).addFilter(rate_filter)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener, queue_handler
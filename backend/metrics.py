@@ -0,0 +1,258 @@
+# metrics.py
+# Metrics dạng Prometheus text (exposition format 0.0.4), không cần prometheus_client.
+#
+#   REQUESTS = REGISTRY.counter("x_requests_total", "Mô tả", ("endpoint",))
+#   REQUESTS.inc("telemetry")
+#   LATENCY = REGISTRY.histogram("x_seconds", "Mô tả", ("endpoint",))
+#   with LATENCY.time("telemetry"): ...
+#   REGISTRY.callback("x_queue_depth", "Mô tả", "gauge", lambda: {("parse",): 3}, ("stage",))
+#
+# Counter/histogram chia thành nhiều stripe (chọn theo thread id), mỗi stripe 1 lock riêng:
+# các thread ghi gần như không tranh nhau, chỉ lúc scrape mới cộng các stripe lại.
+# Số liệu đã có sẵn ở nơi khác (độ dài queue, số client...) dùng callback, chỉ đọc khi scrape.
+import bisect
+import http.server
+import logging
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_STRIPES = 8
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Striped:
+    def __init__(self):
+        self._stripes = [(threading.Lock(), {}) for _ in range(_STRIPES)]
+
+    def _stripe(self):
+        return self._stripes[threading.get_ident() % _STRIPES]
+
+
+class Counter(_Striped):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labelvalues, amount=1):
+        lock, values = self._stripe()
+        with lock:
+            values[labelvalues] = values.get(labelvalues, 0) + amount
+
+    def values(self):
+        total = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = list(values.items())
+            for labels, value in items:
+                total[labels] = total.get(labels, 0) + value
+        return total
+
+    def render(self):
+        return [f"{self.name}{_label_str(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(_Striped):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        idx = bisect.bisect_left(self.buckets, value)
+        lock, values = self._stripe()
+        with lock:
+            entry = values.get(labelvalues)
+            if entry is None:
+                entry = values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def values(self):
+        """labels -> (bucket counts không cộng dồn, sum, count)."""
+        total = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = [(labels, (list(e[0]), e[1], e[2])) for labels, e in values.items()]
+            for labels, (counts, value_sum, count) in items:
+                acc = total.get(labels)
+                if acc is None:
+                    total[labels] = [counts, value_sum, count]
+                else:
+                    acc[0] = [a + b for a, b in zip(acc[0], counts)]
+                    acc[1] += value_sum
+                    acc[2] += count
+        return total
+
+    def render(self):
+        lines = []
+        for labels, (counts, value_sum, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, labels)} {_format_value(value_sum)}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+        return False
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_str(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class CallbackMetric:
+    """Giá trị đọc lúc scrape: fn() trả về số, hoặc dict {tuple label values: số}."""
+
+    def __init__(self, name, documentation, type, fn, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self._fn = fn
+
+    def render(self):
+        value = self._fn()
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_label_str(self.labelnames, labels)} {_format_value(v)}" for labels, v in items]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type, fn, labelnames=()):
+        with self._lock:
+            metric = self._metrics[name] = CallbackMetric(name, documentation, type, fn, labelnames)
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                logging.error(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def start_http_server(port, registry=REGISTRY, host="0.0.0.0"):
+    """HTTP server riêng (thread nền) phục vụ GET /metrics, dùng cho process không có Flask."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
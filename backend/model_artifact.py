@@ -0,0 +1,464 @@
+# model_artifact.py
+# Artifact "compact" cho ensemble: mỗi mảng của model là 1 file .npy không nén + manifest.json,
+# nạp bằng np.load(mmap_mode='r') -> gần như không tốn thời gian load, và nhiều process
+# (forecast_server, worker...) dùng chung page cache thay vì mỗi process 1 bản pickle trong RAM.
+#
+#   RandomForest / XGBoost: cây được làm phẳng thành các mảng left/right/feature/threshold/value
+#                           (node đánh số theo BFS, node lá có left = -1), predict duyệt tất cả cây
+#                           cùng lúc bằng numpy
+#   MLP: coefs/intercepts từng lớp; LinearRegression: coef/intercept; scaler: mean/scale
+#
+#   python model_artifact.py export                       # models/compact từ ensemble_model.pkl
+#   python model_artifact.py export --float32 --max-depth 10   # lượng tử hóa / cắt cây, in độ lệch
+#   python model_artifact.py report                       # size, thời gian load, RSS từng model
+#
+# Mỗi lần export ghi vào thư mục version mới (models/compact/v<thời điểm>-<pid>/: .npy + manifest.json)
+# rồi os.replace file trỏ models/compact/CURRENT -> process đang nạp luôn thấy trọn 1 version
+# (manifest ghi tên version, mảng được đọc từ đúng thư mục đó). Giữ KEEP_VERSIONS version gần nhất.
+#
+# forecast_server dùng artifact này khi MODEL_FORMAT=compact.
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+
+import joblib
+import numpy as np
+
+from ensemble_model import ModelEnsemble
+
+FORMAT_VERSION = 1
+COMPACT_DIR = os.getenv("COMPACT_MODEL_DIR", "models/compact")
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 3
+
+# Tên model trong ensemble -> (thuộc tính ModelEnsemble, file pickle gốc)
+ENSEMBLE_MODELS = {
+    "RandomForest": ("rf_model", "models/model_rf.pkl"),
+    "XGBoost": ("xgb_model", "models/model_xgb.pkl"),
+    "MLP": ("mlp_model", "models/model_mlp.pkl"),
+    "LinearRegression": ("lr_model", "models/model_lr.pkl"),
+}
+
+_ACTIVATIONS = {
+    "identity": lambda h: h,
+    "relu": lambda h: np.maximum(h, 0, out=h),
+    "tanh": np.tanh,
+    "logistic": lambda h: 1.0 / (1.0 + np.exp(-h)),
+}
+
+
+# === PREDICTORS (đọc từ mảng, thường là memmap) ===
+
+class CompactTrees:
+    """
+    Nhiều cây hồi quy trong cùng 1 bộ mảng. split "le": x <= threshold đi trái (sklearn),
+    "lt": x < threshold đi trái (XGBoost). Giá trị thiếu (NaN) luôn đi phải.
+    """
+
+    def __init__(self, arrays, meta):
+        self.left, self.right = arrays["left"], arrays["right"]
+        self.feature, self.threshold = arrays["feature"], arrays["threshold"]
+        self.value, self.roots = arrays["value"], np.asarray(arrays["roots"])
+        self.depth = meta["depth"]
+        self.strict = meta["split"] == "lt"
+        self.aggregate = meta["aggregate"]
+        self.base_score = meta.get("base_score", 0.0)
+
+    def predict(self, X):
+        # sklearn/XGBoost đều so sánh trên float32
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            left = self.left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                break
+            x = X[rows, self.feature[nodes]]
+            threshold = self.threshold[nodes]
+            go_left = x < threshold if self.strict else x <= threshold
+            nodes = np.where(internal, np.where(go_left, left, self.right[nodes]), nodes)
+        leaves = self.value[nodes].astype(np.float64)
+        if self.aggregate == "mean":
+            return leaves.mean(axis=1)
+        return leaves.sum(axis=1) + self.base_score
+
+
+class CompactMLP:
+    def __init__(self, arrays, meta):
+        self.layers = [(arrays[f"coef_{i}"], arrays[f"intercept_{i}"]) for i in range(meta["n_layers"])]
+        self.activation = _ACTIVATIONS[meta["activation"]]
+
+    def predict(self, X):
+        h = np.asarray(X, dtype=np.float64)
+        last = len(self.layers) - 1
+        for i, (coef, intercept) in enumerate(self.layers):
+            h = h @ coef + intercept
+            if i < last:
+                h = self.activation(h)
+        return h.ravel()
+
+
+class CompactLinear:
+    def __init__(self, arrays, meta):
+        self.coef, self.intercept = arrays["coef"], float(arrays["intercept"][0])
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef + self.intercept
+
+
+class CompactScaler:
+    def __init__(self, arrays, meta):
+        self.mean_, self.scale_ = arrays["mean"], arrays["scale"]
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+_PREDICTORS = {"trees": CompactTrees, "mlp": CompactMLP, "linear": CompactLinear, "scaler": CompactScaler}
+
+
+# === EXPORT ===
+
+def _bfs_order(left, right, max_depth=None):
+    """Node còn giữ theo thứ tự BFS (cắt ở max_depth) -> (order, độ sâu thực tế)."""
+    levels, frontier = [], np.array([0])
+    while len(frontier):
+        levels.append(frontier)
+        if max_depth is not None and len(levels) > max_depth:
+            break
+        internal = frontier[left[frontier] >= 0]
+        frontier = np.concatenate([left[internal], right[internal]])
+    return np.concatenate(levels), len(levels) - 1
+
+
+def _flatten_trees(trees, max_depth=None):
+    """
+    trees: [(left, right, feature, threshold, value)] theo index node của từng cây.
+    Node bị cắt ở max_depth thành lá với value của chính nó (trung bình mẫu của node
+    đối với cây sklearn).
+    """
+    parts = {key: [] for key in ("left", "right", "feature", "threshold", "value")}
+    roots, depth, offset = [], 0, 0
+    for left, right, feature, threshold, value in trees:
+        left, right = np.asarray(left), np.asarray(right)
+        order, tree_depth = _bfs_order(left, right, max_depth)
+        new_index = np.full(len(left), -1, dtype=np.int64)
+        new_index[order] = np.arange(len(order)) + offset
+        new_left = np.where(left[order] >= 0, new_index[np.maximum(left[order], 0)], -1)
+        new_right = np.where(new_left >= 0, new_index[np.maximum(right[order], 0)], -1)
+        parts["left"].append(new_left)
+        parts["right"].append(new_right)
+        parts["feature"].append(np.where(new_left >= 0, np.asarray(feature)[order], 0))
+        parts["threshold"].append(np.asarray(threshold)[order])
+        parts["value"].append(np.asarray(value)[order])
+        roots.append(offset)
+        depth = max(depth, tree_depth)
+        offset += len(order)
+
+    index_dtype = np.int32 if offset < 2 ** 31 else np.int64
+    arrays = {key: np.concatenate(parts[key]).astype(index_dtype) for key in ("left", "right")}
+    arrays["feature"] = np.concatenate(parts["feature"]).astype(np.int16)
+    arrays["threshold"] = np.concatenate(parts["threshold"])
+    arrays["value"] = np.concatenate(parts["value"])
+    arrays["roots"] = np.asarray(roots, dtype=index_dtype)
+    return arrays, depth
+
+
+def export_forest(forest, dtype=np.float64, max_depth=None):
+    trees = [(t.children_left, t.children_right, t.feature, t.threshold, t.value[:, 0, 0])
+             for t in (estimator.tree_ for estimator in forest.estimators_)]
+    arrays, depth = _flatten_trees(trees, max_depth)
+    arrays["threshold"] = arrays["threshold"].astype(dtype)
+    arrays["value"] = arrays["value"].astype(dtype)
+    return arrays, {"kind": "trees", "split": "le", "aggregate": "mean", "depth": depth}
+
+
+def export_xgb(model):
+    """Chỉ hỗ trợ objective hồi quy (reg:*) 1 output: prediction = base_score + tổng giá trị lá."""
+    dump = json.loads(model.get_booster().save_raw(raw_format="json"))
+    learner = dump["learner"]
+    base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+    trees = []
+    for tree in learner["gradient_booster"]["model"]["trees"]:
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        # Node lá: split_conditions chính là giá trị lá
+        trees.append((tree["left_children"], tree["right_children"], tree["split_indices"], conditions, conditions))
+    arrays, depth = _flatten_trees(trees)
+    return arrays, {"kind": "trees", "split": "lt", "aggregate": "sum", "depth": depth, "base_score": base_score}
+
+
+def export_mlp(mlp, dtype=np.float64):
+    arrays = {}
+    for i, (coef, intercept) in enumerate(zip(mlp.coefs_, mlp.intercepts_)):
+        arrays[f"coef_{i}"] = np.asarray(coef, dtype=dtype)
+        arrays[f"intercept_{i}"] = np.asarray(intercept, dtype=dtype)
+    return arrays, {"kind": "mlp", "n_layers": len(mlp.coefs_), "activation": mlp.activation}
+
+
+def export_linear(model):
+    arrays = {"coef": np.asarray(model.coef_, dtype=np.float64).ravel(),
+              "intercept": np.asarray(model.intercept_, dtype=np.float64).reshape(1)}
+    return arrays, {"kind": "linear"}
+
+
+def _save_array(path, array):
+    # Thư mục version mới, chưa process nào đọc -> ghi thẳng
+    np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(_version_dir(directory, manifest), MANIFEST)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _version_dir(directory, manifest):
+    """Thư mục chứa mảng của manifest (layout cũ không có "version": chính directory)."""
+    return os.path.join(directory, manifest["version"]) if manifest.get("version") else directory
+
+
+def _switch_current(directory, version):
+    """Trỏ CURRENT sang version mới (os.replace = atomic), xóa các version cũ ngoài KEEP_VERSIONS."""
+    path = os.path.join(directory, CURRENT)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    # Process khác có thể vừa đọc CURRENT cũ -> giữ vài version trước; file đang mmap vẫn đọc được sau khi xóa
+    versions = sorted(name for name in os.listdir(directory)
+                      if name.startswith("v") and os.path.isdir(os.path.join(directory, name)))
+    for name in versions[:-KEEP_VERSIONS]:
+        if name != version:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def artifact_exists(directory=COMPACT_DIR):
+    return (os.path.exists(os.path.join(directory, CURRENT))
+            or os.path.exists(os.path.join(directory, MANIFEST)))
+
+
+def export_ensemble(ensemble, scaler, directory=COMPACT_DIR, float32=False, max_depth=None, eval_X=None):
+    """
+    Ghi ensemble + scaler ra version mới trong `directory` rồi trỏ CURRENT sang. float32: lượng tử hóa threshold/value của RandomForest
+    và trọng số MLP; max_depth: cắt cây RandomForest. Có eval_X (đã scale) thì so prediction với
+    model gốc và ghi độ lệch vào manifest["accuracy"].
+    """
+    version = f"v{datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}"
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+    dtype = np.float32 if float32 else np.float64
+    exported = {
+        "RandomForest": export_forest(ensemble.rf_model, dtype, max_depth),
+        "XGBoost": export_xgb(ensemble.xgb_model),
+        "MLP": export_mlp(ensemble.mlp_model, dtype),
+        "Scaler": ({"mean": np.asarray(scaler.mean_, dtype=np.float64),
+                    "scale": np.asarray(scaler.scale_, dtype=np.float64)}, {"kind": "scaler"}),
+    }
+    if getattr(ensemble, "has_lr", False):
+        exported["LinearRegression"] = export_linear(ensemble.lr_model)
+
+    models = {}
+    for name, (arrays, meta) in exported.items():
+        files = {}
+        for key, array in arrays.items():
+            filename = f"{name}.{key}.npy"
+            _save_array(os.path.join(version_dir, filename), array)
+            files[key] = filename
+        models[name] = dict(meta, files=files, bytes=int(sum(a.nbytes for a in arrays.values())))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "float32": float32,
+        "max_depth": max_depth,
+        "models": models,
+        "model_scores": dict(ensemble.model_scores),
+        "outlier_threshold": ensemble.outlier_threshold,
+    }
+    if eval_X is not None:
+        manifest["accuracy"] = compare_predictions(ensemble, load_models(directory, manifest), eval_X)
+    _write_manifest(directory, manifest)
+    _switch_current(directory, version)
+    return manifest
+
+
+def compare_predictions(ensemble, compact_models, X):
+    """Độ lệch giữa model gốc và bản compact trên X (đã scale): max/mean |Δ| theo kWh."""
+    result = {}
+    for name, (attr, _) in ENSEMBLE_MODELS.items():
+        if name not in compact_models:
+            continue
+        original = np.asarray(getattr(ensemble, attr).predict(X), dtype=np.float64)
+        delta = np.abs(compact_models[name].predict(X) - original)
+        result[name] = {"max_abs_delta": float(delta.max()), "mean_abs_delta": float(delta.mean()),
+                        "rows": int(len(X))}
+    return result
+
+
+# === LOAD ===
+
+def read_manifest(directory=COMPACT_DIR):
+    """Manifest của version CURRENT (layout cũ: directory/manifest.json)."""
+    path = directory
+    try:
+        with open(os.path.join(directory, CURRENT), encoding="utf-8") as f:
+            path = os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        pass
+    with open(os.path.join(path, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compact model format: {manifest.get('format')}")
+    return manifest
+
+
+def load_model(directory, name, manifest=None, mmap=True):
+    manifest = manifest or read_manifest(directory)
+    meta = manifest["models"][name]
+    path = _version_dir(directory, manifest)
+    arrays = {key: np.load(os.path.join(path, filename), mmap_mode='r' if mmap else None)
+              for key, filename in meta["files"].items()}
+    return _PREDICTORS[meta["kind"]](arrays, meta)
+
+
+def load_models(directory=COMPACT_DIR, manifest=None, mmap=True):
+    manifest = manifest or read_manifest(directory)
+    return {name: load_model(directory, name, manifest, mmap) for name in manifest["models"]}
+
+
+class CompactEnsemble(ModelEnsemble):
+    """ModelEnsemble đọc từ artifact compact (predict_best/update_scores... giữ nguyên)."""
+
+    def __init__(self, directory=COMPACT_DIR):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        models = load_models(directory, self.manifest)
+        for name, (attr, _) in ENSEMBLE_MODELS.items():
+            if name in models:
+                setattr(self, attr, models[name])
+        self.has_lr = "LinearRegression" in models
+        self.scaler = models["Scaler"]
+        self.model_scores = dict(self.manifest["model_scores"])
+        self.outlier_threshold = self.manifest["outlier_threshold"]
+
+    def save_scores(self):
+        """Ghi model_scores (học từ feedback) vào manifest thay cho joblib.dump cả ensemble."""
+        self.manifest["model_scores"] = dict(self.model_scores)
+        _write_manifest(self.directory, self.manifest)
+
+    def __reduce__(self):
+        # Pickle chỉ giữ đường dẫn, không copy mảng memmap vào file
+        return (CompactEnsemble, (self.directory,))
+
+
+# === REPORT ===
+
+def _memory_mb():
+    """(RSS, phần private) của process hiện tại; page mmap file-backed là phần shared."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+        return round(fields["Rss"] / 1024, 1), round(private / 1024, 1)
+    except (OSError, KeyError):
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), None
+
+
+def _measure_load(kind, name, directory, n_rows):
+    """Chạy trong process mới: load 1 model (pickle hoặc compact), predict 1 lần, đo thời gian và RSS."""
+    rss_before, private_before = _memory_mb()
+    start = time.perf_counter()
+    if kind == "pickle":
+        model = joblib.load(ENSEMBLE_MODELS[name][1])
+    else:
+        model = load_model(directory, name)
+    load_seconds = time.perf_counter() - start
+
+    X = np.random.RandomState(0).normal(size=(n_rows, 8))
+    start = time.perf_counter()
+    model.predict(X)
+    predict_seconds = time.perf_counter() - start
+
+    rss_after, private_after = _memory_mb()
+    return {
+        "load_ms": round(load_seconds * 1000, 2),
+        "first_predict_ms": round(predict_seconds * 1000, 2),
+        "rss_mb": round(rss_after - rss_before, 1),
+        "private_mb": round(private_after - private_before, 1) if private_after is not None else None,
+    }
+
+
+def report(directory=COMPACT_DIR, n_rows=1):
+    manifest = read_manifest(directory)
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for name, (_, pickle_path) in ENSEMBLE_MODELS.items():
+        if name not in manifest["models"] or not os.path.exists(pickle_path):
+            continue
+        compact_bytes = sum(os.path.getsize(os.path.join(_version_dir(directory, manifest), f))
+                            for f in manifest["models"][name]["files"].values())
+        row = {"model": name, "pickle_mb": round(os.path.getsize(pickle_path) / 1e6, 2),
+               "compact_mb": round(compact_bytes / 1e6, 2)}
+        for kind in ("pickle", "compact"):
+            # Mỗi lần đo 1 process mới để RSS không bị lẫn giữa các model
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                stats = pool.submit(_measure_load, kind, name, directory, n_rows).result()
+            row.update({f"{kind}_{key}": value for key, value in stats.items()})
+        rows.append(row)
+    return rows
+
+
+def load_eval_set(max_rows=2000):
+    """Tập kiểm tra (đã scale) để đo độ lệch: 10% cuối dữ liệu UCI, giống lúc train."""
+    from train_forecast_models import create_features, load_uci_hourly
+    features = create_features(load_uci_hourly())
+    cols = ['hour', 'dayofweek', 'month', 'is_weekend',
+            'kwh_lag_24h', 'kwh_lag_48h', 'kwh_lag_168h', 'kwh_rolling_mean_24h']
+    holdout = features[cols].iloc[int(len(features) * 0.9):].iloc[-max_rows:]
+    return joblib.load("scaler.pkl").transform(holdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact memory-mappable model artifacts")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="write ensemble_model.pkl + scaler.pkl as a compact artifact")
+    export_cmd.add_argument("--out", default=COMPACT_DIR)
+    export_cmd.add_argument("--float32", action="store_true", help="quantize RandomForest/MLP arrays to float32")
+    export_cmd.add_argument("--max-depth", type=int, default=None, help="prune RandomForest trees to this depth")
+    report_cmd = sub.add_parser("report", help="size / load time / RSS per model, pickle vs compact")
+    report_cmd.add_argument("--dir", default=COMPACT_DIR)
+    report_cmd.add_argument("--rows", type=int, default=1, help="rows for the first predict call")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        ensemble = joblib.load("ensemble_model.pkl")
+        try:
+            eval_X = load_eval_set()
+        except FileNotFoundError:
+            eval_X = None
+            print("household_power_consumption.txt not found, skipping accuracy check")
+        manifest = export_ensemble(ensemble, joblib.load("scaler.pkl"), args.out,
+                                   float32=args.float32, max_depth=args.max_depth, eval_X=eval_X)
+        for name, meta in manifest["models"].items():
+            line = f"{name:<17} {meta['bytes'] / 1e6:8.2f} MB"
+            accuracy = manifest.get("accuracy", {}).get(name)
+            if accuracy:
+                line += f"   max|Δ| {accuracy['max_abs_delta']:.6f} kWh   mean|Δ| {accuracy['mean_abs_delta']:.6f} kWh"
+            print(line)
+        print(f"Written to {args.out}")
+    else:
+        rows = report(args.dir, args.rows)
+        json.dump(rows, sys.stdout, indent=2)
+        print()
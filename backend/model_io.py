@@ -0,0 +1,17 @@
+# model_io.py
+# Ghi file model an toàn khi process khác đang đọc / process ghi bị dừng giữa chừng.
+import os
+
+import joblib
+
+
+def atomic_dump(obj, path):
+    """joblib.dump ra file tạm cùng thư mục rồi os.replace -> không bao giờ để lại file .pkl dở dang."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
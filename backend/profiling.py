@@ -0,0 +1,185 @@
+# profiling.py
+# Profile theo yêu cầu (cProfile) cho các đoạn code nóng, bật/tắt lúc đang chạy:
+#
+#   profiler = Profiler("profiles")
+#   profiler.instrument("ingest", stage, "handler")     # lúc khởi tạo
+#   with profiler.section("forecast"): ...              # hoặc quanh 1 đoạn code
+#   profiler.start("ingest", seconds=30)                # admin endpoint / control message
+#   profiler.start("forecast", calls=3)
+#
+# instrument(): chỉ thay obj.attr bằng hàm có profile trong lúc capture chạy, xong thì
+# trả lại hàm gốc -> khi tắt không tốn gì. section() khi tắt chỉ tốn 1 lần kiểm tra dict.
+# Mỗi thread có 1 cProfile.Profile riêng, gộp lại khi kết thúc và ghi:
+#   profiles/<name>-<timestamp>.prof  (pstats: snakeviz, `flameprof x.prof > x.svg`, gprof2dot)
+#   profiles/<name>-<timestamp>.txt   (top hàm theo cumulative time)
+# Mỗi capture bị giới hạn PROFILE_MAX_SECONDS giây (kể cả khi chỉ đặt calls) và PROFILE_MAX_CALLS lần gọi.
+import contextlib
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_MAX_CALLS = int(os.getenv("PROFILE_MAX_CALLS", "10000"))
+
+
+class _Capture:
+    def __init__(self, name, calls, seconds):
+        self.name = name
+        self.calls_left = calls
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.calls = 0
+        self.started_at = datetime.now()
+        self.profiles = {}   # thread id -> cProfile.Profile
+        self.lock = threading.Lock()
+        self.timer = None
+        self.originals = []  # (obj, attr, hàm gốc) để trả lại khi kết thúc
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class Profiler:
+    def __init__(self, output_dir="profiles", top=40):
+        self.output_dir = output_dir
+        self.top = top
+        self._lock = threading.Lock()
+        self._active = {}      # name -> _Capture
+        self._local = threading.local()
+        self._targets = {}     # name -> [(obj, attr)] đăng ký qua instrument()
+        self.last_results = {}  # name -> thông tin file của capture gần nhất
+
+    def instrument(self, name, obj, attr):
+        """Đăng ký obj.attr (hàm sync) để được profile khi capture `name` chạy."""
+        self._targets.setdefault(name, []).append((obj, attr))
+
+    def start(self, name, calls=None, seconds=None):
+        """Bắt đầu capture cho N lần gọi tiếp theo (calls) hoặc trong N giây (seconds)."""
+        if not calls and not seconds:
+            raise ValueError("calls or seconds is required")
+        if (seconds and not 0 < seconds <= PROFILE_MAX_SECONDS) or (calls and not 0 < calls <= PROFILE_MAX_CALLS):
+            raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}], calls in (0, {PROFILE_MAX_CALLS}]")
+        # Chỉ đặt calls: vẫn dừng sau PROFILE_MAX_SECONDS nếu chưa đủ số lần gọi
+        seconds = seconds or PROFILE_MAX_SECONDS
+        with self._lock:
+            if name in self._active:
+                raise RuntimeError(f"Profiling '{name}' is already running")
+            capture = _Capture(name, calls, seconds)
+            self._active[name] = capture
+            for obj, attr in self._targets.get(name, []):
+                original = getattr(obj, attr)
+                capture.originals.append((obj, attr, original))
+                setattr(obj, attr, self._wrap(capture, original))
+        if seconds:
+            # Hết giờ thì ghi file kể cả khi không còn lần gọi nào
+            capture.timer = threading.Timer(seconds, self._finish, args=(capture,))
+            capture.timer.daemon = True
+            capture.timer.start()
+        logging.warning(f"Profiling '{name}' started (calls={calls}, seconds={seconds})")
+        return self.status()[name]
+
+    def status(self):
+        with self._lock:
+            active = dict(self._active)
+        result = {}
+        for name, capture in active.items():
+            result[name] = {
+                "running": True,
+                "calls": capture.calls,
+                "calls_left": capture.calls_left,
+                "seconds_left": round(max(0.0, capture.deadline - time.monotonic()), 1) if capture.deadline else None,
+                "started_at": capture.started_at.isoformat(timespec='seconds')
+            }
+        for name, info in self.last_results.items():
+            result.setdefault(name, dict(info, running=False))
+        return result
+
+    def _wrap(self, capture, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "depth", 0):
+                return fn(*args, **kwargs)
+            with _Section(self, capture):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def section(self, name):
+        """Context manager: `with profiler.section("forecast"): ...` (dùng được quanh await không suspend)."""
+        capture = self._active.get(name) if self._active else None
+        if capture is None or getattr(self._local, "depth", 0):
+            return contextlib.nullcontext()
+        return _Section(self, capture)
+
+    def _enter(self, capture):
+        thread_id = threading.get_ident()
+        with capture.lock:
+            profile = capture.profiles.get(thread_id)
+            if profile is None:
+                profile = capture.profiles[thread_id] = cProfile.Profile()
+        self._local.depth = 1
+        profile.enable()
+        return profile
+
+    def _exit(self, capture, profile):
+        profile.disable()
+        self._local.depth = 0
+        done = False
+        with capture.lock:
+            capture.calls += 1
+            if capture.calls_left is not None:
+                capture.calls_left -= 1
+                done = capture.calls_left <= 0
+        if done or capture.expired():
+            self._finish(capture)
+
+    def _finish(self, capture):
+        with self._lock:
+            if self._active.get(capture.name) is not capture:
+                return
+            del self._active[capture.name]
+            for obj, attr, original in capture.originals:
+                setattr(obj, attr, original)
+        if capture.timer is not None:
+            capture.timer.cancel()
+
+        with capture.lock:
+            profiles = list(capture.profiles.values())
+        info = {"calls": capture.calls, "started_at": capture.started_at.isoformat(timespec='seconds'),
+                "prof_file": None, "summary_file": None}
+        if profiles:
+            os.makedirs(self.output_dir, exist_ok=True)
+            base = os.path.join(self.output_dir, f"{capture.name}-{capture.started_at.strftime('%Y%m%d-%H%M%S')}")
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(base + ".prof")
+
+            summary = io.StringIO()
+            pstats.Stats(base + ".prof", stream=summary).sort_stats("cumulative").print_stats(self.top)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(f"{capture.name}: {capture.calls} calls, {len(profiles)} threads\n")
+                f.write(summary.getvalue())
+            info.update(prof_file=base + ".prof", summary_file=base + ".txt")
+        self.last_results[capture.name] = info
+        logging.warning(f"Profiling '{capture.name}' finished after {capture.calls} calls -> {info['prof_file']}")
+
+
+class _Section:
+    __slots__ = ("_profiler", "_capture", "_profile")
+
+    def __init__(self, profiler, capture):
+        self._profiler = profiler
+        self._capture = capture
+
+    def __enter__(self):
+        self._profile = self._profiler._enter(self._capture)
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler._exit(self._capture, self._profile)
+        return False
@@ -0,0 +1,272 @@
+# replay_telemetry.py
+# Phát lại logs/telemetry.log qua đúng ingest pipeline của app.py
+# (parse -> state -> alert / persist (process_new_energy) -> broadcast (Socket.IO)) để tái hiện lỗi
+# hoặc đo throughput:
+#
+#   python replay_telemetry.py                                   # logs/telemetry.log, tốc độ tối đa
+#   python replay_telemetry.py --speed realtime                  # đúng nhịp thời gian trong log
+#   python replay_telemetry.py --speed 60 --start 2025-11-02T00:00 --end 2025-11-03T00:00   # 1 ngày, nhanh 60x
+#   python replay_telemetry.py logs/telemetry.log.1 logs/telemetry.log --threshold 5 --output replay.json
+#
+# Đọc log theo từng dòng (không nạp cả file), mỗi dòng "Real-time telemetry/attribute" thành 1 frame
+# WebSocket CoreIoT; timestamp của ENERGY-Total lấy theo giờ ghi log. Dòng đã bị LOG_SAMPLE_RATE bỏ
+# lúc ghi thì không phát lại được (báo số dòng bị bỏ trong report).
+# App chạy trong thư mục tạm: SQLite/log riêng, RPC tắt (auto-shutdown chỉ được đếm), không shared
+# state, không gọi CoreIoT / forecast_server. Cuối cùng in frames/s, kWh theo giờ và phân bố thời
+# gian xử lý của từng stage (+ frame -> emit dashboard).
+import argparse
+import ast
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+LINE_RE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - \w+ - Real-time (telemetry|attribute) for (\S+): (.*?)"
+                     r"(?: \[\+(\d+) similar lines suppressed\])?$")
+PERCENTILES = (50, 90, 99)
+
+
+# --- Đọc log ---
+
+def iter_log_records(paths, start=None, end=None, stats=None):
+    """Stream (datetime, device_id, {key: value}) theo thứ tự các file trong `paths`."""
+    stats = stats if stats is not None else {}
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = LINE_RE.match(line.rstrip("\n"))
+                if not match:
+                    continue
+                logged_at, kind, device_id, payload, suppressed = match.groups()
+                ts = datetime.strptime(logged_at, LOG_TIME_FORMAT)
+                if (start and ts < start) or (end and ts >= end):
+                    continue
+                if suppressed:
+                    stats["suppressed_lines"] = stats.get("suppressed_lines", 0) + int(suppressed)
+                try:
+                    if kind == "telemetry":
+                        values = ast.literal_eval(payload)
+                    else:
+                        name, _, value = payload.partition(" = ")
+                        values = {name: value}
+                except (ValueError, SyntaxError):
+                    stats["unparsed_lines"] = stats.get("unparsed_lines", 0) + 1
+                    continue
+                yield ts, device_id, values
+
+
+def to_frame(subscription_id, ts, values):
+    """Record log -> message WebSocket CoreIoT như app nhận được ({"subscriptionId", "data": {key: [[ts_ms, value]]}})."""
+    ts_ms = int(time.mktime(ts.timetuple()) * 1000 + ts.microsecond // 1000)
+    return json.dumps({"subscriptionId": subscription_id,
+                       "data": {key: [[ts_ms, value]] for key, value in values.items()}})
+
+
+# --- Đo thời gian ---
+
+def summarize_latency(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    result = {"count": len(ordered), "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4)}
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 4)
+    result["max_ms"] = round(ordered[-1] * 1000, 4)
+    return result
+
+
+def instrument_stages(app):
+    """Bọc handler của mỗi stage để ghi thời gian xử lý (giây) -> {stage: array}."""
+    latencies = {}
+    for stage in app.ingest_pipeline.stages:
+        samples = latencies[stage.name] = array('d')
+        handler = stage.handler
+
+        def timed(item, handler=handler, samples=samples):
+            started = time.perf_counter()
+            try:
+                return handler(item)
+            finally:
+                samples.append(time.perf_counter() - started)
+        stage.handler = timed
+
+    emit_samples = latencies["frame_to_emit"] = array('d')
+    observe = app.dashboard_broadcaster._observe_latency
+
+    def observe_latency(seconds):
+        emit_samples.append(seconds)
+        if observe:
+            observe(seconds)
+    app.dashboard_broadcaster._observe_latency = observe_latency
+    return latencies
+
+
+def wait_for_drain(app, timeout=60):
+    """Đợi mọi stage xử lý hết (2 lần kiểm tra liên tiếp không còn item nào)."""
+    deadline = time.monotonic() + timeout
+    idle_checks = 0
+    while idle_checks < 2 and time.monotonic() < deadline:
+        busy = any(q.unfinished_tasks for stage in app.ingest_pipeline.stages for q in stage.queues)
+        idle_checks = 0 if busy else idle_checks + 1
+        time.sleep(0.02)
+    app.dashboard_broadcaster.flush()
+
+
+# --- Replay ---
+
+def import_app(workdir):
+    """Import app.py trong workdir với cấu hình 1 process, không shared state."""
+    os.chdir(workdir)
+    for key, value in (("JWT_TOKEN", "replay"), ("DEVICE_ID", "replay"), ("GROUP_ID", "replay")):
+        os.environ.setdefault(key, value)
+    # Chuỗi rỗng (không unset) để load_dotenv không lấy giá trị từ .env
+    os.environ.update(APP_ROLE="all", SHARED_STATE_URL="", SOCKETIO_MESSAGE_QUEUE="", FORECAST_PRECOMPUTE="0")
+    sys.path.insert(0, BACKEND_DIR)
+    import database
+    database.DB_PATH = os.path.join(workdir, "data", "replay.db")
+    import app
+    return app
+
+
+def replay(app, records, speed=None, threshold=None, progress_every=10000):
+    """
+    Đưa các record vào pipeline. speed: None = tối đa (chỉ bị giới hạn bởi backpressure
+    của stage parse), 1 = thời gian thực, k = nhanh k lần.
+    """
+    rpc_calls = []
+
+    def send_rpc_disabled(device_id, command, retries=3, deadline=None):
+        rpc_calls.append((device_id, command))
+        return True, {"status": "success", "device_id": device_id, "replay": True}
+    app.send_rpc_to_device = send_rpc_disabled
+
+    if threshold is not None:
+        app.alert_engine.set_threshold("replay", threshold)
+
+    latencies = instrument_stages(app)
+    app.ingest_pipeline.start()
+    app.dashboard_broadcaster.start()
+
+    subscriptions = {}
+    frames = 0
+    first_ts = last_ts = None
+    started = time.perf_counter()
+    for ts, device_id, values in records:
+        if device_id not in subscriptions:
+            subscriptions[device_id] = len(subscriptions) + 1
+            app.subscription_to_device_map[subscriptions[device_id]] = device_id
+        if first_ts is None:
+            first_ts = ts
+        if speed:
+            delay = (ts - first_ts).total_seconds() / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        app.parse_stage.put(to_frame(subscriptions[device_id], ts, values))
+        last_ts = ts
+        frames += 1
+        if progress_every and frames % progress_every == 0:
+            print(f"  {frames} frames, log time {ts}, {frames / (time.perf_counter() - started):.0f} frames/s")
+
+    fed_seconds = time.perf_counter() - started
+    wait_for_drain(app)
+    total_seconds = time.perf_counter() - started
+
+    hourly = dict(app.hourly_kwh_global.items()) if app.FORECAST_ENABLED else {}
+    return {
+        "frames": frames,
+        "devices": len(subscriptions),
+        "log_span": [first_ts.isoformat() if first_ts else None, last_ts.isoformat() if last_ts else None],
+        "speed": speed or "max",
+        "feed_seconds": round(fed_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "frames_per_second": round(frames / total_seconds, 1) if total_seconds else None,
+        "hourly_kwh": {key: round(kwh, 4) for key, kwh in sorted(hourly.items())},
+        "total_kwh": round(sum(hourly.values()), 4),
+        "rpc_calls": len(rpc_calls),
+        "stages": {name: summarize_latency(samples) for name, samples in latencies.items()},
+        "pipeline": app.ingest_pipeline.stats(),
+    }
+
+
+def print_report(report, show_hours=False):
+    print(f"\nReplayed {report['frames']} frames from {report['devices']} devices "
+          f"({report['log_span'][0]} -> {report['log_span'][1]}, speed {report['speed']})")
+    print(f"  {report['total_seconds']}s total -> {report['frames_per_second']} frames/s")
+    print(f"  {len(report['hourly_kwh'])} hours, {report['total_kwh']} kWh; auto-shutdown RPCs (disabled): {report['rpc_calls']}")
+    for key in ("suppressed_lines", "unparsed_lines"):
+        if report.get(key):
+            print(f"  {key}: {report[key]}")
+    if show_hours:
+        for key, kwh in report["hourly_kwh"].items():
+            print(f"    {key}  {kwh:.4f} kWh")
+    print(f"\n  {'stage':<14} {'count':>8} {'mean':>9} " + " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f" {'max':>9}  (ms)")
+    for name, stats in report["stages"].items():
+        if not stats["count"]:
+            continue
+        print(f"  {name:<14} {stats['count']:>8} {stats['mean_ms']:>9.3f} "
+              + " ".join(f"{stats[f'p{p}_ms']:>9.3f}" for p in PERCENTILES) + f" {stats['max_ms']:>9.3f}")
+    dropped = {name: stage["dropped"] for name, stage in report["pipeline"].items() if stage["dropped"]}
+    errors = {name: stage["errors"] for name, stage in report["pipeline"].items() if stage["errors"]}
+    if dropped or errors:
+        print(f"  dropped: {dropped}  errors: {errors}")
+
+
+def parse_speed(value):
+    if value == "max":
+        return None
+    if value == "realtime":
+        return 1.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be > 0, 'realtime' or 'max'")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay telemetry.log through the app ingest pipeline")
+    parser.add_argument("logs", nargs="*", default=[os.path.join(BACKEND_DIR, "logs", "telemetry.log")],
+                        help="log files, oldest first (default: logs/telemetry.log)")
+    parser.add_argument("--speed", type=parse_speed, default=None,
+                        help="'max' (default), 'realtime' or a factor, e.g. 60 = 60x faster than the log")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="replay from this log time (ISO)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="replay until this log time (ISO, exclusive)")
+    parser.add_argument("--threshold", type=float, help="alert threshold (A) of a virtual client, exercises alert/auto-shutdown")
+    parser.add_argument("--show-hours", action="store_true", help="print kWh per hour")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workdir (SQLite + logs)")
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(path) for path in args.logs]
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="smartplug-replay-")
+    cwd = os.getcwd()
+    try:
+        app = import_app(workdir)
+        stats = {}
+        report = replay(app, iter_log_records(paths, args.start, args.end, stats),
+                        speed=args.speed, threshold=args.threshold)
+        report.update(stats)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Workdir kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report, args.show_hours)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nSaved report to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# request_scheduler.py
+# Admission control cho forecast_server: việc nặng không chạy trên event loop mà trong các "lane",
+# mỗi lane = thread pool riêng + hàng đợi có giới hạn:
+#
+#   scheduler = RequestScheduler(REGISTRY)
+#   scheduler.add_lane("forecast", workers=2, max_queue=8)    # PredictToEndOfMonth / PredictBatch
+#   scheduler.add_lane("priority", workers=1, max_queue=64)   # Feedback, ReloadModels
+#   result = await scheduler.run("forecast", fn, *args)       # đầy -> raise Overloaded ngay
+#
+# Lane "priority" có worker riêng nên feedback không bao giờ phải xếp sau 1 loạt forecast;
+# event loop rảnh nên Health được trả lời ngay cả khi các worker forecast đều bận.
+# Overloaded.retry_after ước lượng từ số việc đang chờ x thời gian chạy trung bình của lane.
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Overloaded(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f"Lane '{lane}' is full, retry after {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self.pending = 0          # đang chạy + đang chờ (chỉ sửa trên event loop)
+        self.running = 0
+        self.avg_seconds = 1.0    # EWMA thời gian chạy 1 việc
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return max(self.pending - self.running, 0)
+
+    def retry_after(self):
+        """Số giây (làm tròn lên) tới khi lane có chỗ: việc đang chờ chia đều cho các worker."""
+        return max(1, math.ceil((self.waiting + 1) * self.avg_seconds / self.workers))
+
+    def status(self):
+        return {"Workers": self.workers, "MaxQueue": self.max_queue, "Running": self.running,
+                "Waiting": self.waiting, "Rejected": self.rejected, "AvgSeconds": round(self.avg_seconds, 3)}
+
+
+class RequestScheduler:
+    def __init__(self, registry=None):
+        self.lanes = {}
+        self._wait_seconds = None
+        if registry is not None:
+            registry.callback("forecast_server_queue_depth", "Requests waiting for a worker per lane", "gauge",
+                              lambda: {(name,): lane.waiting for name, lane in self.lanes.items()}, ("lane",))
+            registry.callback("forecast_server_lane_running", "Requests running per lane", "gauge",
+                              lambda: {(name,): lane.running for name, lane in self.lanes.items()}, ("lane",))
+            registry.callback("forecast_server_rejected_total", "Requests rejected because the lane was full",
+                              "counter", lambda: {(name,): lane.rejected for name, lane in self.lanes.items()},
+                              ("lane",))
+            self._wait_seconds = registry.histogram("forecast_server_queue_wait_seconds",
+                                                    "Time from admission to start of execution per lane",
+                                                    ("lane",), buckets=WAIT_BUCKETS)
+
+    def add_lane(self, name, workers, max_queue):
+        self.lanes[name] = Lane(name, max(1, workers), max(0, max_queue))
+        return self.lanes[name]
+
+    async def run(self, lane_name, fn, *args):
+        """Chạy fn(*args) trong lane (gọi từ event loop). Lane đầy -> Overloaded, không xếp hàng."""
+        lane = self.lanes[lane_name]
+        if lane.pending >= lane.workers + lane.max_queue:
+            lane.rejected += 1
+            raise Overloaded(lane_name, lane.retry_after())
+
+        lane.pending += 1
+        admitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            if self._wait_seconds is not None:
+                self._wait_seconds.observe(started - admitted, lane_name)
+            with lane._lock:
+                lane.running += 1
+            try:
+                return fn(*args)
+            finally:
+                seconds = time.perf_counter() - started
+                with lane._lock:
+                    lane.running -= 1
+                    lane.avg_seconds = 0.8 * lane.avg_seconds + 0.2 * seconds
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(lane.executor, job)
+        finally:
+            lane.pending -= 1
+
+    def status(self):
+        return {name: lane.status() for name, lane in self.lanes.items()}
@@ -0,0 +1,143 @@
+# response_cache.py
+import gzip
+import json
+import os
+import threading
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn: không có thì chỉ nén gzip
+    brotli = None
+
+# Body nhỏ hơn ngưỡng này (bytes) gửi nguyên, nén không đáng
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "6"))
+
+# Shape dạng cột cho time series: ?format=columnar hoặc Accept: application/vnd.columnar+json
+COLUMNAR_MIMETYPE = "application/vnd.columnar+json"
+
+
+def encode_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def wants_columnar():
+    """Request hiện tại muốn shape dạng cột? (?format= ưu tiên hơn header Accept)"""
+    shape = request.args.get('format')
+    if shape:
+        return shape == 'columnar'
+    return request.accept_mimetypes.best_match(['application/json', COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+
+class EncodedBody:
+    """
+    Body JSON đã encode + các bản nén (br/gzip), mỗi bản chỉ nén 1 lần khi client đầu tiên xin,
+    các request sau (cùng cache entry) dùng lại bytes đã nén.
+    """
+
+    def __init__(self, body):
+        self.identity = body
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.identity)
+
+    def get(self, encoding):
+        if encoding == "identity":
+            return self.identity
+        encoded = self._encoded.get(encoding)
+        if encoded is None:
+            with self._lock:
+                encoded = self._encoded.get(encoding)
+                if encoded is None:
+                    if encoding == "br":
+                        encoded = brotli.compress(self.identity, quality=BROTLI_QUALITY)
+                    else:
+                        encoded = gzip.compress(self.identity, compresslevel=GZIP_LEVEL, mtime=0)
+                    self._encoded[encoding] = encoded
+        return encoded
+
+
+def choose_encoding(size):
+    """Content-Encoding cho body `size` bytes theo Accept-Encoding (br > gzip khi cùng q)."""
+    if size < COMPRESS_MIN_BYTES:
+        return "identity"
+    available = ("br", "gzip") if brotli is not None else ("gzip",)
+    best, best_quality = "identity", 0
+    for encoding in available:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class VersionedSnapshot:
+    """
+    Snapshot dữ liệu kèm version: mỗi lần dữ liệu gốc đổi thì bump(),
+    lần đọc tiếp theo mới build + encode JSON lại. Các lần đọc còn lại chỉ
+    trả về bytes đã encode sẵn (O(1), không phụ thuộc số client).
+    version_source: nếu có, version lấy từ nguồn ngoài (vd: shared state) thay cho bump().
+    encode: data -> bytes (mặc định encode_json), vd: ghép các phần đã encode sẵn.
+    """
+
+    def __init__(self, builder, version_source=None, encode=encode_json):
+        self._builder = builder
+        self._version_source = version_source
+        self._encode = encode
+        self._lock = threading.Lock()
+        self.version = 0
+        self._cached = (-1, None, None)  # (version, data, body)
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    def current_version(self):
+        return self._version_source() if self._version_source else self.version
+
+    def get(self):
+        """Trả về (version, data, body_bytes)."""
+        cached = self._cached
+        version = self.current_version()
+        if cached[0] == version:
+            return cached
+
+        with self._lock:
+            version = self.current_version()
+            if self._cached[0] != version:
+                data = self._builder()
+                body = self._encode(data)
+                self._cached = (version, data, body)
+            return self._cached
+
+
+def make_cached_response(body, etag, vary_accept=False):
+    """
+    Response JSON từ bytes đã encode, hỗ trợ ETag / If-None-Match -> 304.
+    body là EncodedBody -> nén theo Accept-Encoding (ETag riêng cho mỗi encoding).
+    vary_accept: shape phụ thuộc header Accept (wants_columnar) -> thêm Vary: Accept.
+    """
+    encoding = "identity"
+    if isinstance(body, EncodedBody):
+        encoding = choose_encoding(len(body))
+        if encoding != "identity":
+            etag = f"{etag}-{encoding}"
+
+    quoted = f'"{etag}"'
+    if request.if_none_match and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body.get(encoding) if isinstance(body, EncodedBody) else body,
+                            mimetype='application/json')
+        if encoding != "identity":
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = quoted
+    response.headers['Cache-Control'] = 'no-cache'
+    vary = (["Accept"] if vary_accept else []) + (["Accept-Encoding"] if isinstance(body, EncodedBody) else [])
+    if vary:
+        response.headers['Vary'] = ", ".join(vary)
+    return response
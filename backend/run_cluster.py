@@ -0,0 +1,52 @@
+# run_cluster.py
+# Chạy 1 process ingest + N process API/Socket.IO trên các port liên tiếp.
+#
+#   SHARED_STATE_URL=redis://localhost:6379/0 SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 \
+#       python run_cluster.py --workers 4 --base-port 5001
+#
+# Đặt load balancer có sticky session (vd: nginx ip_hash) trước các port API:
+# Socket.IO long-polling cần mọi request của 1 client vào cùng 1 worker.
+# Process ingest vẫn mở port (base_port - 1) cho /control và health check nội bộ.
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ingest + API worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--base-port", type=int, default=5001)
+    args = parser.parse_args()
+
+    for name in ("SHARED_STATE_URL", "SOCKETIO_MESSAGE_QUEUE"):
+        if not os.getenv(name):
+            sys.exit(f"{name} is required for multi-process mode")
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    specs = [("ingest", args.base_port - 1)] + [("api", args.base_port + i) for i in range(args.workers)]
+    processes = []
+    for role, port in specs:
+        env = dict(os.environ, APP_ROLE=role, PORT=str(port))
+        processes.append(subprocess.Popen([sys.executable, app_path], env=env))
+        print(f"Started {role} worker on port {port}")
+
+    def stop(*_):
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while all(proc.poll() is None for proc in processes):
+        time.sleep(1)
+    print("A worker exited, shutting down cluster")
+    stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# shared_state.py
+# State dùng chung giữa process ingest và các worker API/Socket.IO (APP_ROLE=ingest|api).
+#
+# Mọi dữ liệu là các map tên -> {field: value JSON} kèm version counter theo tên map:
+#     devices            device_id -> {"telemetry", "attributes", "metadata"}
+#     thresholds         sid -> ngưỡng (A)
+#     predicted_details  timestamp -> chi tiết dự báo theo model (cho feedback)
+#     forecast           "latest" -> kết quả forecast mới nhất (forecast_store.py, APP_ROLE=api)
+# và counter riêng (vd: "hourly" tăng mỗi khi 1 giờ kWh được lưu vào SQLite).
+#
+# Backend: redis://... (cần package `redis`) hoặc sqlite:///path/to/file.db.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class SqliteSharedState:
+    """Stand-in dùng 1 file SQLite (WAL) cho các process trên cùng máy."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS shared_map (
+                name TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (name, field)
+            )""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS shared_counter (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )""")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _bump(conn, name):
+        conn.execute("""INSERT INTO shared_counter (name, value) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1""", (name,))
+
+    def put_map(self, name, mapping):
+        with self._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO shared_map (name, field, value) VALUES (?, ?, ?)",
+                             [(name, field, json.dumps(value)) for field, value in mapping.items()])
+            self._bump(conn, name)
+
+    def replace_map(self, name, mapping):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM shared_map WHERE name = ?", (name,))
+            conn.executemany("INSERT INTO shared_map (name, field, value) VALUES (?, ?, ?)",
+                             [(name, field, json.dumps(value)) for field, value in mapping.items()])
+            self._bump(conn, name)
+
+    def get_map(self, name):
+        rows = self._conn().execute("SELECT field, value FROM shared_map WHERE name = ?", (name,))
+        return {field: json.loads(value) for field, value in rows}
+
+    def delete_map_field(self, name, field):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM shared_map WHERE name = ? AND field = ?", (name, field))
+            self._bump(conn, name)
+
+    def pop_map_field(self, name, field):
+        with self._conn() as conn:
+            row = conn.execute("SELECT value FROM shared_map WHERE name = ? AND field = ?", (name, field)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM shared_map WHERE name = ? AND field = ?", (name, field))
+            self._bump(conn, name)
+            return json.loads(row[0])
+
+    def bump(self, name):
+        with self._conn() as conn:
+            self._bump(conn, name)
+
+    def version(self, name):
+        row = self._conn().execute("SELECT value FROM shared_counter WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+
+class RedisSharedState:
+    """Redis: mỗi map là 1 hash, version là 1 key INCR."""
+
+    def __init__(self, url, prefix="smartplug"):
+        if redis is None:
+            raise ImportError("SHARED_STATE_URL=redis://... requires the 'redis' package (pip install redis)")
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _map_key(self, name):
+        return f"{self._prefix}:map:{name}"
+
+    def _version_key(self, name):
+        return f"{self._prefix}:version:{name}"
+
+    def put_map(self, name, mapping):
+        if not mapping:
+            return
+        pipe = self._redis.pipeline()
+        pipe.hset(self._map_key(name), mapping={field: json.dumps(value) for field, value in mapping.items()})
+        pipe.incr(self._version_key(name))
+        pipe.execute()
+
+    def replace_map(self, name, mapping):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._map_key(name))
+        if mapping:
+            pipe.hset(self._map_key(name), mapping={field: json.dumps(value) for field, value in mapping.items()})
+        pipe.incr(self._version_key(name))
+        pipe.execute()
+
+    def get_map(self, name):
+        return {field.decode(): json.loads(value) for field, value in self._redis.hgetall(self._map_key(name)).items()}
+
+    def delete_map_field(self, name, field):
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._map_key(name), field)
+        pipe.incr(self._version_key(name))
+        pipe.execute()
+
+    def pop_map_field(self, name, field):
+        pipe = self._redis.pipeline()
+        pipe.hget(self._map_key(name), field)
+        pipe.hdel(self._map_key(name), field)
+        value, deleted = pipe.execute()
+        if not deleted:
+            return None
+        self._redis.incr(self._version_key(name))
+        return json.loads(value)
+
+    def bump(self, name):
+        self._redis.incr(self._version_key(name))
+
+    def version(self, name):
+        value = self._redis.get(self._version_key(name))
+        return int(value) if value else 0
+
+
+def create_shared_state(url):
+    """None -> chạy 1 process, state nằm trong biến module như cũ."""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSharedState(url)
+    if url.startswith("sqlite:///"):
+        return SqliteSharedState(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+class SharedStatePublisher:
+    """
+    Ingest đánh dấu thiết bị thay đổi; thread nền ghi gộp các thiết bị đó vào
+    shared state mỗi `interval` giây (1 transaction / 1 pipeline cho cả lô).
+    """
+
+    def __init__(self, state, get_entry, interval=0.2, map_name="devices"):
+        self._state = state
+        self._get_entry = get_entry
+        self.interval = interval
+        self.map_name = map_name
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def mark_dirty(self, device_id):
+        with self._lock:
+            self._dirty.add(device_id)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self._state.put_map(self.map_name, {device_id: self._get_entry(device_id) for device_id in dirty})
+        return len(dirty)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="shared-state-publisher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Shared state publish error: {e}")
+            time.sleep(self.interval)
@@ -0,0 +1,50 @@
+# startup.py
+# Đo thời gian khởi động, tính từ lúc process bắt đầu (gồm cả thời gian import):
+#
+#   startup = StartupTimer(REGISTRY)        # metric process_startup_seconds{phase=...}
+#   startup.mark("listening")
+#   startup.mark("models_ready")
+#   startup.mark("first_request")           # chỉ lần đầu được ghi, các lần sau trả về giá trị cũ
+import logging
+import os
+import threading
+import time
+
+_IMPORTED_AT = time.time()
+
+
+def process_started_at():
+    """Epoch lúc process bắt đầu (Linux: /proc/self/stat); không có /proc thì lấy lúc import module này."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        # field 22 (starttime, tính bằng clock tick từ lúc boot); sau "(comm)" bắt đầu từ field 3
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _IMPORTED_AT
+
+
+class StartupTimer:
+    def __init__(self, registry=None, log=logging.info):
+        self.started_at = process_started_at()
+        self.phases = {}
+        self._lock = threading.Lock()
+        self._log = log
+        if registry is not None:
+            registry.callback("process_startup_seconds", "Seconds from process start to each startup phase",
+                              "gauge", lambda: {(phase,): seconds for phase, seconds in self.phases.items()},
+                              ("phase",))
+
+    def mark(self, phase):
+        """Ghi mốc `phase` (1 lần) -> số giây từ lúc process bắt đầu."""
+        with self._lock:
+            if phase in self.phases:
+                return self.phases[phase]
+            seconds = self.phases[phase] = round(time.time() - self.started_at, 3)
+        self._log(f"Startup: {phase} after {seconds:.2f}s")
+        return seconds
+
+    def uptime(self):
+        return round(time.time() - self.started_at, 1)
@@ -6,8 +6,20 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LinearRegression
 from sklearn.neural_network import MLPRegressor
 import xgboost as xgb
-import joblib
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.metrics import r2_score
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # threadpoolctl đi kèm scikit-learn, chỉ phòng khi thiếu
+    threadpool_limits = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from direct_forecast import DIRECT_FEATURES, MAX_HORIZON, DIRECT_MODEL_PATH, make_training_set
+from model_io import atomic_dump
 
 def create_features(df):
     df = df.copy()
@@ -21,7 +33,160 @@ def create_features(df):
     df['kwh_rolling_mean_24h'] = df['kwh_hour'].shift(24).rolling(window=24).mean()
     return df.dropna()
 
-def train_all_models(use_personal_data=False):
+def train_direct_model(df_hourly, n_estimators=300, max_depth=6, learning_rate=0.05,
+                       origin_step=6, horizons_per_origin=48, n_jobs=-1):
+    """
+    Model dự báo trực tiếp (horizon là feature) cho strategy 'direct' của forecast_server.
+    Chia train/test theo thời gian của origin (10% origin cuối để test). Trả về R² trên tập test.
+    """
+    X, y, origins = make_training_set(df_hourly['kwh_hour'], origin_step=origin_step,
+                                      horizons_per_origin=horizons_per_origin)
+    split = np.quantile(origins, 0.9)
+    train, test = origins < split, origins >= split
+
+    model = xgb.XGBRegressor(
+        n_estimators=n_estimators,
+        learning_rate=learning_rate,
+        max_depth=max_depth,
+        random_state=42,
+        n_jobs=n_jobs
+    )
+    model.fit(X[train], y[train])
+    atomic_dump({"model": model, "features": DIRECT_FEATURES, "max_horizon": MAX_HORIZON}, DIRECT_MODEL_PATH)
+    return round(r2_score(y[test], model.predict(X[test])), 4)
+
+# === PARALLEL TRAINING ===
+# Mỗi model train trong 1 process riêng (process mới cho mỗi model -> đo được peak RSS của từng model)
+# với số core cố định; model chỉ ghi đè file cũ khi đã dump xong (tmp + os.replace).
+
+def build_xgb(n_jobs):
+    # [PRIORITY 1] XGBoost - Tốt nhất cho time series
+    return xgb.XGBRegressor(
+        n_estimators=300,      # Tăng từ 200
+        learning_rate=0.02,    # Giảm để học chậm hơn, chính xác hơn
+        max_depth=6,           # Thêm depth
+        random_state=42,
+        n_jobs=n_jobs
+    )
+
+def build_rf(n_jobs):
+    # [PRIORITY 2] Random Forest - Rất ổn định
+    return RandomForestRegressor(
+        n_estimators=100,      # Tăng từ 50
+        max_depth=15,          # Thêm depth
+        random_state=42,
+        n_jobs=n_jobs
+    )
+
+def build_mlp(n_jobs):
+    # [PRIORITY 3] MLP - Có thể học non-linear (1 core, BLAS bị giới hạn bởi threadpool_limits)
+    return MLPRegressor(
+        hidden_layer_sizes=(64, 32, 16),  # Thêm layers
+        max_iter=300,                      # Tăng iterations
+        activation='relu',
+        random_state=42,
+        early_stopping=True,
+        validation_fraction=0.1
+    )
+
+def build_lr(n_jobs):
+    # [OPTIONAL] Linear Regression - Chỉ để so sánh
+    return LinearRegression()
+
+# name -> (factory, file, trọng số chia core; 0 = chạy 1 core)
+MODEL_SPECS = {
+    "xgb": (build_xgb, "models/model_xgb.pkl", 3),
+    "rf": (build_rf, "models/model_rf.pkl", 3),
+    "direct": (None, DIRECT_MODEL_PATH, 2),
+    "mlp": (build_mlp, "models/model_mlp.pkl", 0),
+    "lr": (build_lr, "models/model_lr.pkl", 0),
+}
+
+def allocate_cores(names, total):
+    """Model 1 luồng nhận 1 core; phần còn lại chia cho model song song theo trọng số (ít nhất 1)."""
+    single = [name for name in names if MODEL_SPECS[name][2] == 0]
+    multi = [name for name in names if MODEL_SPECS[name][2] > 0]
+    budget = {name: 1 for name in single}
+    remaining = max(len(multi), total - len(single))
+    weight_sum = sum(MODEL_SPECS[name][2] for name in multi) or 1
+    for name in multi:
+        budget[name] = max(1, int(remaining * MODEL_SPECS[name][2] / weight_sum))
+    return budget
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: bytes
+    return round(peak / (1024 * 1024) if peak > 1 << 32 else peak / 1024, 1)
+
+def _train_one(name, n_jobs, data):
+    """Chạy trong worker process: fit 1 model với đúng n_jobs core, dump atomic, trả về thống kê."""
+    start = time.perf_counter()
+    limits = threadpool_limits(limits=n_jobs) if threadpool_limits else None
+    try:
+        if name == "direct":
+            score = train_direct_model(data, n_jobs=n_jobs)
+        else:
+            factory, path, _ = MODEL_SPECS[name]
+            X_train, X_test, y_train, y_test = data
+            model = factory(n_jobs)
+            model.fit(X_train, y_train)
+            atomic_dump(model, path)
+            score = round(model.score(X_test, y_test), 4)
+    finally:
+        if limits is not None:
+            limits.restore_original_limits()
+    return {"name": name, "score": score, "seconds": round(time.perf_counter() - start, 2),
+            "peak_rss_mb": _peak_rss_mb(), "cores": n_jobs}
+
+def train_models_parallel(tasks, cores=None, parallel=True):
+    """
+    tasks: {name trong MODEL_SPECS: data}. Các model độc lập train đồng thời, mỗi model
+    1 process với ngân sách core riêng (TRAIN_CORES, mặc định = số CPU).
+    Trả về {name: {"score", "seconds", "peak_rss_mb", "cores"}}.
+    """
+    cores = cores or int(os.getenv("TRAIN_CORES", str(os.cpu_count() or 1)))
+    budget = allocate_cores(list(tasks), cores)
+    # Model lâu nhất submit trước
+    order = sorted(tasks, key=lambda name: -MODEL_SPECS[name][2])
+    results = {}
+    started = time.perf_counter()
+
+    def report(result):
+        results[result["name"]] = result
+        print(f"  ✓ {result['name']:<6} R²={result['score']:<8} {result['seconds']:>7.2f}s  "
+              f"cores={result['cores']}  peak RSS={result['peak_rss_mb']} MB")
+
+    if not parallel or cores <= 1:
+        for name in order:
+            report(_train_one(name, budget[name], tasks[name]))
+    else:
+        workers = min(len(tasks), cores)
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+        except TypeError:  # Python < 3.11
+            pool = ProcessPoolExecutor(max_workers=workers)
+        with pool:
+            futures = [pool.submit(_train_one, name, budget[name], tasks[name]) for name in order]
+            for future in as_completed(futures):
+                report(future.result())
+
+    print(f"  Total wall time: {time.perf_counter() - started:.2f}s on {cores} cores "
+          f"(slowest model: {max(r['seconds'] for r in results.values()):.2f}s)")
+    return results
+
+def load_uci_hourly(path="household_power_consumption.txt"):
+    """UCI household power (phút) -> DataFrame kWh theo giờ (cột 'kwh_hour')."""
+    if not os.path.exists(path):
+        raise FileNotFoundError("Need household_power_consumption.txt")
+    df_raw = pd.read_csv(path, sep=';', na_values=['?'], low_memory=False)
+    df_raw['datetime'] = pd.to_datetime(df_raw['Date'] + ' ' + df_raw['Time'], dayfirst=True)
+    df_raw = df_raw.set_index('datetime').ffill()
+    df_hourly = df_raw['Global_active_power'].astype(float).resample('h').mean()
+    return df_hourly.to_frame(name='kwh_hour')
+
+def train_all_models(use_personal_data=False, parallel=True, cores=None):
     FEATURES = ['hour','dayofweek','month','is_weekend',
                 'kwh_lag_24h','kwh_lag_48h','kwh_lag_168h','kwh_rolling_mean_24h']
     TARGET = 'kwh_hour'
@@ -45,14 +210,7 @@ def train_all_models(use_personal_data=False):
         use_personal_data = False
 
     if not use_personal_data:
-        path = "household_power_consumption.txt"
-        if not os.path.exists(path):
-            raise FileNotFoundError("Need household_power_consumption.txt")
-        df_raw = pd.read_csv(path, sep=';', na_values=['?'], low_memory=False)
-        df_raw['datetime'] = pd.to_datetime(df_raw['Date'] + ' ' + df_raw['Time'], dayfirst=True)
-        df_raw = df_raw.set_index('datetime').ffill()
-        df_hourly = df_raw['Global_active_power'].astype(float).resample('h').mean()
-        df = df_hourly.to_frame(name='kwh_hour')
+        df = load_uci_hourly()
 
     df_features = create_features(df)
     X = df_features[FEATURES]
@@ -60,62 +218,18 @@ def train_all_models(use_personal_data=False):
 
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
-    joblib.dump(scaler, "scaler.pkl")
+    atomic_dump(scaler, "scaler.pkl")
 
     X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.1, shuffle=False)
     os.makedirs("models", exist_ok=True)
 
     print("\n🔨 Training models...")
-    
-    # [PRIORITY 1] XGBoost - Tốt nhất cho time series
-    print("  [1/4] Training XGBoost...")
-    model_xgb = xgb.XGBRegressor(
-        n_estimators=300,      # Tăng từ 200
-        learning_rate=0.02,    # Giảm để học chậm hơn, chính xác hơn
-        max_depth=6,           # Thêm depth
-        random_state=42, 
-        n_jobs=-1
-    )
-    model_xgb.fit(X_train, y_train)
-    joblib.dump(model_xgb, "models/model_xgb.pkl")
-    
-    # [PRIORITY 2] Random Forest - Rất ổn định
-    print("  [2/4] Training Random Forest...")
-    model_rf = RandomForestRegressor(
-        n_estimators=100,      # Tăng từ 50
-        max_depth=15,          # Thêm depth
-        random_state=42, 
-        n_jobs=-1
-    )
-    model_rf.fit(X_train, y_train)
-    joblib.dump(model_rf, "models/model_rf.pkl")
-    
-    # [PRIORITY 3] MLP - Có thể học non-linear
-    print("  [3/4] Training MLP...")
-    model_mlp = MLPRegressor(
-        hidden_layer_sizes=(64, 32, 16),  # Thêm layers
-        max_iter=300,                      # Tăng iterations
-        activation='relu',
-        random_state=42,
-        early_stopping=True,
-        validation_fraction=0.1
-    )
-    model_mlp.fit(X_train, y_train)
-    joblib.dump(model_mlp, "models/model_mlp.pkl")
-    
-    # [OPTIONAL] Linear Regression - Chỉ để so sánh
-    print("  [4/4] Training Linear Regression (baseline)...")
-    model_lr = LinearRegression()
-    model_lr.fit(X_train, y_train)
-    joblib.dump(model_lr, "models/model_lr.pkl")
-
-    # Evaluate
-    scores = {
-        "xgb": round(model_xgb.score(X_test, y_test), 4),
-        "rf": round(model_rf.score(X_test, y_test), 4),
-        "mlp": round(model_mlp.score(X_test, y_test), 4),
-        "lr": round(model_lr.score(X_test, y_test), 4),
-    }
+    split = (X_train, X_test, y_train, y_test)
+    tasks = {"xgb": split, "rf": split, "mlp": split, "lr": split,
+             # [DIRECT] 1 model cho mọi horizon -> forecast cả tháng bằng 1 lần predict
+             "direct": df}
+    results = train_models_parallel(tasks, cores=cores, parallel=parallel)
+    scores = {name: result["score"] for name, result in results.items()}
 
     print(f"\n TRAINING COMPLETE!")
     print(f" R² Scores:")
@@ -123,11 +237,18 @@ def train_all_models(use_personal_data=False):
     print(f"   RandomForest: {scores['rf']} ")
     print(f"   MLP:          {scores['mlp']} ")
     print(f"   LinearReg:    {scores['lr']}  (baseline)")
+    print(f"   Direct:       {scores['direct']}  (multi-horizon, FORECAST_STRATEGY=direct)")
     print(f"\nEnsemble will use: XGBoost + RandomForest (+ MLP if stable)")
     
     return scores
 
 if __name__ == "__main__":
-    train_all_models(use_personal_data=True)
+    import argparse
+    parser = argparse.ArgumentParser(description="Train forecast models")
+    parser.add_argument("--sequential", action="store_true", help="train models one after another in-process")
+    parser.add_argument("--cores", type=int, default=None, help="core budget (default: TRAIN_CORES or CPU count)")
+    args = parser.parse_args()
+
+    train_all_models(use_personal_data=True, parallel=not args.sequential, cores=args.cores)
     print("\n Creating ensemble model...")
     os.system("python run_ensemble.py")
\ No newline at end of file
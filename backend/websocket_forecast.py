@@ -15,6 +15,8 @@ class ForecastClient:
                     cls._instance = super().__new__(cls)
                     cls._instance.ws = None
                     cls._instance.connected = False
+                    # Mỗi lần chỉ 1 request/response trên connection dùng chung
+                    cls._instance._request_lock = threading.Lock()
         return cls._instance
 
     def connect(self):
@@ -39,6 +41,10 @@ class ForecastClient:
             return None
 
     def predict(self, history_dict, consumed_this_month):
+        with self._request_lock:
+            return self._predict(history_dict, consumed_this_month)
+
+    def _predict(self, history_dict, consumed_this_month):
         ws = self.connect()
         if not ws: return None
         
@@ -62,7 +68,27 @@ class ForecastClient:
             self._close_connection()
             return None
 
+    def predict_batch(self, series, include_details=False, timeout=120):
+        """
+        series: list {"Id", "History": {timestamp: kwh}, "ConsumedThisMonth"}.
+        Trả về response dạng cột của "PredictBatch" hoặc None.
+        """
+        payload = {
+            "Type": "PredictBatch",
+            "Series": [{
+                "Id": item["Id"],
+                "History": {k: float(v) for k, v in item["History"].items()},
+                "ConsumedThisMonth": round(float(item.get("ConsumedThisMonth", 0)), 4)
+            } for item in series],
+            "IncludeDetails": include_details
+        }
+        return self.send_control(payload, timeout=timeout)
+
     def send_feedback(self, predicted_details, actual_dict):
+        with self._request_lock:
+            return self._send_feedback(predicted_details, actual_dict)
+
+    def _send_feedback(self, predicted_details, actual_dict):
         ws = self.connect()
         if not ws: return False
         
@@ -85,6 +111,41 @@ class ForecastClient:
             self._close_connection()
             return False
 
+    def send_control(self, payload, timeout=10):
+        """Gửi message điều khiển (vd: {"Type": "Profile", ...}), trả về dict response hoặc None."""
+        with self._request_lock:
+            ws = self.connect()
+            if not ws: return None
+            try:
+                ws.send(json.dumps(payload))
+                ws.settimeout(timeout)
+                result = json.loads(ws.recv())
+                self._close_connection()
+                return result
+            except Exception as e:
+                logging.error(f"Control message error: {e}")
+                self._close_connection()
+                return None
+
+    def check_health(self, timeout=2):
+        """
+        {"Type": "Health"} qua 1 connection riêng (không đợi _request_lock, forecast dài không chặn
+        health check). Trả về dict readiness của forecast_server hoặc None.
+        """
+        ws = websocket.WebSocket()
+        try:
+            ws.connect("ws://127.0.0.1:8080", timeout=timeout)
+            ws.send(json.dumps({"Type": "Health"}))
+            return json.loads(ws.recv())
+        except Exception as e:
+            logging.debug(f"Forecast health check failed: {e}")
+            return None
+        finally:
+            try:
+                ws.close()
+            except:
+                pass
+
     def _close_connection(self):
         """Đóng connection"""
         self.connected = False
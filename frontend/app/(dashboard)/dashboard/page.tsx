@@ -43,6 +43,47 @@ export default function DashboardPage() {
     socket.emit("join_dashboard");
     console.log("Dashboard: Joined dashboard room");
 
+    // Extract changed fields from one device's (partial) data
+    const extractUpdates = (data: any): Partial<Device> => {
+      const updates: Partial<Device> = {};
+
+      // Extract telemetry data
+      const telemetry = data.telemetry || {};
+      if (telemetry["ENERGY-Power"] !== undefined && telemetry["ENERGY-Power"] !== "N/A") {
+        updates.power = parseFloat(telemetry["ENERGY-Power"]);
+      }
+      if (telemetry["ENERGY-Voltage"] !== undefined && telemetry["ENERGY-Voltage"] !== "N/A") {
+        updates.voltage = parseFloat(telemetry["ENERGY-Voltage"]);
+      }
+      if (telemetry["ENERGY-Current"] !== undefined && telemetry["ENERGY-Current"] !== "N/A") {
+        updates.current = parseFloat(telemetry["ENERGY-Current"]);
+      }
+      if (telemetry["ENERGY-Today"] !== undefined && telemetry["ENERGY-Today"] !== "N/A") {
+        updates.energyToday = parseFloat(telemetry["ENERGY-Today"]);
+      }
+      if (telemetry["ENERGY-Total"] !== undefined && telemetry["ENERGY-Total"] !== "N/A") {
+        updates.energyTotal = parseFloat(telemetry["ENERGY-Total"]);
+      }
+      if (telemetry["ENERGY-Factor"] !== undefined && telemetry["ENERGY-Factor"] !== "N/A") {
+        updates.powerFactor = parseFloat(telemetry["ENERGY-Factor"]);
+      }
+
+      // Extract attributes (POWER status)
+      const attributes = data.attributes || {};
+      if (attributes.POWER !== undefined && attributes.POWER !== "N/A") {
+        updates.isOn = attributes.POWER === "ON";
+        updates.status = updates.isOn ? "online" : "offline";
+      }
+
+      // Extract metadata if needed (name, type, location)
+      const metadata = data.metadata || {};
+      if (metadata.name) updates.name = metadata.name;
+      if (metadata.type) updates.type = metadata.type;
+      if (metadata.location) updates.location = metadata.location;
+
+      return updates;
+    };
+
     // Listen for realtime updates
     const handleDashboardUpdate = (payload: any) => {
       console.log("Dashboard update received:", payload);
@@ -57,58 +98,30 @@ export default function DashboardPage() {
             location: item.location,
             status: item.attributes?.POWER === "ON" ? "online" : "offline",
             isOn: item.attributes?.POWER === "ON",
-            power: parseFloat(item.telemetry?.["ENERGY-Power"] || "0"),
-            voltage: parseFloat(item.telemetry?.["ENERGY-Voltage"] || "0"),
-            current: parseFloat(item.telemetry?.["ENERGY-Current"] || "0"),
-            energyToday: parseFloat(item.telemetry?.["ENERGY-Today"] || "0"),
+            power: parseFloat(item.telemetry?.["ENERGY-Power"] ?? "0"),
+            voltage: parseFloat(item.telemetry?.["ENERGY-Voltage"] ?? "0"),
+            current: parseFloat(item.telemetry?.["ENERGY-Current"] ?? "0"),
+            energyToday: parseFloat(item.telemetry?.["ENERGY-Today"] ?? "0"),
           }));
           setDevices(updatedDevices);
         }
+        // Handle batched delta updates (only changed fields per device)
+        else if (Array.isArray(payload.updates)) {
+          const deltas = new Map<string, any>(
+            payload.updates.map((update: any) => [update.device_id, update.data])
+          );
+          setDevices((prev) =>
+            prev.map((device) =>
+              deltas.has(device.id) ? { ...device, ...extractUpdates(deltas.get(device.id)) } : device
+            )
+          );
+        }
         // Handle individual device update
         else if (payload.device_id && payload.data) {
           setDevices((prev) =>
-            prev.map((device) => {
-              if (device.id === payload.device_id) {
-                const updates: Partial<Device> = {};
-
-                // Extract telemetry data
-                const telemetry = payload.data.telemetry || {};
-                if (telemetry["ENERGY-Power"] !== undefined && telemetry["ENERGY-Power"] !== "N/A") {
-                  updates.power = parseFloat(telemetry["ENERGY-Power"]);
-                }
-                if (telemetry["ENERGY-Voltage"] !== undefined && telemetry["ENERGY-Voltage"] !== "N/A") {
-                  updates.voltage = parseFloat(telemetry["ENERGY-Voltage"]);
-                }
-                if (telemetry["ENERGY-Current"] !== undefined && telemetry["ENERGY-Current"] !== "N/A") {
-                  updates.current = parseFloat(telemetry["ENERGY-Current"]);
-                }
-                if (telemetry["ENERGY-Today"] !== undefined && telemetry["ENERGY-Today"] !== "N/A") {
-                  updates.energyToday = parseFloat(telemetry["ENERGY-Today"]);
-                }
-                if (telemetry["ENERGY-Total"] !== undefined && telemetry["ENERGY-Total"] !== "N/A") {
-                  updates.energyTotal = parseFloat(telemetry["ENERGY-Total"]);
-                }
-                if (telemetry["ENERGY-Factor"] !== undefined && telemetry["ENERGY-Factor"] !== "N/A") {
-                  updates.powerFactor = parseFloat(telemetry["ENERGY-Factor"]);
-                }
-
-                // Extract attributes (POWER status)
-                const attributes = payload.data.attributes || {};
-                if (attributes.POWER !== undefined && attributes.POWER !== "N/A") {
-                  updates.isOn = attributes.POWER === "ON";
-                  updates.status = updates.isOn ? "online" : "offline";
-                }
-
-                // Extract metadata if needed (name, type, location)
-                const metadata = payload.data.metadata || {};
-                if (metadata.name) updates.name = metadata.name;
-                if (metadata.type) updates.type = metadata.type;
-                if (metadata.location) updates.location = metadata.location;
-
-                return { ...device, ...updates };
-              }
-              return device;
-            })
+            prev.map((device) =>
+              device.id === payload.device_id ? { ...device, ...extractUpdates(payload.data) } : device
+            )
           );
         }
       } catch (error) {
@@ -116,10 +129,25 @@ export default function DashboardPage() {
       }
     };
 
+    // Kết quả từng thiết bị của lệnh bật/tắt tất cả (kể cả thiết bị còn "pending" khi HTTP đã trả về)
+    const handleGroupControlResult = (payload: any) => {
+      if (!payload.success) {
+        console.warn(`Group control ${payload.batch_id}: ${payload.device_id} failed`, payload.result);
+        return;
+      }
+      setDevices((prev) =>
+        prev.map((device) =>
+          device.id === payload.device_id ? { ...device, isOn: payload.command_sent === "ON" } : device
+        )
+      );
+    };
+
     socket.on("dashboard_update", handleDashboardUpdate);
+    socket.on("group_control_result", handleGroupControlResult);
 
     return () => {
       socket.off("dashboard_update", handleDashboardUpdate);
+      socket.off("group_control_result", handleGroupControlResult);
     };
   }, [socket, isConnected]);
 
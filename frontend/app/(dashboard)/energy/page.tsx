@@ -44,7 +44,7 @@ export default function EnergyPage() {
           console.log("Processing initial snapshot:", payload.data.length, "devices")
           const newMap = new Map<string, DeviceCurrentData>()
           payload.data.forEach((item: any) => {
-            const current = parseFloat(item.telemetry?.["ENERGY-Current"] || "0")
+            const current = parseFloat(item.telemetry?.["ENERGY-Current"] ?? "0")
             newMap.set(item.id, {
               deviceId: item.id,
               deviceName: item.name,
@@ -54,26 +54,30 @@ export default function EnergyPage() {
           setDevicesCurrentData(newMap)
           console.log("Updated devices current data from snapshot")
         }
-        // Handle individual device update
-        else if (payload?.device_id && payload?.data) {
-          const current = payload.data.telemetry?.["ENERGY-Current"]
-          console.log(`Device ${payload.device_id} current update:`, current)
-
-          if (current !== undefined && current !== null) {
-            const value = Number(current) || 0
-            setDevicesCurrentData((prev) => {
-              const newMap = new Map(prev)
-              const existing = newMap.get(payload.device_id)
-              const deviceName = payload.data.metadata?.name || existing?.deviceName || "Unknown Device"
-              newMap.set(payload.device_id, {
-                deviceId: payload.device_id,
+        // Handle batched delta updates and individual device updates
+        else if (Array.isArray(payload?.updates) || (payload?.device_id && payload?.data)) {
+          const updates: any[] = Array.isArray(payload.updates)
+            ? payload.updates
+            : [{ device_id: payload.device_id, data: payload.data }]
+          const changed = updates.filter(
+            (update) => update.data?.telemetry?.["ENERGY-Current"] !== undefined && update.data?.telemetry?.["ENERGY-Current"] !== null
+          )
+          if (changed.length === 0) return
+
+          setDevicesCurrentData((prev) => {
+            const newMap = new Map(prev)
+            changed.forEach((update) => {
+              const value = Number(update.data.telemetry["ENERGY-Current"]) || 0
+              const existing = newMap.get(update.device_id)
+              const deviceName = update.data.metadata?.name || existing?.deviceName || "Unknown Device"
+              newMap.set(update.device_id, {
+                deviceId: update.device_id,
                 deviceName: deviceName,
                 current: value
               })
-              console.log(`Updated device ${payload.device_id} (${deviceName}) current to ${value}A`)
-              return newMap
             })
-          }
+            return newMap
+          })
         }
       } catch (e) {
         console.error("Error processing dashboard_update in Energy page", e)
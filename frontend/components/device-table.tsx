@@ -63,7 +63,7 @@ export function DeviceTable() {
                       {device.attributes?.POWER === "ON" ? "online" : "offline"}
                     </span>
                   </td>
-                  <td className="px-6 py-4 text-sm text-gray-900">{device.telemetry?.["ENERGY-Power"] || "N/A"}</td>
+                  <td className="px-6 py-4 text-sm text-gray-900">{device.telemetry?.["ENERGY-Power"] ?? "N/A"}</td>
                   <td className="px-6 py-4 text-sm">
                     <button
                       onClick={() => handleTogglePower(device.id, device.attributes?.POWER === "ON")}
@@ -2,6 +2,7 @@
 
 import { useEffect, useState } from "react"
 import { Loader2, Zap } from "lucide-react"
+import { useSocket } from "@/context/SocketContext"
 
 // Định nghĩa kiểu dữ liệu trả về từ Server AI
 interface ForecastData {
@@ -10,13 +11,29 @@ interface ForecastData {
     tong_kwh_ca_thang: number
 }
 
+// Payload 'forecast_result' (room 'forecast') khi forecast job kết thúc
+interface ForecastJobResult {
+    job_id: string
+    status: "running" | "done" | "error"
+    error?: string
+    result?: {
+        PredictedBillVND: number
+        TotalKwhForecasted: number
+        TotalKwhMonth: number
+    }
+}
+
 const AI_SERVER_URL = "http://localhost:5000"
 const STORAGE_KEY = "ai_forecast_result" // session storage
+const FORECAST_BUDGET_MS = 3000 // quá hạn thì backend trả ước tính nhanh (degraded)
 
 export function AIPredictEnergy() {
     const [forecastData, setForecastData] = useState<ForecastData | null>(null)
     const [isForecasting, setIsForecasting] = useState(false)
     const [forecastStatus, setForecastStatus] = useState<string>("")
+    // Job ensemble còn chạy sau khi nhận ước tính nhanh (degraded); xong thì thay kết quả
+    const [pendingJobId, setPendingJobId] = useState<string | null>(null)
+    const { socket, isConnected } = useSocket()
 
     // Kiểm tra xem trong session có dữ liệu cũ không
     useEffect(() => {
@@ -31,13 +48,49 @@ export function AIPredictEnergy() {
         }
     }, [])
 
+    useEffect(() => {
+        if (!socket || !isConnected || !pendingJobId) return
+
+        const applyJobResult = (job: ForecastJobResult) => {
+            if (job.job_id !== pendingJobId) return
+            if (job.status === "done" && job.result) {
+                const data: ForecastData = {
+                    tien_can_tra_vnd: job.result.PredictedBillVND,
+                    tong_kwh_du_doan_duoc: job.result.TotalKwhForecasted,
+                    tong_kwh_ca_thang: job.result.TotalKwhMonth,
+                }
+                setForecastData(data)
+                setForecastStatus("Dự báo thành công!")
+                sessionStorage.setItem(STORAGE_KEY, JSON.stringify(data))
+                setPendingJobId(null)
+            } else if (job.status === "error") {
+                setForecastStatus(`Ước tính nhanh (AI Server lỗi: ${job.error ?? "không rõ"}).`)
+                setPendingJobId(null)
+            }
+        }
+
+        socket.on("forecast_result", applyJobResult)
+        socket.emit("join_forecast")
+
+        // Job có thể đã xong trước khi join room -> hỏi trạng thái 1 lần
+        fetch(`${AI_SERVER_URL}/forecast/jobs/${pendingJobId}`)
+            .then((res) => (res.ok ? res.json() : null))
+            .then((job: ForecastJobResult | null) => job && applyJobResult(job))
+            .catch((e) => console.error("Lỗi lấy trạng thái forecast job", e))
+
+        return () => {
+            socket.off("forecast_result", applyJobResult)
+        }
+    }, [socket, isConnected, pendingJobId])
+
     const handleRunForecast = async () => {
         setIsForecasting(true)
         setForecastStatus("Đang gửi dữ liệu sang AI Server...")
         setForecastData(null) // Reset giao diện
+        setPendingJobId(null)
 
         try {
-            const res = await fetch(`${AI_SERVER_URL}/forecast`)
+            const res = await fetch(`${AI_SERVER_URL}/forecast?budget_ms=${FORECAST_BUDGET_MS}`)
             const result = await res.json()
 
             if (res.ok) {
@@ -47,10 +100,16 @@ export function AIPredictEnergy() {
 
                 if (dataSummary.status === "success") {
                     setForecastData(dataSummary.data)
-                    setForecastStatus("Dự báo thành công!")
-
-                    //Lưu kết quả vào sessionStorage
-                    sessionStorage.setItem(STORAGE_KEY, JSON.stringify(dataSummary.data))
+                    if (dataSummary.degraded) {
+                        // Ước tính nhanh, chưa lưu cache: kết quả AI đầy đủ tới qua 'forecast_result' của job_id
+                        setForecastStatus("Ước tính nhanh (AI Server chậm), kết quả đầy đủ sẽ cập nhật sau.")
+                        if (result.job_id) setPendingJobId(result.job_id)
+                    } else {
+                        setForecastStatus("Dự báo thành công!")
+
+                        //Lưu kết quả vào sessionStorage
+                        sessionStorage.setItem(STORAGE_KEY, JSON.stringify(dataSummary.data))
+                    }
                 }
             } else {
                 setForecastStatus(`Lỗi: ${result.message}`)
@@ -59,7 +59,7 @@ export async function fetchDevices(): Promise<Device[]> {
         const metadata = deviceData?.metadata || {};
         const deviceId = deviceData?.id || `device-${index}`;
 
-        const voltage = parseFloat(telemetry["ENERGY-Voltage"] || "0");
+        const voltage = parseFloat(telemetry["ENERGY-Voltage"] ?? "0");
         const status = attributes.POWER === "ON" ? "online" : "offline";
         const isOn = attributes.POWER === "ON";
 
@@ -71,12 +71,12 @@ export async function fetchDevices(): Promise<Device[]> {
           isOn,
           location: metadata.location || deviceData.location || "",
           lastUpdate: new Date().toISOString(),
-          power: parseFloat(telemetry["ENERGY-Power"] || "0"),
+          power: parseFloat(telemetry["ENERGY-Power"] ?? "0"),
           voltage: voltage,
-          current: parseFloat(telemetry["ENERGY-Current"] || "0"),
-          energyToday: parseFloat(telemetry["ENERGY-Today"] || "0"),
-          energyTotal: parseFloat(telemetry["ENERGY-Total"] || "0"),
-          powerFactor: parseFloat(telemetry["ENERGY-Factor"] || "0"),
+          current: parseFloat(telemetry["ENERGY-Current"] ?? "0"),
+          energyToday: parseFloat(telemetry["ENERGY-Today"] ?? "0"),
+          energyTotal: parseFloat(telemetry["ENERGY-Total"] ?? "0"),
+          powerFactor: parseFloat(telemetry["ENERGY-Factor"] ?? "0"),
         };
       });
     }
@@ -96,9 +96,9 @@ export async function controlAllDevices(command: "ON" | "OFF"): Promise<Device[]
     })
     if (!response.ok) throw new Error("Failed to control devices")
     const data = await response.json()
-    // Return updated devices based on results
+    // Return updated devices based on results (thiết bị "pending" / lỗi cập nhật sau qua 'group_control_result')
     return (
-      data.results?.map((result: any) => ({
+      data.results?.filter((result: any) => result.status === "success").map((result: any) => ({
         id: result.device_id,
         isOn: command === "ON",
       })) || []